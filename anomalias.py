@@ -0,0 +1,117 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Linha de base: mediana do % Quebra nos meses anteriores da mesma filial e produto
+JANELA_BASE = 6
+MINIMO_HISTORICO = 3
+# Escore robusto (desvios em MAD) a partir do qual o mês vira alerta
+LIMITE_ESCORE = 3.5
+# Dispersão mínima, em pontos percentuais: séries quase constantes não geram escores enormes
+PISO_DISPERSAO = 1.0
+# Z da variação por amostragem: com poucas unidades no mês, o % Quebra oscila mesmo sem mudança real
+Z_AMOSTRAGEM = 1.0
+# Meses com menos unidades (quebra + vendidos) que isso não geram alerta
+MINIMO_UNIDADES = 20
+# Séries processadas por vez, para limitar a memória das janelas
+TAMANHO_LOTE = 5000
+
+COLUNAS_ALERTAS = ['Filial', 'Produto', 'Ano', 'Mes', 'Quebra', 'Vendidos', '% Quebra',
+                   '% Quebra esperada', 'Escore', 'Quebra excedente']
+
+
+def matriz_mensal(resumo):
+    """Quebra e Vendidos do resumo como matrizes (série x mês).
+
+    Cada série é um par (Filial, Produto); as colunas vão do primeiro ao
+    último mês do resumo, com NaN nos meses sem registro. Devolve
+    (chaves, primeiro_periodo, quebra, vendidos).
+    """
+    periodos = resumo['Ano'].to_numpy(dtype='int64') * 12 + resumo['Mes'].to_numpy(dtype='int64') - 1
+    codigos, chaves = pd.MultiIndex.from_arrays(
+        [resumo['Filial'].astype(str), resumo['Produto'].astype(str)]
+    ).factorize()
+    primeiro = int(periodos.min())
+    forma = (len(chaves), int(periodos.max()) - primeiro + 1)
+    quebra = np.full(forma, np.nan)
+    vendidos = np.full(forma, np.nan)
+    # O resumo tem uma linha por (Filial, Produto, mês): atribuição direta, sem laço
+    quebra[codigos, periodos - primeiro] = pd.to_numeric(resumo['Quebra'], errors='coerce').fillna(0).to_numpy()
+    vendidos[codigos, periodos - primeiro] = pd.to_numeric(resumo['Vendidos'], errors='coerce').fillna(0).to_numpy()
+    return chaves, primeiro, quebra, vendidos
+
+
+def _escores(taxa, unidades, janela, minimo_historico):
+    # Mediana e MAD das `janela` colunas anteriores a cada mês, para um lote de séries
+    anteriores = np.pad(taxa, ((0, 0), (janela, 0)), constant_values=np.nan)[:, :-1]
+    janelas = sliding_window_view(anteriores, janela, axis=1)
+    validos = (~np.isnan(janelas)).sum(axis=-1)
+    with warnings.catch_warnings():
+        # Janelas sem nenhum mês válido dão NaN, e são descartadas por `validos`
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mediana = np.nanmedian(janelas, axis=-1)
+        mad = np.nanmedian(np.abs(janelas - mediana[..., None]), axis=-1)
+    # Desvio binomial do % Quebra esperado para as unidades do mês (com uma unidade de folga:
+    # linha de base 0% não zera a variação)
+    n = np.maximum(unidades, 1)
+    p = (np.nan_to_num(mediana) / 100 * n + 1) / (n + 2)
+    amostragem = 100 * np.sqrt(p * (1 - p) / n)
+    escala = np.maximum(np.maximum(1.4826 * mad, PISO_DISPERSAO), Z_AMOSTRAGEM * amostragem)
+    escore = np.where(validos >= minimo_historico, (taxa - mediana) / escala, np.nan)
+    return mediana, escore
+
+
+def detectar_anomalias(resumo, janela=JANELA_BASE, limite=LIMITE_ESCORE, minimo_historico=MINIMO_HISTORICO,
+                       minimo_unidades=MINIMO_UNIDADES, desde=None):
+    """Meses com % Quebra anormalmente alto para a filial e o produto.
+
+    Compara cada mês com a mediana dos `janela` meses anteriores da mesma
+    série, em desvios absolutos medianos (escore robusto). Todas as filiais e
+    produtos passam de uma vez, em lotes de séries. `desde` (Timestamp)
+    limita os alertas devolvidos aos meses a partir dele.
+
+    Devolve os alertas do maior para o menor escore.
+    """
+    if resumo.empty:
+        return pd.DataFrame(columns=COLUNAS_ALERTAS)
+    chaves, primeiro, quebra, vendidos = matriz_mensal(resumo)
+    unidades = quebra + vendidos
+    with np.errstate(divide='ignore', invalid='ignore'):
+        taxa = np.where(unidades > 0, quebra / unidades * 100, np.nan)
+
+    inicio_colunas = 0
+    if desde is not None:
+        desde = pd.Timestamp(desde)
+        inicio_colunas = max(0, desde.year * 12 + desde.month - 1 - primeiro)
+
+    linhas, colunas, medianas, escores = [], [], [], []
+    for inicio in range(0, len(chaves), TAMANHO_LOTE):
+        lote = slice(inicio, inicio + TAMANHO_LOTE)
+        mediana, escore = _escores(taxa[lote], unidades[lote], janela, minimo_historico)
+        alerta = (escore >= limite) & (unidades[lote] >= minimo_unidades)
+        alerta[:, :inicio_colunas] = False
+        linha, coluna = np.nonzero(alerta)
+        linhas.append(linha + inicio)
+        colunas.append(coluna)
+        medianas.append(mediana[linha, coluna])
+        escores.append(escore[linha, coluna])
+    linhas, colunas = np.concatenate(linhas), np.concatenate(colunas)
+    mediana, escore = np.concatenate(medianas), np.concatenate(escores)
+
+    periodos = colunas + primeiro
+    alertas = pd.DataFrame({
+        'Filial': chaves.get_level_values(0)[linhas],
+        'Produto': chaves.get_level_values(1)[linhas],
+        'Ano': periodos // 12,
+        'Mes': periodos % 12 + 1,
+        'Quebra': quebra[linhas, colunas],
+        'Vendidos': vendidos[linhas, colunas],
+        '% Quebra': np.round(taxa[linhas, colunas], 2),
+        '% Quebra esperada': np.round(mediana, 2),
+        'Escore': np.round(escore, 1),
+        # Unidades perdidas acima do que a linha de base previa
+        'Quebra excedente': np.round(quebra[linhas, colunas] - mediana / 100 * unidades[linhas, colunas], 1),
+    })
+    return alertas.sort_values(['Escore', 'Quebra excedente'], ascending=False, kind='stable').reset_index(drop=True)
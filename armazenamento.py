@@ -0,0 +1,667 @@
+import json
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import precos
+import resumo_mensal
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+# pyarrow é opcional e pesado de importar: só entra quando o backend Parquet é usado
+pa = None
+pq = None
+
+ARQUIVO_DADOS = 'dados_quebras.csv'
+DIRETORIO_PARTICOES = 'particoes'
+DIRETORIO_PARQUET = 'particoes_parquet'
+
+# 'csv' (padrão), 'parquet' ou 'sqlite'
+VARIAVEL_BACKEND = 'CONTROLE_ARMAZENAMENTO'
+
+COLUNAS = ['ID', 'Data', 'Produto', 'Inicial', 'Vendidos', 'Quebra', '% Quebra', 'Estoque Final', 'Filial', 'Lucro Bruto']
+
+ARQUIVO_VERSAO = '_versao'
+ARQUIVO_RESUMO = '_resumo_mensal.csv'
+# Trava de escrita entre processos e registro do que cada versão alterou
+ARQUIVO_TRAVA = '_trava'
+ARQUIVO_ALTERACOES = '_alteracoes.jsonl'
+
+# Versões guardadas no registro de alterações; quem ficou mais para trás recarrega tudo
+MAXIMO_ALTERACOES = 1000
+
+# Partições mensais com menos linhas que isso são unidas no arquivo anual da filial
+LIMITE_COMPACTACAO = 1000
+
+
+def _nome_seguro(valor):
+    return re.sub(r'[^0-9A-Za-z_.-]', '_', str(valor).strip()) or '_'
+
+
+def _importar_pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("O backend Parquet precisa do pacote pyarrow (pip install pyarrow).")
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+class RegistroDesatualizado(ValueError):
+    def __init__(self):
+        super().__init__("O registro foi alterado ou excluído por outra sessão depois de lido. "
+                         "Confira os dados atuais e tente de novo.")
+
+
+def chaves_particoes(*dfs):
+    # (Filial, 'AAAA-MM') de cada linha: a unidade do registro de alterações
+    chaves = set()
+    for df in dfs:
+        if df is not None and not df.empty:
+            meses = pd.to_datetime(df['Data']).dt.strftime('%Y-%m')
+            chaves.update(zip(df['Filial'].astype(str), meses))
+    return sorted(chaves)
+
+
+def conferir_atuais(atual, antigos):
+    """Levanta RegistroDesatualizado se algum registro de `antigos` não está mais como foi lido.
+
+    `atual` é o conteúdo gravado agora; a comparação é pelo ID, com a mesma
+    tolerância de centavos usada no recálculo (o Parquet guarda float32).
+    """
+    if antigos.empty:
+        return
+    atual = atual.drop_duplicates('ID', keep='last').set_index(atual['ID'].astype(str).rename(None))
+    ids = antigos['ID'].astype(str)
+    if not ids.isin(atual.index).all():
+        raise RegistroDesatualizado()
+    atual = atual.loc[ids.to_numpy()]
+    iguais = np.ones(len(antigos), dtype=bool)
+    for coluna in COLUNAS[1:]:
+        if coluna not in antigos.columns:
+            continue
+        a, b = antigos[coluna], atual[coluna]
+        if coluna == 'Data':
+            iguais &= pd.to_datetime(a).to_numpy() == pd.to_datetime(b).to_numpy()
+        elif coluna in ('Produto', 'Filial'):
+            iguais &= a.astype(str).to_numpy() == b.astype(str).to_numpy()
+        else:
+            iguais &= np.isclose(pd.to_numeric(a, errors='coerce').to_numpy(dtype=float),
+                                 pd.to_numeric(b, errors='coerce').to_numpy(dtype=float),
+                                 rtol=0, atol=0.005, equal_nan=True)
+    if not iguais.all():
+        raise RegistroDesatualizado()
+
+
+def novos_ids(quantidade):
+    # IDs aleatórios de 64 bits em hexadecimal: únicos sem precisar de contador compartilhado
+    valores = np.frombuffer(os.urandom(8 * quantidade), dtype='>u8')
+    return [f"{v:016x}" for v in valores]
+
+
+class ArmazenamentoParticionado:
+    """Dados de quebra gravados em um arquivo por filial e mês.
+
+    Layout: <diretorio>/<filial>/<AAAA-MM>.csv. Depois da compactação, meses
+    pequenos de uma filial passam a morar em <diretorio>/<filial>/<AAAA>.csv.
+    Cada (filial, mês) fica sempre em um único arquivo.
+    """
+
+    extensao = '.csv'
+
+    def __init__(self, diretorio=DIRETORIO_PARTICOES, arquivo_legado=ARQUIVO_DADOS):
+        self.diretorio = diretorio
+        self.arquivo_legado = arquivo_legado
+        self._trava = threading.RLock()
+        self._profundidade = 0
+
+    # ---------- trava de escrita ----------
+
+    @contextmanager
+    def escrita(self):
+        """Trava exclusiva do diretório, entre processos (vários workers do app, lote.py).
+
+        Reentrante no mesmo objeto: operações que chamam outras só travam uma vez.
+        """
+        with self._trava:
+            arquivo = None
+            if self._profundidade == 0:
+                os.makedirs(self.diretorio, exist_ok=True)
+                arquivo = open(os.path.join(self.diretorio, ARQUIVO_TRAVA), 'a')
+                if fcntl is not None:
+                    fcntl.flock(arquivo, fcntl.LOCK_EX)
+            self._profundidade += 1
+            try:
+                yield
+            finally:
+                self._profundidade -= 1
+                if arquivo is not None:
+                    # Fechar o arquivo solta a trava
+                    arquivo.close()
+
+    # ---------- leitura e escrita de um arquivo ----------
+
+    def _ler_arquivo(self, caminho, produtos=None, inicio=None, fim=None):
+        # CSV não tem como pular linhas: os filtros são aplicados depois em carregar()
+        df = pd.read_csv(caminho, dtype={'Filial': str, 'ID': str})
+        df['Data'] = pd.to_datetime(df['Data'], errors='coerce')
+        return df
+
+    def _gravar_arquivo(self, caminho, df):
+        # Grava em arquivo temporário e troca no final para não deixar partição pela metade
+        temporario = caminho + '.tmp'
+        df.to_csv(temporario, index=False, date_format='%Y-%m-%d')
+        os.replace(temporario, caminho)
+
+    def _anexar_arquivo(self, caminho, df):
+        existe = os.path.exists(caminho)
+        df.to_csv(caminho, mode='a', header=not existe, index=False, date_format='%Y-%m-%d')
+
+    def _estado_arquivo(self, caminho, completo=False):
+        # Para desfazer um append basta o tamanho atual (trunca de volta);
+        # para desfazer uma regravação é preciso o conteúdo anterior
+        if not os.path.exists(caminho):
+            return None
+        if not completo:
+            return os.path.getsize(caminho)
+        with open(caminho, 'rb') as f:
+            return f.read()
+
+    def _restaurar_arquivo(self, caminho, estado):
+        if estado is None:
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        elif isinstance(estado, bytes):
+            with open(caminho, 'wb') as f:
+                f.write(estado)
+        else:
+            with open(caminho, 'r+b') as f:
+                f.truncate(estado)
+
+    # ---------- localização das partições ----------
+
+    def _diretorio_filial(self, filial):
+        return os.path.join(self.diretorio, _nome_seguro(filial))
+
+    def caminho_particao(self, filial, data):
+        data = pd.Timestamp(data)
+        pasta = self._diretorio_filial(filial)
+        mensal = os.path.join(pasta, f"{data.year:04d}-{data.month:02d}{self.extensao}")
+        anual = os.path.join(pasta, f"{data.year:04d}{self.extensao}")
+        if not os.path.exists(mensal) and os.path.exists(anual):
+            return anual
+        return mensal
+
+    def particoes_de(self, df):
+        if df.empty:
+            return set()
+        return set(self._caminhos_por_linha(df).unique())
+
+    def _caminhos_por_linha(self, df):
+        # Uma consulta ao disco por (filial, mês), não por linha
+        chaves = pd.DataFrame({
+            'Filial': df['Filial'].astype(str).values,
+            'Periodo': pd.to_datetime(df['Data']).dt.to_period('M').values,
+        }, index=df.index)
+        caminhos = {
+            (filial, periodo): self.caminho_particao(filial, periodo.to_timestamp())
+            for filial, periodo in chaves.drop_duplicates().itertuples(index=False)
+        }
+        return pd.Series(
+            [caminhos[chave] for chave in zip(chaves['Filial'], chaves['Periodo'])],
+            index=df.index
+        )
+
+    def _arquivos(self, filiais=None, inicio=None, fim=None):
+        # Poda de partições: só lista os arquivos das filiais e meses pedidos
+        if not os.path.isdir(self.diretorio):
+            return []
+        pastas = sorted(os.listdir(self.diretorio))
+        if filiais is not None:
+            pastas = [p for p in pastas if p in {_nome_seguro(f) for f in filiais}]
+        inicio = pd.Timestamp(inicio) if inicio is not None else None
+        fim = pd.Timestamp(fim) if fim is not None else None
+        arquivos = []
+        for pasta in pastas:
+            caminho_pasta = os.path.join(self.diretorio, pasta)
+            if not os.path.isdir(caminho_pasta):
+                continue
+            for nome in sorted(os.listdir(caminho_pasta)):
+                if not nome.endswith(self.extensao):
+                    continue
+                if inicio is not None or fim is not None:
+                    periodo = pd.Period(nome[:-len(self.extensao)], freq='M' if '-' in nome else 'Y')
+                    if inicio is not None and periodo.end_time < inicio:
+                        continue
+                    if fim is not None and periodo.start_time > fim:
+                        continue
+                arquivos.append(os.path.join(caminho_pasta, nome))
+        return arquivos
+
+    def _preparar(self, df):
+        df = df.reindex(columns=COLUNAS)
+        df['Data'] = pd.to_datetime(df['Data'])
+        df['Filial'] = df['Filial'].astype(str)
+        # Todo registro gravado ganha um ID estável
+        sem_id = df['ID'].isna()
+        df['ID'] = df['ID'].astype(object)
+        if sem_id.any():
+            df.loc[sem_id, 'ID'] = novos_ids(int(sem_id.sum()))
+        return df
+
+    def _existe(self):
+        # O diretório pode existir só com a trava de escrita, antes de qualquer gravação
+        return os.path.isdir(self.diretorio) and any(nome != ARQUIVO_TRAVA for nome in os.listdir(self.diretorio))
+
+    # ---------- versão dos dados ----------
+
+    def versao(self):
+        # Contador que muda a cada gravação; serve de chave para caches de leitura
+        try:
+            with open(os.path.join(self.diretorio, ARQUIVO_VERSAO)) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _registrar_alteracao(self, particoes=None):
+        # Anota as partições (Filial, mês) alteradas antes de avançar a versão: quem
+        # lê a versão nova já acha a anotação. particoes=None: qualquer uma pode ter mudado.
+        with self.escrita():
+            os.makedirs(self.diretorio, exist_ok=True)
+            versao = self.versao() + 1
+            self._anotar_alteracao(versao, particoes)
+            caminho = os.path.join(self.diretorio, ARQUIVO_VERSAO)
+            with open(caminho + '.tmp', 'w') as f:
+                f.write(str(versao))
+            os.replace(caminho + '.tmp', caminho)
+
+    def _anotar_alteracao(self, versao, particoes):
+        caminho = os.path.join(self.diretorio, ARQUIVO_ALTERACOES)
+        linha = json.dumps({'versao': versao, 'particoes': None if particoes is None else [list(p) for p in particoes]})
+        with open(caminho, 'a', encoding='utf-8') as f:
+            f.write(linha + '\n')
+        if os.path.getsize(caminho) > 200 * MAXIMO_ALTERACOES:
+            # Regrava só as últimas versões (o arquivo é lido a cada atualização das sessões)
+            anotacoes = self._ler_alteracoes()
+            with open(caminho + '.tmp', 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(a) + '\n' for a in anotacoes[-MAXIMO_ALTERACOES // 2:])
+            os.replace(caminho + '.tmp', caminho)
+
+    def _ler_alteracoes(self):
+        try:
+            with open(os.path.join(self.diretorio, ARQUIVO_ALTERACOES), encoding='utf-8') as f:
+                return [json.loads(linha) for linha in f if linha.strip()]
+        except FileNotFoundError:
+            return []
+
+    def alteracoes_desde(self, versao, ate=None):
+        """Partições (Filial, 'AAAA-MM') alteradas depois de `versao`, até a versão `ate` (padrão: a atual).
+
+        None quando o registro não cobre todas as versões do intervalo (ficou
+        para trás demais, ou alguma gravação mexeu em tudo): aí é preciso recarregar tudo.
+        """
+        ate = self.versao() if ate is None else ate
+        anotacoes = [a for a in self._ler_alteracoes() if versao < a['versao'] <= ate]
+        if sorted(a['versao'] for a in anotacoes) != list(range(versao + 1, ate + 1)):
+            return None
+        if any(a['particoes'] is None for a in anotacoes):
+            return None
+        return sorted({tuple(p) for a in anotacoes for p in a['particoes']})
+
+    def carregar_particoes(self, particoes):
+        # Conteúdo atual das partições (Filial, 'AAAA-MM'): uma leitura por filial, do primeiro ao último mês pedido
+        partes = []
+        por_filial = {}
+        for filial, mes in particoes:
+            por_filial.setdefault(filial, []).append(pd.Period(mes, freq='M'))
+        for filial, meses in por_filial.items():
+            parte = self.carregar(filiais=[filial], inicio=min(meses).start_time, fim=max(meses).end_time.normalize())
+            partes.append(parte[parte['Data'].dt.to_period('M').isin(meses)])
+        if not partes:
+            return self._preparar(pd.DataFrame(columns=COLUNAS))
+        return pd.concat(partes, ignore_index=True)
+
+    # ---------- resumo mensal (Filial, Produto, ano, mês) ----------
+
+    def _caminho_resumo(self):
+        return os.path.join(self.diretorio, ARQUIVO_RESUMO)
+
+    def carregar_resumo(self):
+        # Reconstrói a partir das partições se o resumo ainda não existir
+        caminho = self._caminho_resumo()
+        if not os.path.exists(caminho):
+            return self.reconstruir_resumo()
+        return pd.read_csv(caminho, dtype={'Filial': str, 'Produto': str})
+
+    def reconstruir_resumo(self):
+        # Recalcula o resumo inteiro a partir das partições (tarefa noturna ou resumo corrompido)
+        resumo = resumo_mensal.agregar(self.carregar())
+        self._gravar_resumo(resumo)
+        return resumo
+
+    def _gravar_resumo(self, resumo):
+        # Colunas sempre na ordem de COLUNAS_RESUMO, venha o resumo de agregar() ou de somar()
+        os.makedirs(self.diretorio, exist_ok=True)
+        caminho = self._caminho_resumo()
+        resumo[resumo_mensal.COLUNAS_RESUMO].to_csv(caminho + '.tmp', index=False)
+        os.replace(caminho + '.tmp', caminho)
+
+    def _somar_resumo(self, df_novos):
+        if not os.path.exists(self._caminho_resumo()):
+            return  # será reconstruído na próxima leitura
+        self._gravar_resumo(resumo_mensal.somar(self.carregar_resumo(), resumo_mensal.agregar(df_novos)))
+
+    def _substituir_resumo(self, caminhos, df_partes):
+        # Zera no resumo os (filial, mês) cobertos pelas partições regravadas e soma o conteúdo novo
+        if not os.path.exists(self._caminho_resumo()):
+            return
+        resumo = self.carregar_resumo()
+        remover = pd.Series(False, index=resumo.index)
+        pastas = resumo['Filial'].map(_nome_seguro)
+        for caminho in caminhos:
+            pasta, nome = os.path.split(caminho)
+            periodo = pd.Period(nome[:-len(self.extensao)], freq='M' if '-' in nome else 'Y')
+            no_periodo = resumo['Ano'] == periodo.year
+            if periodo.freqstr.startswith('M'):
+                no_periodo &= resumo['Mes'] == periodo.month
+            remover |= (pastas == os.path.basename(pasta)) & no_periodo
+        self._gravar_resumo(resumo_mensal.substituir(resumo, remover, resumo_mensal.agregar(df_partes)))
+
+    # ---------- preços ----------
+
+    def carregar_precos(self):
+        return precos.carregar_precos()
+
+    def salvar_precos(self, df_precos, vigencia=None):
+        # O que mudou entra no histórico, vigente a partir de `vigencia` (padrão: hoje)
+        with self.escrita():
+            precos.salvar_precos(df_precos, vigencia=vigencia)
+
+    def carregar_historico_precos(self):
+        return precos.carregar_historico()
+
+    def versao_precos(self):
+        return precos.versao_precos()
+
+    # ---------- consultas ----------
+
+    def totalizar(self, filiais=None, produtos=None, inicio=None, fim=None):
+        # Somas de Quebra, Vendidos e Lucro Bruto para o filtro
+        df = self.carregar(filiais, produtos, inicio, fim)
+        return {coluna: float(df[coluna].sum()) for coluna in ('Quebra', 'Vendidos', 'Lucro Bruto')}
+
+    # ---------- operações ----------
+
+    def migrar_legado(self):
+        # Primeira execução: divide o arquivo único antigo em partições
+        if not self.arquivo_legado or self._existe() or not os.path.exists(self.arquivo_legado):
+            return False
+        df = pd.read_csv(self.arquivo_legado, dtype={'Filial': str})
+        df['Data'] = pd.to_datetime(df['Data'], errors='coerce')
+        if df['Data'].isna().any():
+            raise ValueError(f"Existem datas inválidas em {self.arquivo_legado}. Corrija antes de continuar.")
+        with self.escrita():
+            if self._existe():
+                return False  # outro processo migrou enquanto este lia o arquivo
+            self.regravar_particoes(df, self.particoes_de(df))
+        return True
+
+    def _tipar(self, df):
+        return df
+
+    def carregar(self, filiais=None, produtos=None, inicio=None, fim=None, categorias=False):
+        # Filial e período podam arquivos; o backend pode aplicar mais filtros na leitura
+        self.migrar_legado()
+        if not self._existe():
+            raise FileNotFoundError(f"Dados não encontrados: {self.arquivo_legado or self.diretorio}.")
+        arquivos = self._arquivos(filiais, inicio, fim)
+        if not arquivos:
+            return self._preparar(pd.DataFrame(columns=COLUNAS))
+        partes = []
+        atualizados = False
+        for arquivo in arquivos:
+            parte = self._ler_arquivo(arquivo, produtos, inicio, fim).reindex(columns=COLUNAS)
+            sem_filtro = produtos is None and inicio is None and fim is None
+            if sem_filtro and parte['ID'].isna().any():
+                # Arquivo de antes dos IDs: atribui uma única vez e regrava
+                with self.escrita():
+                    parte = self._preparar(self._ler_arquivo(arquivo).reindex(columns=COLUNAS))
+                    self._gravar_arquivo(arquivo, parte)
+                atualizados = True
+            partes.append(parte)
+        if atualizados:
+            self._registrar_alteracao()
+        df = pd.concat(partes, ignore_index=True)
+
+        mask = pd.Series(True, index=df.index)
+        if filiais is not None:
+            mask &= df['Filial'].astype(str).isin([str(f) for f in filiais])
+        if produtos is not None:
+            mask &= df['Produto'].isin(list(produtos))
+        if inicio is not None:
+            mask &= df['Data'] >= pd.Timestamp(inicio)
+        if fim is not None:
+            mask &= df['Data'] <= pd.Timestamp(fim)
+        if not mask.all():
+            df = df[mask].reset_index(drop=True)
+
+        if categorias:
+            df = self._tipar(df)
+        else:
+            for coluna in ('Filial', 'Produto'):
+                if isinstance(df[coluna].dtype, pd.CategoricalDtype):
+                    df[coluna] = df[coluna].astype(str)
+        return df
+
+    def inserir(self, df_novos):
+        # Inserção só acrescenta linhas ao fim das partições envolvidas. É tudo ou
+        # nada: se uma partição falhar, as já gravadas voltam ao estado anterior.
+        if df_novos.empty:
+            return
+        df_novos = self._preparar(df_novos)
+        estados = {}
+        with self.escrita():
+            try:
+                for caminho, grupo in df_novos.groupby(self._caminhos_por_linha(df_novos), sort=False):
+                    estados[caminho] = self._estado_arquivo(caminho)
+                    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                    self._anexar_arquivo(caminho, grupo)
+            except Exception:
+                for caminho, estado in estados.items():
+                    self._restaurar_arquivo(caminho, estado)
+                raise
+            self._somar_resumo(df_novos)
+            self._registrar_alteracao(chaves_particoes(df_novos))
+
+    def regravar_particoes(self, df, caminhos, backup=False, alteradas=None):
+        # Regrava apenas as partições informadas com as linhas de df que pertencem a elas.
+        # `alteradas`: (Filial, 'AAAA-MM') que mudaram, para o registro de alterações (None: todas)
+        if not caminhos:
+            return
+        df = self._preparar(df)
+        por_linha = self._caminhos_por_linha(df) if not df.empty else pd.Series(dtype=object)
+        estados = {}
+        with self.escrita():
+            try:
+                for caminho in caminhos:
+                    estados[caminho] = self._estado_arquivo(caminho, completo=True)
+                    if backup and os.path.exists(caminho):
+                        shutil.copy(caminho, caminho + '.backup')
+                    parte = df[por_linha == caminho]
+                    if parte.empty:
+                        if os.path.exists(caminho):
+                            os.remove(caminho)
+                        continue
+                    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                    self._gravar_arquivo(caminho, parte)
+            except Exception:
+                for caminho, estado in estados.items():
+                    self._restaurar_arquivo(caminho, estado)
+                raise
+            self._substituir_resumo(caminhos, df[por_linha.isin(list(caminhos))])
+            self._registrar_alteracao(alteradas)
+
+    def _ler_particoes(self, caminhos):
+        # Conteúdo atual (em disco) das partições informadas
+        existentes = [self._ler_arquivo(c) for c in caminhos if os.path.exists(c)]
+        atual = pd.concat(existentes, ignore_index=True) if existentes else pd.DataFrame(columns=COLUNAS)
+        return self._preparar(atual)
+
+    def atualizar(self, antigos, novos):
+        """Grava a nova versão de registros existentes (mesmo ID).
+
+        `antigos` são as linhas como estavam, para achar as partições de
+        origem; se a data ou a filial mudou, o registro troca de partição.
+        Se outra sessão alterou ou excluiu algum deles depois de lido, nada é
+        gravado e sai RegistroDesatualizado.
+        """
+        novos = self._preparar(novos)
+        caminhos = self.particoes_de(antigos) | self.particoes_de(novos)
+        with self.escrita():
+            atual = self._ler_particoes(caminhos)
+            conferir_atuais(atual, antigos)
+            atual = atual[~atual['ID'].isin(novos['ID'])]
+            self.regravar_particoes(pd.concat([atual, novos], ignore_index=True), caminhos,
+                                    alteradas=chaves_particoes(antigos, novos))
+
+    def excluir(self, registros, backup=False):
+        # Remove os registros (pelo ID) regravando só as partições onde estão
+        caminhos = self.particoes_de(registros)
+        with self.escrita():
+            atual = self._ler_particoes(caminhos)
+            self.regravar_particoes(atual[~atual['ID'].isin(registros['ID'])], caminhos, backup=backup,
+                                    alteradas=chaves_particoes(registros))
+
+    def substituir(self, remover, df_novos):
+        """Troca registros existentes por novos em uma única gravação.
+
+        `remover` tem colunas ID, Filial e Data: saem os registros com esses
+        IDs, procurados nas partições de Filial e Data. Sem nada a remover,
+        vira um simples inserir().
+        """
+        if remover.empty:
+            self.inserir(df_novos)
+            return
+        caminhos = self.particoes_de(remover) | self.particoes_de(df_novos)
+        with self.escrita():
+            atual = self._ler_particoes(caminhos)
+            saem = atual['ID'].isin(remover['ID'].astype(str))
+            self.regravar_particoes(pd.concat([atual[~saem], self._preparar(df_novos)], ignore_index=True), caminhos,
+                                    alteradas=chaves_particoes(atual[saem], df_novos))
+
+    def compactar(self, limite=LIMITE_COMPACTACAO):
+        # Une os meses pequenos de cada filial/ano no arquivo anual. O mês corrente
+        # fica de fora porque ainda recebe inserções.
+        mes_atual = datetime.today().strftime('%Y-%m')
+        padrao = re.compile(r'^(\d{4})-(\d{2})$')
+        unidos = 0
+        with self.escrita():
+            for caminho in self._arquivos():
+                pasta, nome = os.path.split(caminho)
+                chave = nome[:-len(self.extensao)]
+                casamento = padrao.match(chave)
+                if not casamento or chave == mes_atual:
+                    continue
+                df_mes = self._ler_arquivo(caminho)
+                if len(df_mes) >= limite:
+                    continue
+                anual = os.path.join(pasta, f"{casamento.group(1)}{self.extensao}")
+                if os.path.exists(anual):
+                    df_mes = pd.concat([self._ler_arquivo(anual), df_mes], ignore_index=True)
+                self._gravar_arquivo(anual, self._preparar(df_mes))
+                os.remove(caminho)
+                unidos += 1
+            if unidos:
+                # Só o arquivo mudou; os registros de cada partição são os mesmos
+                self._registrar_alteracao([])
+        return unidos
+
+
+class ArmazenamentoParquet(ArmazenamentoParticionado):
+    """Mesmo layout por filial/mês, em Parquet com colunas tipadas.
+
+    Filial e período escolhem as partições lidas. Cada partição é um único
+    row group, ordenado por Produto e Data: no tamanho de uma filial/mês,
+    dividir em grupos menores custa mais em metadados do que os filtros de
+    Produto poupam, e esses filtros são aplicados na leitura do arquivo.
+    """
+
+    extensao = '.parquet'
+
+    def __init__(self, diretorio=DIRETORIO_PARQUET, arquivo_legado=None):
+        _importar_pyarrow()
+        super().__init__(diretorio, arquivo_legado)
+
+    @staticmethod
+    def esquema():
+        return pa.schema([
+            ('ID', pa.string()),
+            ('Data', pa.date32()),
+            ('Produto', pa.dictionary(pa.int32(), pa.string())),
+            ('Inicial', pa.float32()),
+            ('Vendidos', pa.float32()),
+            ('Quebra', pa.float32()),
+            ('% Quebra', pa.float32()),
+            ('Estoque Final', pa.float32()),
+            ('Filial', pa.dictionary(pa.int32(), pa.string())),
+            ('Lucro Bruto', pa.float32()),
+        ])
+
+    def _ler_arquivo(self, caminho, produtos=None, inicio=None, fim=None):
+        filtros = []
+        if produtos is not None:
+            filtros.append(('Produto', 'in', [str(p) for p in produtos]))
+        if inicio is not None:
+            filtros.append(('Data', '>=', pd.Timestamp(inicio).date()))
+        if fim is not None:
+            filtros.append(('Data', '<=', pd.Timestamp(fim).date()))
+        # Um único arquivo aberto do começo ao fim: se outro processo regravar a
+        # partição no meio (os.replace), esta leitura continua na versão antiga
+        with open(caminho, 'rb') as arquivo:
+            tabela = pq.read_table(arquivo, filters=filtros or None)
+        return tabela.to_pandas(date_as_object=False)
+
+    def _gravar_arquivo(self, caminho, df):
+        df = df.sort_values(['Produto', 'Data'], kind='stable')
+        df = df.astype({'ID': 'string', 'Produto': 'string', 'Filial': 'string'})
+        tabela = pa.Table.from_pandas(df, preserve_index=False).cast(self.esquema())
+        temporario = caminho + '.tmp'
+        pq.write_table(tabela, temporario, row_group_size=max(len(tabela), 1))
+        os.replace(temporario, caminho)
+
+    def _estado_arquivo(self, caminho, completo=False):
+        # A partição é sempre regravada inteira, então guarda o conteúdo anterior
+        return super()._estado_arquivo(caminho, completo=True)
+
+    def _anexar_arquivo(self, caminho, df):
+        # Parquet não aceita append: regrava só a partição tocada
+        if os.path.exists(caminho):
+            df = pd.concat([self._ler_arquivo(caminho), df], ignore_index=True)
+        self._gravar_arquivo(caminho, self._preparar(df))
+
+    def _tipar(self, df):
+        df = df.astype({'Filial': 'category', 'Produto': 'category'})
+        df['Filial'] = df['Filial'].cat.remove_unused_categories()
+        df['Produto'] = df['Produto'].cat.remove_unused_categories()
+        return df
+
+
+def obter_armazenamento():
+    backend = os.environ.get(VARIAVEL_BACKEND, 'csv').lower()
+    if backend == 'parquet':
+        return ArmazenamentoParquet()
+    if backend == 'sqlite':
+        from armazenamento_sqlite import ArmazenamentoSQLite
+        return ArmazenamentoSQLite()
+    return ArmazenamentoParticionado()
@@ -0,0 +1,390 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import pandas as pd
+
+import precos
+import resumo_mensal
+from armazenamento import COLUNAS, MAXIMO_ALTERACOES, ArmazenamentoParticionado, chaves_particoes, conferir_atuais
+
+DIRETORIO_SQLITE = 'dados_sqlite'
+ARQUIVO_SQLITE = 'controle.sqlite3'
+# Sobe quando o ESQUEMA muda: bancos com versão menor rodam o script de novo
+VERSAO_ESQUEMA = 1
+
+# Nome da coluna no banco -> nome no DataFrame
+COLUNAS_SQL = {
+    'id': 'ID',
+    'data': 'Data',
+    'produto': 'Produto',
+    'inicial': 'Inicial',
+    'vendidos': 'Vendidos',
+    'quebra': 'Quebra',
+    'perc_quebra': '% Quebra',
+    'estoque_final': 'Estoque Final',
+    'filial': 'Filial',
+    'lucro_bruto': 'Lucro Bruto',
+}
+COLUNAS_SQL_PRECOS = {
+    'cod_vip': 'COD VIP',
+    'produto': 'Produto',
+    'custo': 'Custo Unitário',
+    'preco_venda': 'Preço Venda Unitário',
+}
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS registros (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    produto TEXT NOT NULL,
+    inicial REAL,
+    vendidos REAL,
+    quebra REAL,
+    perc_quebra REAL,
+    estoque_final REAL,
+    filial TEXT NOT NULL,
+    lucro_bruto REAL
+);
+CREATE INDEX IF NOT EXISTS idx_registros_filial_data ON registros (filial, data);
+CREATE INDEX IF NOT EXISTS idx_registros_data ON registros (data);
+CREATE INDEX IF NOT EXISTS idx_registros_produto ON registros (produto, data);
+
+CREATE TABLE IF NOT EXISTS precos (
+    cod_vip TEXT,
+    produto TEXT NOT NULL,
+    custo REAL,
+    preco_venda REAL
+);
+CREATE INDEX IF NOT EXISTS idx_precos_produto ON precos (produto);
+
+CREATE TABLE IF NOT EXISTS historico_precos (
+    cod_vip TEXT,
+    produto TEXT NOT NULL,
+    custo REAL,
+    preco_venda REAL,
+    vigencia TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_historico_precos ON historico_precos (produto, vigencia);
+
+-- Partições (filial, 'AAAA-MM') alteradas em cada versão; filial NULL: todas
+CREATE TABLE IF NOT EXISTS alteracoes (
+    versao INTEGER NOT NULL,
+    filial TEXT,
+    periodo TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_alteracoes_versao ON alteracoes (versao);
+
+CREATE TABLE IF NOT EXISTS meta (
+    chave TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL
+);
+"""
+
+
+class ArmazenamentoSQLite(ArmazenamentoParticionado):
+    """Registros e preços em um banco SQLite local (modo WAL).
+
+    Cada operação roda em uma transação própria, então dois gerentes gravando
+    ao mesmo tempo não apagam as linhas um do outro. Os contadores de versão
+    dos dados e dos preços ficam na tabela meta e mudam na mesma transação da
+    gravação.
+    """
+
+    def __init__(self, diretorio=DIRETORIO_SQLITE, arquivo_legado=None):
+        super().__init__(diretorio, arquivo_legado)
+        self.caminho = os.path.join(diretorio, ARQUIVO_SQLITE)
+        os.makedirs(diretorio, exist_ok=True)
+        self._preparar_banco()
+
+    def _versao_esquema(self):
+        try:
+            return self._ler_meta('esquema')
+        except sqlite3.OperationalError:
+            return 0  # banco novo, ainda sem a tabela meta
+
+    def _preparar_banco(self):
+        # Esquema e migração só uma vez por banco; nas outras aberturas basta ler a versão no meta
+        if self._versao_esquema() >= VERSAO_ESQUEMA:
+            return
+        with self.escrita():
+            if self._versao_esquema() >= VERSAO_ESQUEMA:
+                return  # outro processo preparou o banco enquanto este esperava a trava
+            with self._conexao() as conexao:
+                conexao.executescript(ESQUEMA)
+            self.migrar_legado()
+            with self._conexao() as conexao:
+                conexao.execute(
+                    "INSERT INTO meta (chave, valor) VALUES ('esquema', ?) "
+                    "ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor",
+                    (VERSAO_ESQUEMA,)
+                )
+
+    @contextmanager
+    def _conexao(self):
+        # Uma conexão por operação; o bloco with é a transação (commit ou rollback)
+        conexao = sqlite3.connect(self.caminho, timeout=30)
+        try:
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            with conexao:
+                yield conexao
+        finally:
+            conexao.close()
+
+    # ---------- conversões ----------
+
+    def _linhas(self, df):
+        df = self._preparar(df)
+        df = df.astype(object).where(df.notna(), None)
+        df['Data'] = [d.strftime('%Y-%m-%d') for d in df['Data']]
+        return list(df[list(COLUNAS_SQL.values())].itertuples(index=False, name=None))
+
+    def _para_df(self, df):
+        df = df.rename(columns=COLUNAS_SQL).reindex(columns=COLUNAS)
+        df['Data'] = pd.to_datetime(df['Data'])
+        for coluna in ('Inicial', 'Vendidos', 'Quebra', '% Quebra', 'Estoque Final', 'Lucro Bruto'):
+            df[coluna] = pd.to_numeric(df[coluna])
+        return df
+
+    def _incrementar(self, conexao, chave='versao'):
+        conexao.execute(
+            "INSERT INTO meta (chave, valor) VALUES (?, 1) "
+            "ON CONFLICT(chave) DO UPDATE SET valor = valor + 1",
+            (chave,)
+        )
+
+    def _anotar(self, conexao, particoes):
+        # Nova versão e suas partições alteradas, na transação da gravação
+        self._incrementar(conexao)
+        versao = conexao.execute("SELECT valor FROM meta WHERE chave = 'versao'").fetchone()[0]
+        linhas = [(versao, None, None)] if particoes is None else [(versao, f, p) for f, p in particoes]
+        conexao.executemany("INSERT INTO alteracoes (versao, filial, periodo) VALUES (?, ?, ?)", linhas)
+        # Primeira versão coberta pelo registro (bancos de antes dele começam aqui)
+        conexao.execute("INSERT OR IGNORE INTO meta (chave, valor) VALUES ('inicio_alteracoes', ?)", (versao,))
+        if versao % 100 == 0:
+            inicio = versao - MAXIMO_ALTERACOES + 1
+            conexao.execute("DELETE FROM alteracoes WHERE versao < ?", (inicio,))
+            conexao.execute("UPDATE meta SET valor = MAX(valor, ?) WHERE chave = 'inicio_alteracoes'", (inicio,))
+
+    def _ler_meta(self, chave):
+        with self._conexao() as conexao:
+            linha = conexao.execute("SELECT valor FROM meta WHERE chave = ?", (chave,)).fetchone()
+        return linha[0] if linha else 0
+
+    def _filtros_sql(self, filiais=None, produtos=None, inicio=None, fim=None):
+        condicoes, parametros = [], []
+        if filiais is not None:
+            filiais = [str(f) for f in filiais]
+            condicoes.append(f"filial IN ({','.join('?' * len(filiais))})")
+            parametros += filiais
+        if produtos is not None:
+            produtos = [str(p) for p in produtos]
+            condicoes.append(f"produto IN ({','.join('?' * len(produtos))})")
+            parametros += produtos
+        if inicio is not None:
+            condicoes.append("data >= ?")
+            parametros.append(pd.Timestamp(inicio).strftime('%Y-%m-%d'))
+        if fim is not None:
+            condicoes.append("data <= ?")
+            parametros.append(pd.Timestamp(fim).strftime('%Y-%m-%d'))
+        where = f" WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        return where, parametros
+
+    # ---------- migração ----------
+
+    def migrar_legado(self):
+        # Banco novo: copia os dados das partições CSV (ou do dados_quebras.csv) e o precos.csv
+        if self._ler_meta('migrado'):
+            return False
+        with self._conexao() as conexao:
+            vazio = conexao.execute("SELECT COUNT(*) FROM registros").fetchone()[0] == 0
+        if vazio:
+            try:
+                df = ArmazenamentoParticionado().carregar()
+            except FileNotFoundError:
+                df = pd.DataFrame(columns=COLUNAS)
+            if not df.empty:
+                self.inserir(df)
+        with self._conexao() as conexao:
+            if vazio:
+                self._gravar_precos(conexao, precos.carregar_precos(), precos.carregar_historico())
+            self._incrementar(conexao, 'migrado')
+        return vazio
+
+    # ---------- versão ----------
+
+    def versao(self):
+        return self._ler_meta('versao')
+
+    def versao_precos(self):
+        return self._ler_meta('versao_precos')
+
+    def alteracoes_desde(self, versao, ate=None):
+        with self._conexao() as conexao:
+            linha = conexao.execute("SELECT valor FROM meta WHERE chave = 'inicio_alteracoes'").fetchone()
+            if ate is None:
+                ate = conexao.execute("SELECT COALESCE(MAX(valor), 0) FROM meta WHERE chave = 'versao'").fetchone()[0]
+            if linha is None or versao + 1 < linha[0]:
+                return None
+            particoes = conexao.execute(
+                "SELECT DISTINCT filial, periodo FROM alteracoes WHERE versao > ? AND versao <= ?", (versao, ate)
+            ).fetchall()
+        if any(filial is None for filial, _ in particoes):
+            return None
+        return sorted(particoes)
+
+    # ---------- leitura ----------
+
+    def carregar(self, filiais=None, produtos=None, inicio=None, fim=None, categorias=False):
+        where, parametros = self._filtros_sql(filiais, produtos, inicio, fim)
+        with self._conexao() as conexao:
+            df = pd.read_sql_query(f"SELECT * FROM registros{where}", conexao, params=parametros)
+        df = self._para_df(df)
+        return self._tipar(df) if categorias else df
+
+    def _tipar(self, df):
+        return df.astype({'Filial': 'category', 'Produto': 'category'})
+
+    def carregar_resumo(self):
+        # Agregação feita no banco, usando os índices
+        consulta = (
+            "SELECT filial AS Filial, produto AS Produto, "
+            "CAST(strftime('%Y', data) AS INTEGER) AS Ano, CAST(strftime('%m', data) AS INTEGER) AS Mes, "
+            "SUM(COALESCE(quebra, 0)) AS Quebra, SUM(COALESCE(vendidos, 0)) AS Vendidos, "
+            "SUM(COALESCE(lucro_bruto, 0)) AS \"Lucro Bruto\", COUNT(*) AS Registros "
+            "FROM registros GROUP BY filial, produto, Ano, Mes"
+        )
+        with self._conexao() as conexao:
+            resumo = pd.read_sql_query(consulta, conexao)
+        return resumo if not resumo.empty else resumo_mensal.resumo_vazio()
+
+    def reconstruir_resumo(self):
+        # O resumo é sempre calculado no banco; não há arquivo para refazer
+        return self.carregar_resumo()
+
+    def totalizar(self, filiais=None, produtos=None, inicio=None, fim=None):
+        where, parametros = self._filtros_sql(filiais, produtos, inicio, fim)
+        consulta = (
+            "SELECT COALESCE(SUM(quebra), 0), COALESCE(SUM(vendidos), 0), COALESCE(SUM(lucro_bruto), 0) "
+            f"FROM registros{where}"
+        )
+        with self._conexao() as conexao:
+            quebra, vendidos, lucro = conexao.execute(consulta, parametros).fetchone()
+        return {'Quebra': quebra, 'Vendidos': vendidos, 'Lucro Bruto': lucro}
+
+    # ---------- escrita (uma transação por operação) ----------
+
+    def inserir(self, df_novos):
+        if df_novos.empty:
+            return
+        marcadores = ','.join('?' * len(COLUNAS_SQL))
+        with self._conexao() as conexao:
+            conexao.executemany(
+                f"INSERT INTO registros ({','.join(COLUNAS_SQL)}) VALUES ({marcadores})",
+                self._linhas(df_novos)
+            )
+            self._anotar(conexao, chaves_particoes(df_novos))
+
+    def atualizar(self, antigos, novos):
+        # Como no particionado: se outra sessão mudou os registros depois de lidos, nada é gravado
+        atribuicoes = ','.join(f"{coluna} = ?" for coluna in COLUNAS_SQL if coluna != 'id')
+        linhas = [linha[1:] + linha[:1] for linha in self._linhas(novos)]
+        ids = [str(i) for i in antigos['ID']]
+        with self._conexao() as conexao:
+            # Trava de escrita já na leitura: ninguém grava entre a conferência e o UPDATE
+            conexao.execute("BEGIN IMMEDIATE")
+            blocos = (ids[i:i + 500] for i in range(0, len(ids), 500))
+            atuais = [
+                pd.read_sql_query(f"SELECT * FROM registros WHERE id IN ({','.join('?' * len(bloco))})", conexao, params=bloco)
+                for bloco in blocos
+            ]
+            atuais = pd.concat(atuais, ignore_index=True) if atuais else pd.DataFrame(columns=list(COLUNAS_SQL))
+            conferir_atuais(self._para_df(atuais), antigos)
+            conexao.executemany(f"UPDATE registros SET {atribuicoes} WHERE id = ?", linhas)
+            self._anotar(conexao, chaves_particoes(antigos, novos))
+
+    def excluir(self, registros, backup=False):
+        # backup não se aplica: a transação já garante que nada fica pela metade
+        with self._conexao() as conexao:
+            conexao.executemany("DELETE FROM registros WHERE id = ?", [(str(i),) for i in registros['ID']])
+            self._anotar(conexao, chaves_particoes(registros))
+
+    def substituir(self, remover, df_novos):
+        # Saem os registros com os IDs de `remover`; os novos entram na mesma transação
+        marcadores = ','.join('?' * len(COLUNAS_SQL))
+        with self._conexao() as conexao:
+            conexao.executemany("DELETE FROM registros WHERE id = ?", [(str(i),) for i in remover['ID']])
+            if not df_novos.empty:
+                conexao.executemany(
+                    f"INSERT INTO registros ({','.join(COLUNAS_SQL)}) VALUES ({marcadores})",
+                    self._linhas(df_novos)
+                )
+            self._anotar(conexao, chaves_particoes(remover, df_novos))
+
+    def compactar(self, limite=None):
+        # Equivalente da compactação: devolve ao disco o espaço de linhas apagadas
+        conexao = sqlite3.connect(self.caminho, timeout=30)
+        try:
+            conexao.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conexao.execute("VACUUM")
+            conexao.execute("PRAGMA optimize")
+        finally:
+            conexao.close()
+        return 0
+
+    # ---------- preços ----------
+
+    def carregar_precos(self):
+        with self._conexao() as conexao:
+            return self._ler_precos(conexao)
+
+    def _ler_precos(self, conexao):
+        df_precos = pd.read_sql_query("SELECT * FROM precos ORDER BY rowid", conexao)
+        df_precos = df_precos.rename(columns=COLUNAS_SQL_PRECOS)
+        # COD VIP numérico quando possível, como no precos.csv
+        codigos = pd.to_numeric(df_precos['COD VIP'], errors='coerce')
+        if codigos.notna().all():
+            df_precos['COD VIP'] = codigos.astype('int64')
+        df_precos['Produto'] = df_precos['Produto'].fillna('Desconhecido')
+        return df_precos
+
+    def _linhas_precos(self, df_precos):
+        return [
+            (None if pd.isna(cod) else str(cod), produto,
+             None if pd.isna(custo) else float(custo), None if pd.isna(venda) else float(venda))
+            for cod, produto, custo, venda in df_precos[list(COLUNAS_SQL_PRECOS.values())].itertuples(index=False, name=None)
+        ]
+
+    def carregar_historico_precos(self):
+        with self._conexao() as conexao:
+            historico = pd.read_sql_query("SELECT * FROM historico_precos ORDER BY rowid", conexao)
+        if historico.empty:
+            return precos.historico_inicial(self.carregar_precos())
+        historico = historico.rename(columns={**COLUNAS_SQL_PRECOS, 'vigencia': precos.COLUNA_VIGENCIA})[precos.COLUNAS_HISTORICO]
+        historico[precos.COLUNA_VIGENCIA] = pd.to_datetime(historico[precos.COLUNA_VIGENCIA])
+        return historico
+
+    def salvar_precos(self, df_precos, vigencia=None):
+        # O que mudou entra no histórico, vigente a partir de `vigencia` (padrão: hoje).
+        # A tabela atual é lida na mesma transação da gravação: duas gravações
+        # seguidas não perdem a linha de histórico uma da outra
+        with self.escrita(), self._conexao() as conexao:
+            conexao.execute("BEGIN IMMEDIATE")
+            antigos = self._ler_precos(conexao)
+            mudancas = precos.mudancas_precos(antigos, df_precos, vigencia or pd.Timestamp.today())
+            if conexao.execute("SELECT COUNT(*) FROM historico_precos").fetchone()[0] == 0:
+                mudancas = pd.concat([precos.historico_inicial(antigos), mudancas], ignore_index=True)
+            self._gravar_precos(conexao, df_precos, mudancas)
+
+    def _gravar_precos(self, conexao, df_precos, mudancas):
+        # Tabela atual e linhas novas do histórico na transação de `conexao`
+        linhas_historico = [
+            linha + (data.strftime('%Y-%m-%d'),)
+            for linha, data in zip(self._linhas_precos(mudancas), mudancas[precos.COLUNA_VIGENCIA])
+        ]
+        conexao.execute("DELETE FROM precos")
+        conexao.executemany("INSERT INTO precos VALUES (?, ?, ?, ?)", self._linhas_precos(df_precos))
+        conexao.executemany("INSERT INTO historico_precos VALUES (?, ?, ?, ?, ?)", linhas_historico)
+        self._incrementar(conexao, 'versao_precos')
+
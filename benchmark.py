@@ -0,0 +1,425 @@
+import argparse
+import ast
+import gc
+import importlib.util
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from anomalias import detectar_anomalias
+from armazenamento import VARIAVEL_BACKEND, novos_ids, obter_armazenamento
+from catalogo_precos import CatalogoPrecos
+from calculos import calcular_metricas_vigentes
+from conjunto_registros import ConjuntoRegistros
+from exportacao import assinatura, exportar
+from importacao import RegistroImportacoes, hash_conteudo, ids_importacao, ler_planilha, montar_registros
+from indice_registros import IndiceRegistros
+from precos import historico_inicial
+from previsao import JANELA_DIAS, sugerir_producao
+from servicos import montar_dashboard, montar_relatorio, ordem_relatorio, recalcular_lucro
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Mede as operações do app sobre um histórico sintético, sem navegador.
+# Uso: python benchmark.py --tamanho rede --armazenamento csv --saida resultado.json
+#      python benchmark.py --tamanho pequeno --comparar resultado.json
+
+# (filiais, produtos, anos)
+TAMANHOS = {
+    'pequeno': (5, 50, 1),
+    'medio': (20, 200, 2),
+    'rede': (100, 500, 3),
+}
+
+ETAPAS = ['importacoes', 'carregar', 'memoria', 'registrar', 'editar', 'excluir', 'importar', 'relatorio', 'dashboard', 'exportar',
+          'recalcular', 'anomalias', 'previsao']
+
+
+# ---------- dados sintéticos ----------
+
+def gerar_precos(produtos, semente=0):
+    # Mesmo esquema do precos.csv
+    gerador = np.random.default_rng(semente)
+    custo = gerador.uniform(1.5, 8.0, produtos).round(2)
+    return pd.DataFrame({
+        'COD VIP': 10000 + np.arange(produtos),
+        'Produto': [f"PRODUTO SINTETICO {i:04d}" for i in range(produtos)],
+        'Custo Unitário': custo,
+        'Preço Venda Unitário': (custo * gerador.uniform(1.6, 2.4, produtos)).round(2),
+    })
+
+
+def gerar_historico(filiais, df_precos, anos, ultimo_ano=2025, semente=0):
+    """Um registro por filial, produto e mês, como nas importações mensais.
+
+    A venda segue a demanda do produto, o porte da filial e a época do ano;
+    a quebra é uma fração da venda que varia por produto.
+    """
+    gerador = np.random.default_rng(semente + 1)
+    produtos = df_precos['Produto'].to_numpy()
+    meses = pd.date_range(f"{ultimo_ano - anos + 1}-01-01", periods=12 * anos, freq='MS')
+    n_produtos, n_meses = len(produtos), len(meses)
+
+    demanda = gerador.lognormal(3.0, 0.8, n_produtos)
+    porte = gerador.lognormal(0.0, 0.4, filiais)
+    sazonalidade = 1 + 0.15 * np.sin(2 * np.pi * (meses.month.to_numpy() - 3) / 12)
+    taxa_quebra = gerador.beta(2, 25, n_produtos)
+
+    media = porte[:, None, None] * demanda[None, :, None] * sazonalidade[None, None, :]
+    vendidos = gerador.poisson(media).ravel()
+    quebra = gerador.poisson(media.ravel() * np.repeat(np.tile(taxa_quebra, filiais), n_meses))
+
+    df = pd.DataFrame({
+        'Data': np.tile(meses.to_numpy(), filiais * n_produtos),
+        'Produto': np.tile(np.repeat(produtos, n_meses), filiais),
+        'Vendidos': vendidos.astype(float),
+        'Quebra': quebra.astype(float),
+        'Filial': np.repeat([str(f) for f in range(1, filiais + 1)], n_produtos * n_meses),
+    })
+    df, _ = calcular_metricas_vigentes(df, historico_inicial(df_precos))
+    return df
+
+
+def gerar_diario(filiais, df_precos, dias=JANELA_DIAS, fim='2025-12-31', semente=0):
+    """Lançamentos diários das últimas `dias` (um por filial, produto e dia), como no registro em lote.
+
+    A procura tem efeito do dia da semana; a produção do dia é a venda da
+    semana anterior com folga, então há quebra e, às vezes, falta de produto.
+    """
+    gerador = np.random.default_rng(semente + 4)
+    datas = pd.date_range(end=fim, periods=dias, freq='D')
+    n_produtos = len(df_precos)
+    demanda = gerador.lognormal(2.0, 0.8, n_produtos)
+    porte = gerador.lognormal(0.0, 0.4, filiais)
+    semana = np.array([0.9, 0.85, 0.9, 0.95, 1.1, 1.3, 1.0])[datas.dayofweek.to_numpy()]
+    media = porte[:, None, None] * demanda[None, :, None] * semana[None, None, :]
+    procura = gerador.poisson(media)
+    producao = np.ceil(1.2 * np.concatenate([media[..., :7], procura[..., :-7]], axis=-1))
+    vendidos = np.minimum(procura, producao)
+
+    df = pd.DataFrame({
+        'Data': np.tile(datas.to_numpy(), filiais * n_produtos),
+        'Produto': np.tile(np.repeat(df_precos['Produto'].to_numpy(), dias), filiais),
+        'Vendidos': vendidos.ravel().astype(float),
+        'Quebra': (producao - vendidos).ravel(),
+        'Filial': np.repeat([str(f) for f in range(1, filiais + 1)], n_produtos * dias),
+    })
+    df, _ = calcular_metricas_vigentes(df, historico_inicial(df_precos))
+    return df
+
+
+def planilha_xlsx(df_precos, semente=0):
+    # Planilha no formato importado pelo app (CÓD. VIP, DESCRIÇÃO, QUEBRA, VENDA)
+    gerador = np.random.default_rng(semente + 2)
+    planilha = pd.DataFrame({
+        'CÓD. VIP': df_precos['COD VIP'],
+        'DESCRIÇÃO': df_precos['Produto'],
+        'QUEBRA': gerador.poisson(2, len(df_precos)),
+        'VENDA': gerador.poisson(30, len(df_precos)),
+    })
+    conteudo = io.BytesIO()
+    planilha.to_excel(conteudo, index=False)
+    return conteudo.getvalue()
+
+
+# ---------- medição ----------
+
+def medir(funcao, repeticoes=1, memoria=True):
+    """Mediana e mínimo do tempo em `repeticoes` chamadas.
+
+    Com `memoria`, uma chamada extra roda sob o tracemalloc para o pico de
+    memória alocada (fora da medição de tempo, que o tracemalloc deixa lenta).
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        gc.collect()
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    resultado = {
+        'segundos': round(statistics.median(tempos), 6),
+        'minimo': round(min(tempos), 6),
+        'repeticoes': repeticoes,
+    }
+    if memoria:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            funcao()
+            resultado['pico_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        finally:
+            tracemalloc.stop()
+    return resultado
+
+
+def pico_processo_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KiB, macOS em bytes
+    return round(pico / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 2)
+
+
+def modulos_app():
+    # Módulos importados pelo controle.py na partida, lidos do próprio arquivo
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'controle.py'), encoding='utf-8') as f:
+        arvore = ast.parse(f.read())
+    modulos = []
+    for no in arvore.body:
+        if isinstance(no, ast.Import):
+            nomes = [apelido.name for apelido in no.names]
+        elif isinstance(no, ast.ImportFrom) and no.module:
+            nomes = [no.module]
+        else:
+            continue
+        modulos += [nome for nome in nomes if nome not in modulos]
+    return modulos
+
+
+def medir_importacoes(repeticoes=3):
+    """Custo de importar os módulos do app em um processo novo, como na partida do servidor.
+
+    Usa `python -X importtime` e devolve também o custo acumulado dos
+    módulos de primeiro nível mais caros.
+    """
+    pasta = os.path.dirname(os.path.abspath(__file__))
+    modulos = [m for m in modulos_app() if importlib.util.find_spec(m) is not None]
+    comando = [sys.executable, '-X', 'importtime', '-c', 'import ' + ', '.join(modulos)]
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        processo = subprocess.run(comando, cwd=pasta, capture_output=True, text=True, check=True)
+        tempos.append(time.perf_counter() - inicio)
+
+    # Linhas "import time: próprio | acumulado | módulo"; sem recuo = primeiro nível
+    acumulados = {}
+    for linha in processo.stderr.splitlines():
+        partes = linha.split('|')
+        if len(partes) == 3 and not partes[2].startswith('  ') and partes[1].strip().isdigit():
+            acumulados[partes[2].strip()] = int(partes[1]) / 1000
+    maiores = sorted(acumulados.items(), key=lambda item: item[1], reverse=True)[:15]
+    return {
+        'segundos': round(statistics.median(tempos), 6),
+        'minimo': round(min(tempos), 6),
+        'repeticoes': repeticoes,
+        'modulos_ms': {nome: round(ms, 1) for nome, ms in maiores},
+    }
+
+
+# ---------- etapas ----------
+
+def relatorio(armazenamento, historico_precos):
+    # Mesmo caminho do menu Relatório com o filtro padrão (tudo): consulta, preços, totais, 1ª página
+    df_relatorio, totais = montar_relatorio(armazenamento, historico_precos)
+    return df_relatorio, totais, df_relatorio.iloc[ordem_relatorio(df_relatorio, 'Data', crescente=False)[:50]]
+
+
+def dashboard(armazenamento):
+    # Menu Análise com o filtro padrão: todas as filiais e produtos do último ano
+    resumo = armazenamento.carregar_resumo()
+    return montar_dashboard(resumo, ano=int(resumo['Ano'].max()))
+
+
+def executar(filiais, produtos, anos, backend, repeticoes=3, memoria=True, semente=0):
+    parametros = {'filiais': filiais, 'produtos': produtos, 'anos': anos, 'armazenamento': backend,
+                  'repeticoes': repeticoes, 'semente': semente}
+    resultados = {'importacoes': medir_importacoes(repeticoes)}
+    gerador = np.random.default_rng(semente + 3)
+
+    diretorio_original = os.getcwd()
+    trabalho = tempfile.mkdtemp(prefix='benchmark_quebras_')
+    os.environ[VARIAVEL_BACKEND] = backend
+    try:
+        # Tudo (partições, banco, precos.csv, exportações) fica no diretório temporário
+        os.chdir(trabalho)
+        df_precos = gerar_precos(produtos, semente)
+        df_precos.to_csv('precos.csv', index=False)
+        inicio = time.perf_counter()
+        historico = gerar_historico(filiais, df_precos, anos, semente=semente)
+        armazenamento = obter_armazenamento()
+        armazenamento.inserir(historico)
+        parametros['linhas'] = len(historico)
+        parametros['preparo_segundos'] = round(time.perf_counter() - inicio, 3)
+        del historico
+        historico_precos = armazenamento.carregar_historico_precos()
+        datas = pd.date_range(f"{2025 - anos + 1}-01-01", '2025-12-31', freq='D')
+
+        def carregar():
+            # Abertura a frio, como a primeira execução do app
+            df = obter_armazenamento().carregar()
+            return df, IndiceRegistros(df)
+
+        resultados['carregar'] = medir(carregar, repeticoes, memoria)
+        df, indice_registros = carregar()
+
+        # O que o app faz depois de uma gravação própria, em vez de recarregar tudo:
+        # inclusão e exclusão aplicadas à cópia em memória, e a tabela das sessões
+        conjunto = ConjuntoRegistros(df, armazenamento.versao())
+        excluir_memoria = iter(gerador.permutation(df['ID'].to_numpy()))
+
+        def em_memoria():
+            conjunto.inserir(df.iloc[[gerador.integers(len(df))]].assign(ID=novos_ids(1)))
+            conjunto.excluir(pd.DataFrame({'ID': [next(excluir_memoria)]}))
+            return conjunto.tabela()
+
+        resultados['memoria'] = medir(em_memoria, repeticoes, memoria)
+        del conjunto
+
+        def registrar():
+            novo = pd.DataFrame([{
+                'Data': datas[gerador.integers(len(datas))],
+                'Produto': df_precos['Produto'].iloc[gerador.integers(produtos)],
+                'Vendidos': int(gerador.integers(0, 50)),
+                'Quebra': int(gerador.integers(0, 5)),
+                'Filial': str(gerador.integers(1, filiais + 1)),
+            }])
+            novo, _ = calcular_metricas_vigentes(novo, historico_precos)
+            armazenamento.inserir(novo)
+
+        resultados['registrar'] = medir(registrar, repeticoes, memoria)
+
+        def editar():
+            # Localiza pelo índice de IDs e regrava o registro com novos valores
+            id_registro = df['ID'].iloc[gerador.integers(len(df))]
+            antigo = df.iloc[[indice_registros.posicao(id_registro)]]
+            novo = antigo.assign(Vendidos=float(gerador.integers(0, 50)))
+            novo, _ = calcular_metricas_vigentes(novo, historico_precos)
+            armazenamento.atualizar(antigo, novo)
+
+        resultados['editar'] = medir(editar, repeticoes, memoria)
+
+        # Cada exclusão apaga um registro diferente
+        excluir_ids = iter(gerador.permutation(df['ID'].to_numpy()))
+
+        def excluir():
+            id_registro = next(excluir_ids)
+            armazenamento.excluir(df.iloc[[indice_registros.posicao(id_registro)]], backup=True)
+
+        resultados['excluir'] = medir(excluir, repeticoes, memoria)
+
+        # Cada importação é uma filial diferente no mês seguinte ao histórico
+        conteudo = planilha_xlsx(df_precos, semente)
+        catalogo = CatalogoPrecos(df_precos)
+        livro = RegistroImportacoes(armazenamento.diretorio)
+        filiais_importacao = iter(range(1, filiais + 1))
+
+        def importar():
+            filial = str(next(filiais_importacao, filiais))
+            resultado = ler_planilha('sintetica.xlsx', conteudo)
+            if resultado['erro']:
+                raise RuntimeError(resultado['erro'])
+            registros, _ = montar_registros(resultado['planilha'], filial, 2026, 1, catalogo, historico_precos)
+            chave = (hash_conteudo(conteudo), filial, 2026, 1)
+            registros = registros.assign(ID=ids_importacao(*chave, registros['Produto']))
+            armazenamento.substituir(registros[['ID', 'Filial', 'Data']], registros)
+            livro.registrar([[*chave, 'sintetica.xlsx', len(registros), None, list(registros['ID'])]])
+
+        resultados['importar'] = medir(importar, repeticoes, memoria)
+
+        resultados['relatorio'] = medir(lambda: relatorio(armazenamento, historico_precos), repeticoes, memoria)
+        resultados['dashboard'] = medir(lambda: dashboard(armazenamento), repeticoes, memoria)
+        # Detecção sobre o resumo inteiro, como depois de uma importação
+        resultados['anomalias'] = medir(lambda: detectar_anomalias(armazenamento.carregar_resumo()), repeticoes, memoria)
+        # Previsão de todas as filiais e produtos sobre 8 semanas de lançamentos diários, já em memória
+        diario = gerar_diario(filiais, df_precos, semente=semente)
+        resultados['previsao'] = medir(lambda: sugerir_producao(diario, historico_precos), repeticoes, memoria)
+        del diario
+
+        # Exportação sem cache: cada chamada gera o arquivo de novo
+        df_relatorio = relatorio(armazenamento, historico_precos)[0]
+
+        def exportar_csv():
+            caminho = exportar(lambda: df_relatorio, 'CSV', assinatura(execucao=time.perf_counter_ns()))
+            os.remove(caminho)
+
+        resultados['exportar'] = medir(exportar_csv, repeticoes, memoria)
+
+        # Reajuste de todos os preços no meio do último ano; cada chamada recalcula um produto
+        vigencia = pd.Timestamp(2025, 7, 1)
+        reajustados = df_precos.assign(**{'Preço Venda Unitário': (df_precos['Preço Venda Unitário'] * 1.1).round(2)})
+        armazenamento.salvar_precos(reajustados, vigencia=vigencia)
+        historico_precos = armazenamento.carregar_historico_precos()
+        produtos_recalculo = itertools.cycle(df_precos['Produto'])
+
+        def recalcular():
+            recalcular_lucro(armazenamento, historico_precos, produtos=[next(produtos_recalculo)], inicio=vigencia)
+
+        resultados['recalcular'] = medir(recalcular, repeticoes, memoria)
+    finally:
+        os.chdir(diretorio_original)
+        shutil.rmtree(trabalho, ignore_errors=True)
+
+    return {
+        'quando': datetime.now().isoformat(timespec='seconds'),
+        'ambiente': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'plataforma': platform.platform(),
+        },
+        'parametros': parametros,
+        'pico_processo_mb': pico_processo_mb(),
+        'resultados': resultados,
+    }
+
+
+def comparar(atual, anterior):
+    # Razão atual/anterior por etapa (> 1 = mais lento)
+    linhas = []
+    for etapa in ETAPAS:
+        novo = atual['resultados'].get(etapa)
+        velho = anterior['resultados'].get(etapa)
+        if not novo or not velho or not velho['segundos']:
+            continue
+        linhas.append(f"  {etapa:<10} {velho['segundos']:>10.4f}s -> {novo['segundos']:>10.4f}s"
+                      f"  ({novo['segundos'] / velho['segundos']:.2f}x)")
+    return '\n'.join(linhas)
+
+
+def argumentos():
+    parser = argparse.ArgumentParser(description="Benchmark das operações do Controle de Quebras com dados sintéticos.")
+    parser.add_argument('--tamanho', choices=TAMANHOS, default='pequeno')
+    parser.add_argument('--filiais', type=int, help="substitui o número de filiais do tamanho")
+    parser.add_argument('--produtos', type=int, help="substitui o número de produtos do tamanho")
+    parser.add_argument('--anos', type=int, help="substitui o número de anos do tamanho")
+    parser.add_argument('--armazenamento', choices=['csv', 'parquet', 'sqlite'], default='csv')
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--semente', type=int, default=0)
+    parser.add_argument('--sem-memoria', action='store_true', help="não mede o pico de memória (mais rápido)")
+    parser.add_argument('--saida', help="arquivo JSON para gravar o resultado")
+    parser.add_argument('--comparar', help="resultado JSON anterior para comparar")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = argumentos()
+    filiais, produtos, anos = TAMANHOS[args.tamanho]
+    resultado = executar(
+        args.filiais or filiais, args.produtos or produtos, args.anos or anos,
+        args.armazenamento, repeticoes=args.repeticoes, memoria=not args.sem_memoria, semente=args.semente
+    )
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto + '\n')
+    print(texto)
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            print(f"\nComparação com {args.comparar}:")
+            print(comparar(resultado, json.load(arquivo)))
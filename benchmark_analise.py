@@ -0,0 +1,76 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from estilo_analise import REGRAS, estilizar, estilos_css, montar_analise
+
+# Compara o estilo por célula (função Python em cada valor) com o estilo vetorizado da Análise.
+# Uso: python benchmark_analise.py [filiais] [repeticoes]
+
+
+def resumo_sintetico(filiais, produtos=50, ano=2025, semente=0):
+    gerador = np.random.default_rng(semente)
+    chaves = pd.MultiIndex.from_product(
+        [[f"{f:03d}" for f in range(filiais)], [f"PRODUTO {p}" for p in range(produtos)], [ano], range(1, 13)],
+        names=['Filial', 'Produto', 'Ano', 'Mes']
+    ).to_frame(index=False)
+    n = len(chaves)
+    chaves['Quebra'] = gerador.integers(0, 20, n).astype(float)
+    chaves['Vendidos'] = gerador.integers(0, 200, n).astype(float)
+    chaves['Lucro Bruto'] = gerador.normal(50, 80, n).round(2)
+    chaves['Registros'] = 1
+    return chaves
+
+
+def css_por_celula(tabela, limite, acima, abaixo):
+    # Equivalente ao antigo applymap(lambda ...): uma chamada Python por célula
+    return tabela.apply(lambda coluna: coluna.map(lambda x: acima if x > limite else abaixo))
+
+
+def medir(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos) * 1000
+
+
+if __name__ == "__main__":
+    filiais = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    analise = montar_analise(resumo_sintetico(filiais))
+    celulas = sum(tabela.size for tabela, _ in analise['tabelas'].values())
+    print(f"{filiais} filiais, {celulas} células nas 4 tabelas (melhor de {repeticoes})")
+
+    def por_celula():
+        for nome, (tabela, _) in analise['tabelas'].items():
+            css_por_celula(tabela, *REGRAS[nome][1:])
+
+    def vetorizado():
+        for nome, (tabela, _) in analise['tabelas'].items():
+            estilos_css(tabela, *REGRAS[nome][1:])
+
+    print(f"  estilos por célula:   {medir(por_celula, repeticoes):8.2f} ms")
+    print(f"  estilos vetorizados:  {medir(vetorizado, repeticoes):8.2f} ms")
+
+    # Renderização completa (formato + estilos), como o st.dataframe faz; precisa do jinja2
+    try:
+        import jinja2  # noqa: F401
+    except ImportError:
+        sys.exit("jinja2 não instalado: renderização do Styler não medida.")
+
+    def renderizar_por_celula():
+        for nome, (tabela, _) in analise['tabelas'].items():
+            formato, limite, acima, abaixo = REGRAS[nome]
+            tabela.style.format(formato).map(lambda x: acima if x > limite else abaixo).to_html()
+
+    def renderizar_vetorizado():
+        for nome, (tabela, css) in analise['tabelas'].items():
+            estilizar(nome, tabela, css).to_html()
+
+    print(f"  render por célula:    {medir(renderizar_por_celula, repeticoes):8.2f} ms")
+    print(f"  render vetorizado:    {medir(renderizar_vetorizado, repeticoes):8.2f} ms")
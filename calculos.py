@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+COLUNAS_PRECO = ['Custo Unitário', 'Preço Venda Unitário']
+
+
+def percentual_quebra(vendidos, quebra):
+    vendidos = np.asarray(vendidos, dtype=float)
+    quebra = np.asarray(quebra, dtype=float)
+    total = vendidos + quebra
+    with np.errstate(divide='ignore', invalid='ignore'):
+        perc = np.where(total > 0, quebra / total * 100, 0.0)
+    return np.round(perc, 2)
+
+
+def lucro_bruto(vendidos, quebra, custo, preco_venda):
+    # Lucro Bruto = (Preço Venda × Vendidos) - (Custo × (Vendidos + Quebra))
+    vendidos = np.asarray(vendidos, dtype=float)
+    quebra = np.asarray(quebra, dtype=float)
+    return np.asarray(preco_venda, dtype=float) * vendidos - np.asarray(custo, dtype=float) * (vendidos + quebra)
+
+
+def chave_texto(serie):
+    # Chaves comparáveis dos dois lados do join: 14303, 14303.0 e "14303" viram "14303"
+    texto = serie.astype(str).str.strip()
+    numeros = pd.to_numeric(serie, errors='coerce')
+    inteiros = (numeros.notna() & (numeros % 1 == 0)).to_numpy()
+    if inteiros.any():
+        texto = texto.where(~inteiros, numeros.fillna(0).astype('int64').astype(str))
+    return texto.to_numpy()
+
+
+def precos_vigentes(df, historico, chaves=('Produto',)):
+    """Custo e preço de venda vigentes na Data de cada linha, como array (n, 2).
+
+    Junção as-of ordenada (merge_asof) por chave e data: vale a última
+    'Vigência' até a Data da linha. Antes da primeira vigência de um produto
+    vale o primeiro preço cadastrado. Sem preço: NaN.
+    """
+    chaves = list(chaves)
+    if df.empty or historico.empty:
+        return np.full((len(df), 2), np.nan)
+    esquerda = pd.DataFrame({chave: chave_texto(df[chave]) for chave in chaves})
+    esquerda['Data'] = pd.to_datetime(df['Data']).to_numpy()
+    esquerda['_posicao'] = np.arange(len(df))
+    esquerda = esquerda.sort_values('Data', kind='stable')
+
+    direita = pd.DataFrame({chave: chave_texto(historico[chave]) for chave in chaves})
+    direita['Vigência'] = pd.to_datetime(historico['Vigência']).to_numpy().astype(esquerda['Data'].dtype)
+    direita[COLUNAS_PRECO] = historico[COLUNAS_PRECO].astype(float).to_numpy()
+    # Ordem estável: na mesma vigência vale a última linha gravada
+    direita = direita.sort_values('Vigência', kind='stable')
+
+    juntos = pd.merge_asof(esquerda, direita, left_on='Data', right_on='Vigência', by=chaves, direction='backward')
+    antes = juntos['Vigência'].isna().to_numpy()
+    if antes.any():
+        primeiros = direita.drop_duplicates(subset=chaves, keep='first')
+        anteriores = pd.merge(juntos.loc[antes, chaves + ['_posicao']], primeiros, on=chaves, how='left')
+        juntos = pd.concat([juntos[~antes], anteriores], ignore_index=True)
+
+    valores = np.full((len(df), 2), np.nan)
+    valores[juntos['_posicao'].to_numpy()] = juntos[COLUNAS_PRECO].to_numpy(dtype=float)
+    return valores
+
+
+def _aplicar_precos(df, custo, preco_venda):
+    df['% Quebra'] = percentual_quebra(df['Vendidos'], df['Quebra'])
+    df['Lucro Bruto'] = lucro_bruto(df['Vendidos'], df['Quebra'], custo, preco_venda)
+    return df
+
+
+def _quantidades(df):
+    df = df.copy()
+    df['Vendidos'] = pd.to_numeric(df['Vendidos'], errors='coerce').fillna(0)
+    df['Quebra'] = pd.to_numeric(df['Quebra'], errors='coerce').fillna(0)
+    return df
+
+
+def calcular_metricas_vigentes(df, historico, chaves=('Produto',)):
+    """Preenche '% Quebra' e 'Lucro Bruto' com o preço vigente na Data de cada linha.
+
+    `historico` vem de carregar_historico_precos(). Produtos sem preço ficam
+    com Lucro Bruto nulo; a máscara devolvida (sem_preco) marca essas linhas.
+    """
+    df = _quantidades(df)
+    valores = precos_vigentes(df, historico, chaves)
+    sem_preco = np.isnan(valores).any(axis=1)
+    df = _aplicar_precos(df, valores[:, 0], valores[:, 1])
+    return df, pd.Series(sem_preco, index=df.index)
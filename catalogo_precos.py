@@ -0,0 +1,216 @@
+import io
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from calculos import COLUNAS_PRECO, chave_texto
+from precos import COLUNAS_PRECOS
+
+# Cabeçalhos aceitos na tabela do fornecedor, já normalizados (sem acento, maiúsculas)
+CABECALHOS_FORNECEDOR = {
+    'COD VIP': 'COD VIP', 'COD': 'COD VIP', 'CODIGO': 'COD VIP', 'CODIGO VIP': 'COD VIP',
+    'PRODUTO': 'Produto', 'DESCRICAO': 'Produto',
+    'CUSTO': 'Custo Unitário', 'CUSTO UNITARIO': 'Custo Unitário',
+    'PRECO VENDA': 'Preço Venda Unitário', 'PRECO VENDA UNITARIO': 'Preço Venda Unitário',
+    'PRECO': 'Preço Venda Unitário', 'VENDA': 'Preço Venda Unitário',
+}
+
+
+def normalizar_nome(texto):
+    # "Pão de  queijo." e "PAO DE QUEIJO" viram a mesma chave
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in texto.upper()).split())
+
+
+def normalizar_nomes(serie):
+    return (serie.astype(str).str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+            .str.upper().str.replace(r'[^A-Z0-9]+', ' ', regex=True).str.strip())
+
+
+class CatalogoPrecos:
+    """Tabela de preços indexada para buscas sem varrer as linhas.
+
+    - por COD VIP: pd.Index com tabela hash, busca O(1);
+    - secundário: nome do produto normalizado (sem acento, caixa ou
+      pontuação), usado quando o código não existe ou não foi informado.
+
+    Em códigos ou nomes repetidos vale o primeiro cadastro. As operações de
+    alteração não mexem no catálogo: devolvem a nova tabela para salvar_precos().
+    """
+
+    def __init__(self, df_precos):
+        self.df = df_precos.reindex(columns=COLUNAS_PRECOS).reset_index(drop=True)
+        self._por_codigo = self._indice(chave_texto(self.df['COD VIP']), self.df['COD VIP'].notna().to_numpy())
+        self._por_nome = self._indice(normalizar_nomes(self.df['Produto']).to_numpy(), self.df['Produto'].notna().to_numpy())
+
+    @staticmethod
+    def _indice(chaves, validas):
+        # Chave -> posição da primeira linha com ela
+        primeiras = validas & ~pd.Series(chaves).duplicated().to_numpy()
+        return pd.Series(np.flatnonzero(primeiras), index=pd.Index(chaves[primeiras]))
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def produtos(self):
+        # Um nome por produto (o primeiro cadastro de cada nome normalizado), na ordem da tabela
+        return list(self.df['Produto'].to_numpy()[self._por_nome.to_numpy()])
+
+    def opcao(self, produto):
+        """Posição do produto na lista `produtos` (índice de um selectbox); None se não cadastrado."""
+        posicao = self._por_nome.get(normalizar_nome(produto))
+        return None if posicao is None else int(np.searchsorted(self._por_nome.to_numpy(), posicao))
+
+    def posicao(self, cod_vip=None, produto=None):
+        """Posição da linha pelo código ou, sem código conhecido, pelo nome; None se não achar."""
+        if cod_vip is not None and not pd.isna(cod_vip) and str(cod_vip).strip():
+            posicao = self._por_codigo.get(chave_texto(pd.Series([cod_vip]))[0])
+            if posicao is not None:
+                return int(posicao)
+        if produto is not None and not pd.isna(produto):
+            posicao = self._por_nome.get(normalizar_nome(produto))
+            if posicao is not None:
+                return int(posicao)
+        return None
+
+    def posicoes(self, codigos, nomes):
+        """Como posicao() para colunas inteiras; -1 onde não achar."""
+        codigos = pd.Series(codigos).reset_index(drop=True)
+        posicoes = self._por_codigo.reindex(chave_texto(codigos)).to_numpy(dtype=float, copy=True)
+        posicoes[codigos.isna().to_numpy()] = np.nan
+        faltando = np.isnan(posicoes)
+        if faltando.any():
+            nomes = normalizar_nomes(pd.Series(nomes).reset_index(drop=True)[faltando])
+            posicoes[faltando] = self._por_nome.reindex(nomes.to_numpy()).to_numpy(dtype=float)
+        return np.where(np.isnan(posicoes), -1, posicoes).astype(int)
+
+    def linha(self, posicao):
+        return self.df.iloc[posicao]
+
+    def nome_cadastrado(self, produto):
+        # Grafia do catálogo para um nome digitado; o próprio nome se não houver
+        posicao = self.posicao(produto=produto)
+        return produto if posicao is None else self.df['Produto'].iloc[posicao]
+
+    def canonizar(self, planilha):
+        """Troca Produto pelo nome do catálogo, casando por COD VIP e depois pelo nome.
+
+        Devolve (planilha, encontrados): linhas sem cadastro mantêm o nome da planilha.
+        """
+        posicoes = self.posicoes(planilha['COD VIP'], planilha['Produto'])
+        encontrados = posicoes >= 0
+        planilha = planilha.copy()
+        nomes = planilha['Produto'].to_numpy(dtype=object, copy=True)
+        nomes[encontrados] = self.df['Produto'].to_numpy()[posicoes[encontrados]]
+        planilha['Produto'] = nomes
+        return planilha, pd.Series(encontrados, index=planilha.index)
+
+    # ---------- alterações ----------
+
+    def atualizar(self, posicao, valores):
+        df = self.df.astype({'COD VIP': object})
+        df.loc[posicao, list(valores)] = list(valores.values())
+        return _tipos(df)
+
+    def remover(self, posicao):
+        return self.df.drop(index=posicao).reset_index(drop=True)
+
+    def diferencas(self, novos):
+        """Prévia de uma carga em lote: uma linha por produto da tabela nova.
+
+        'Situação' é 'Novo', 'Alterado', 'Sem alteração' ou 'Ignorado: <motivo>'.
+        """
+        novos = novos.reindex(columns=COLUNAS_PRECOS).reset_index(drop=True)
+        posicoes = self.posicoes(novos['COD VIP'], novos['Produto'])
+        existe = posicoes >= 0
+        atuais = self.df.iloc[np.where(existe, posicoes, 0)].reset_index(drop=True) if len(self.df) else None
+
+        previa = pd.DataFrame({'COD VIP': novos['COD VIP'], 'Produto': novos['Produto']})
+        # Sem nome, ou com o mesmo nome em outra grafia, vale o nome já cadastrado
+        if atuais is not None:
+            mesmo_nome = (normalizar_nomes(previa['Produto']) == normalizar_nomes(atuais['Produto'])).to_numpy()
+            manter = existe & (previa['Produto'].isna().to_numpy() | mesmo_nome)
+            previa['Produto'] = previa['Produto'].where(~manter, atuais['Produto'])
+        for coluna in COLUNAS_PRECO:
+            atual = atuais[coluna].astype(float).where(existe) if atuais is not None else np.nan
+            previa[f"{coluna} atual"] = atual
+            previa[f"{coluna} novo"] = pd.to_numeric(novos[coluna], errors='coerce')
+
+        custo, venda = previa['Custo Unitário novo'], previa['Preço Venda Unitário novo']
+        mudou = ~existe
+        for coluna in COLUNAS_PRECO:
+            mudou |= ~np.isclose(previa[f"{coluna} atual"].to_numpy(dtype=float),
+                                 previa[f"{coluna} novo"].to_numpy(dtype=float), rtol=0, atol=0.005)
+        if atuais is not None:
+            mudou |= existe & (previa['Produto'].astype(str) != atuais['Produto'].astype(str)).to_numpy()
+            codigo_novo = novos['COD VIP'].notna().to_numpy()
+            mudou |= existe & codigo_novo & (chave_texto(novos['COD VIP']) != chave_texto(atuais['COD VIP']))
+
+        situacao = np.where(existe, np.where(mudou, 'Alterado', 'Sem alteração'), 'Novo').astype(object)
+        repetido = (chave_texto(novos['COD VIP']) != 'nan') & pd.Series(chave_texto(novos['COD VIP'])).duplicated(keep='last').to_numpy()
+        situacao[repetido] = 'Ignorado: código repetido na tabela'
+        situacao[(venda <= custo).to_numpy()] = 'Ignorado: preço de venda não é maior que o custo'
+        situacao[(custo.isna() | venda.isna()).to_numpy()] = 'Ignorado: custo ou preço vazio'
+        situacao[previa['Produto'].isna().to_numpy()] = 'Ignorado: produto novo sem nome'
+        previa['Situação'] = situacao
+        previa['_posicao'] = posicoes
+        return previa
+
+    def produtos_afetados(self, previa):
+        # Nome novo e nome cadastrado das linhas que mudam: os registros de ambos podem mudar de preço
+        mudancas = previa[previa['Situação'].isin(['Novo', 'Alterado'])]
+        cadastrados = mudancas['_posicao'].to_numpy()
+        cadastrados = self.df['Produto'].to_numpy()[cadastrados[cadastrados >= 0]]
+        return sorted(set(mudancas['Produto']) | set(cadastrados))
+
+    def aplicar(self, previa):
+        """Nova tabela com as linhas 'Novo' e 'Alterado' de diferencas()."""
+        linhas = previa.rename(columns={f"{coluna} novo": coluna for coluna in COLUNAS_PRECO})
+        df = self.df.astype({'COD VIP': object})
+        alterados = linhas[linhas['Situação'] == 'Alterado']
+        if not alterados.empty:
+            posicoes = alterados['_posicao'].to_numpy()
+            # Código vazio na tabela nova mantém o código cadastrado
+            codigos = alterados['COD VIP'].where(alterados['COD VIP'].notna(), df['COD VIP'].to_numpy()[posicoes])
+            df.iloc[posicoes] = alterados.assign(**{'COD VIP': codigos})[COLUNAS_PRECOS].to_numpy(dtype=object)
+        novos = linhas.loc[linhas['Situação'] == 'Novo', COLUNAS_PRECOS]
+        if not novos.empty:
+            df = pd.concat([df, novos.astype({'COD VIP': object})], ignore_index=True)
+        return _tipos(df)
+
+
+def _tipos(df_precos):
+    # COD VIP numérico quando possível, como no precos.csv
+    df_precos = df_precos.copy()
+    codigos = pd.to_numeric(df_precos['COD VIP'], errors='coerce')
+    if codigos.notna().all() and (codigos % 1 == 0).all():
+        df_precos['COD VIP'] = codigos.astype('int64')
+    df_precos[COLUNAS_PRECO] = df_precos[COLUNAS_PRECO].astype(float)
+    return df_precos
+
+
+def ler_tabela_fornecedor(nome, conteudo):
+    """Lê a tabela de preços do fornecedor (.csv, .xlsx ou .xls) no formato do precos.csv.
+
+    Aceita os cabeçalhos do precos.csv ou os da planilha de quebras (CÓD. VIP,
+    DESCRIÇÃO), com ou sem acento. COD VIP, custo e preço são obrigatórios.
+    """
+    if nome.lower().endswith('.csv'):
+        tabela = pd.read_csv(io.BytesIO(conteudo), sep=None, engine='python')
+    else:
+        tabela = pd.read_excel(io.BytesIO(conteudo))
+    colunas = {}
+    for coluna in tabela.columns:
+        destino = CABECALHOS_FORNECEDOR.get(normalizar_nome(coluna))
+        if destino is not None and destino not in colunas.values():
+            colunas[coluna] = destino
+    tabela = tabela[list(colunas)].rename(columns=colunas)
+    faltando = [c for c in ('COD VIP', 'Custo Unitário', 'Preço Venda Unitário') if c not in tabela.columns]
+    if faltando:
+        raise ValueError(f"Colunas ausentes na tabela de preços: {', '.join(faltando)}")
+    tabela = tabela.dropna(how='all')
+    if 'Produto' in tabela.columns:
+        tabela['Produto'] = tabela['Produto'].where(tabela['Produto'].isna(), tabela['Produto'].astype(str).str.strip())
+    return tabela.reindex(columns=COLUNAS_PRECOS)
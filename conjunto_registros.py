@@ -0,0 +1,256 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from armazenamento import COLUNAS, novos_ids
+
+COLUNAS_CATEGORIAS = ['Produto', 'Filial']
+COLUNAS_NUMERICAS = ['Inicial', 'Vendidos', 'Quebra', '% Quebra', 'Estoque Final', 'Lucro Bruto']
+
+CAPACIDADE_MINIMA = 1024
+# Compacta quando as linhas excluídas passam desta fração do total
+FRACAO_COMPACTACAO = 0.25
+
+
+class ConjuntoRegistros:
+    """Registros em memória, em colunas numpy pré-alocadas.
+
+    - Filial e Produto guardados como códigos de categoria, Data como datetime64;
+    - inserção no fim, dobrando a capacidade quando enche (O(1) amortizado por linha);
+    - exclusão só marca a linha (lápide); compactar() remove as marcadas;
+    - edição é lápide na linha antiga mais inserção da nova.
+
+    Nada é alterado no lugar: tabelas já entregues por tabela() continuam
+    valendo. Quem compartilha o conjunto entre sessões usa `trava`.
+    """
+
+    def __init__(self, df=None, versao=None):
+        self.trava = threading.RLock()
+        self.recarregar(df if df is not None else pd.DataFrame(columns=COLUNAS), versao)
+
+    def recarregar(self, df, versao=None):
+        self.versao = versao
+        self._n = 0
+        self._mortos = 0
+        self._colunas = self._alocar(max(CAPACIDADE_MINIMA, len(df)))
+        self._categorias = {coluna: pd.Index([], dtype=object) for coluna in COLUNAS_CATEGORIAS}
+        self._por_id = {}
+        self._tabela = None
+        self.inserir(df)
+
+    @staticmethod
+    def _alocar(capacidade):
+        colunas = {
+            'ID': np.empty(capacidade, dtype=object),
+            'Data': np.empty(capacidade, dtype='datetime64[ns]'),
+            '_vivo': np.zeros(capacidade, dtype=bool),
+        }
+        colunas.update({coluna: np.empty(capacidade, dtype=np.int32) for coluna in COLUNAS_CATEGORIAS})
+        colunas.update({coluna: np.empty(capacidade, dtype=float) for coluna in COLUNAS_NUMERICAS})
+        return colunas
+
+    def __len__(self):
+        return self._n - self._mortos
+
+    @property
+    def capacidade(self):
+        return len(self._colunas['ID'])
+
+    def _crescer(self, minimo):
+        # Arrays novos (e não resize no lugar): tabelas antigas ainda apontam para os atuais
+        capacidade = max(minimo, 2 * self.capacidade)
+        novas = self._alocar(capacidade)
+        for coluna, valores in self._colunas.items():
+            novas[coluna][:self._n] = valores[:self._n]
+        self._colunas = novas
+
+    def _codificar(self, coluna, valores):
+        # Categorias novas vão para o fim: os códigos já gravados não mudam
+        valores = pd.Series(valores, dtype=object).where(pd.notna(valores), None)
+        categorias = self._categorias[coluna]
+        novas = pd.Index(valores.dropna().unique()).difference(categorias, sort=False)
+        if len(novas):
+            categorias = self._categorias[coluna] = categorias.append(novas)
+        return categorias.get_indexer(valores)
+
+    # ---------- alterações ----------
+
+    def inserir(self, df):
+        if df.empty:
+            return
+        if df['ID'].isna().any():
+            raise ValueError("Registros sem ID não podem entrar no conjunto.")
+        df = df.reindex(columns=COLUNAS)
+        quantidade = len(df)
+        if self._n + quantidade > self.capacidade:
+            self._crescer(self._n + quantidade)
+        fatia = slice(self._n, self._n + quantidade)
+        colunas = self._colunas
+        ids = df['ID'].astype(str).to_numpy()
+        colunas['ID'][fatia] = ids
+        colunas['Data'][fatia] = pd.to_datetime(df['Data']).to_numpy(dtype='datetime64[ns]')
+        colunas['Produto'][fatia] = self._codificar('Produto', df['Produto'])
+        colunas['Filial'][fatia] = self._codificar('Filial', df['Filial'].where(df['Filial'].isna(), df['Filial'].astype(str)))
+        for coluna in COLUNAS_NUMERICAS:
+            colunas[coluna][fatia] = pd.to_numeric(df[coluna], errors='coerce').to_numpy(dtype=float)
+        colunas['_vivo'][fatia] = True
+
+        # ID repetido: vale a linha nova, a antiga vira lápide
+        repetidos = [self._por_id[i] for i in ids if i in self._por_id]
+        self._por_id.update(zip(ids, range(self._n, self._n + quantidade)))
+        self._n += quantidade
+        self._marcar(repetidos)
+
+    def _marcar(self, posicoes):
+        if posicoes:
+            self._colunas['_vivo'][posicoes] = False
+            self._mortos += len(posicoes)
+        self._tabela = None
+        if self._mortos > FRACAO_COMPACTACAO * self._n:
+            self.compactar()
+
+    def excluir(self, registros):
+        self._marcar([self._por_id.pop(i) for i in registros['ID'].astype(str) if i in self._por_id])
+
+    def atualizar(self, novos):
+        # Mesmo ID: a linha antiga vira lápide e a nova entra no fim
+        self.inserir(novos)
+
+    def substituir(self, remover, df_novos):
+        # Mesma regra do armazenamento: saem os registros com os IDs de `remover`
+        self.excluir(remover)
+        self.inserir(df_novos)
+
+    def trocar_particoes(self, particoes, df):
+        """Troca o conteúdo das partições (Filial, 'AAAA-MM') pelo de `df`, lido do armazenamento."""
+        filiais = self._categorias['Filial'].get_indexer(pd.Index([filial for filial, _ in particoes], dtype=object))
+        meses = pd.PeriodIndex([mes for _, mes in particoes], freq='M').asi8
+        # Chave numérica (código da filial, mês) para comparar todas as linhas de uma vez
+        alvo = filiais[filiais >= 0].astype(np.int64) * 100_000 + meses[filiais >= 0]
+        chaves = (self._colunas['Filial'][:self._n].astype(np.int64) * 100_000
+                  + self._colunas['Data'][:self._n].astype('datetime64[M]').astype(np.int64))
+        sair = np.isin(chaves, alvo) & self._colunas['_vivo'][:self._n]
+        posicoes = np.flatnonzero(sair)
+        for i in self._colunas['ID'][posicoes]:
+            self._por_id.pop(i, None)
+        self._marcar(list(posicoes))
+        self.inserir(df)
+
+    def compactar(self):
+        # Copia só as linhas vivas para arrays novos
+        vivos = np.flatnonzero(self._colunas['_vivo'][:self._n])
+        novas = self._alocar(max(CAPACIDADE_MINIMA, 2 * len(vivos)))
+        for coluna, valores in self._colunas.items():
+            novas[coluna][:len(vivos)] = valores[vivos]
+        self._colunas = novas
+        self._n = len(vivos)
+        self._mortos = 0
+        self._por_id = dict(zip(novas['ID'][:self._n], range(self._n)))
+        self._tabela = None
+
+    # ---------- leitura ----------
+
+    def tabela(self):
+        """DataFrame das linhas vivas, com Filial e Produto categóricos.
+
+        Sem lápides, as colunas são fatias dos arrays (sem cópia). Fica guardado
+        até a próxima alteração.
+        """
+        if self._tabela is None:
+            posicoes = slice(0, self._n) if not self._mortos else np.flatnonzero(self._colunas['_vivo'][:self._n])
+            colunas = {}
+            for coluna in COLUNAS:
+                valores = self._colunas[coluna][posicoes]
+                if coluna in COLUNAS_CATEGORIAS:
+                    valores = pd.Categorical.from_codes(valores, categories=self._categorias[coluna])
+                colunas[coluna] = valores
+            self._tabela = pd.DataFrame(colunas, copy=False)
+        return self._tabela
+
+
+class GravacaoIncremental:
+    """Armazenamento que repassa cada gravação também ao ConjuntoRegistros.
+
+    O resto da interface (leituras, versão, preços) vai direto ao
+    armazenamento. O conjunto só recebe a alteração se estava na versão de
+    antes da gravação e ela avançou a versão em exatamente um; senão (outro
+    processo gravou antes) fica para trás até o próximo sincronizar(), que
+    relê só as partições alteradas desde a versão dele.
+    """
+
+    def __init__(self, armazenamento, conjunto):
+        self.armazenamento = armazenamento
+        self.conjunto = conjunto
+
+    def __getattr__(self, nome):
+        return getattr(self.armazenamento, nome)
+
+    def sincronizar(self):
+        """Traz o conjunto para a versão atual do armazenamento.
+
+        Pelo registro de alterações relê só as partições que mudaram; sem ele
+        (primeira leitura, ou o conjunto ficou para trás demais) relê tudo.
+        Devolve 'atual', 'parcial' ou 'completa'.
+        """
+        while True:
+            # Leitura fora da trava do conjunto: as outras sessões continuam lendo a tabela atual
+            base, versao = self.conjunto.versao, self.armazenamento.versao()
+            if base == versao:
+                return 'atual'
+            particoes = None
+            if base is not None and base < versao:
+                particoes = self.armazenamento.alteracoes_desde(base, versao)
+            if particoes is None:
+                df = self.armazenamento.carregar()
+            else:
+                df = self.armazenamento.carregar_particoes(particoes)
+            if df['Data'].isna().any():
+                raise ValueError("Existem datas inválidas nos arquivos de dados. Corrija antes de continuar.")
+            with self.conjunto.trava:
+                # Outra sessão pode ter sincronizado enquanto esta lia: aí recomeça da versão nova
+                if self.conjunto.versao == base:
+                    if particoes is None:
+                        self.conjunto.recarregar(df, versao)
+                        return 'completa'
+                    self.conjunto.trocar_particoes(particoes, df)
+                    self.conjunto.versao = versao
+                    return 'parcial'
+
+    def _gravar(self, gravacao, aplicar):
+        # Trava de escrita antes da trava do conjunto, na mesma ordem da importação
+        with self.armazenamento.escrita(), self.conjunto.trava:
+            antes = self.armazenamento.versao()
+            gravacao()
+            depois = self.armazenamento.versao()
+            if self.conjunto.versao == antes and depois == antes + 1:
+                aplicar()
+                self.conjunto.versao = depois
+
+    @staticmethod
+    def _com_ids(df):
+        # IDs atribuídos aqui para o conjunto e o armazenamento gravarem os mesmos
+        sem_id = df['ID'].isna() if 'ID' in df.columns else pd.Series(True, index=df.index)
+        if not sem_id.any():
+            return df
+        df = df.assign(ID=df['ID'].astype(object) if 'ID' in df.columns else None)
+        df.loc[sem_id, 'ID'] = novos_ids(int(sem_id.sum()))
+        return df
+
+    def inserir(self, df_novos):
+        if df_novos.empty:
+            return
+        df_novos = self._com_ids(df_novos)
+        self._gravar(lambda: self.armazenamento.inserir(df_novos), lambda: self.conjunto.inserir(df_novos))
+
+    def atualizar(self, antigos, novos):
+        self._gravar(lambda: self.armazenamento.atualizar(antigos, novos), lambda: self.conjunto.atualizar(novos))
+
+    def excluir(self, registros, backup=False):
+        self._gravar(lambda: self.armazenamento.excluir(registros, backup=backup),
+                     lambda: self.conjunto.excluir(registros))
+
+    def substituir(self, remover, df_novos):
+        df_novos = self._com_ids(df_novos) if not df_novos.empty else df_novos
+        self._gravar(lambda: self.armazenamento.substituir(remover, df_novos),
+                     lambda: self.conjunto.substituir(remover, df_novos))
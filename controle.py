@@ -1,61 +1,293 @@
+import time
+inicio_execucao = time.perf_counter()  # antes das importações, para medir o custo delas
+
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 from datetime import datetime
 import os
-import io
-import numpy as np
-import shutil
 
-ARQUIVO_DADOS = 'dados_quebras.csv'
-ARQUIVO_PRECOS = 'precos.csv'
+from anomalias import detectar_anomalias
+from armazenamento import obter_armazenamento
+from calculos import calcular_metricas_vigentes
+from catalogo_precos import CatalogoPrecos, ler_tabela_fornecedor
+from conjunto_registros import ConjuntoRegistros, GravacaoIncremental
+from estilo_analise import estilizar
+from exportacao import assinatura, caminho_exportacao, exportar, formatos_disponiveis, nome_arquivo, tipo_mime
+from indice_registros import IndiceRegistros
+from importacao import expandir_arquivos
+from medicao import LIMITE_LENTO, Medidor
+from previsao import JANELA_DIAS, MINIMO_DIAS, sugerir_producao
+from servicos import montar_dashboard, montar_relatorio, ordem_relatorio
+from tarefas import CANCELADA, CONCLUIDA, ERRO, EXECUTANDO, PENDENTE, FilaTarefas, iniciar_trabalhadores
+
+# Primeiro comando do Streamlit, antes de qualquer leitura de dados
+st.set_page_config(page_title="Controle de Quebras", layout="wide")
+
+# Tempos por etapa desta execução; as lentas vão para execucoes_lentas.jsonl
+medidor = Medidor(
+    limite=float(os.environ.get('CONTROLE_LIMITE_LENTO', LIMITE_LENTO)),
+    perfil=os.environ.get('CONTROLE_PERFIL') == '1',
+    inicio=inicio_execucao
+)
+# Só a primeira execução do processo paga as importações; nas seguintes os módulos já estão carregados
+medidor.adicionar('importar módulos', time.perf_counter() - inicio_execucao)
+
+# Com Copy-on-Write, a visão rasa entregue a cada sessão nunca altera a cópia compartilhada
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+
+@st.cache_resource(show_spinner=False)
+def _conjunto_compartilhado(diretorio):
+    # Registros em memória, um por processo: as gravações do app o atualizam
+    # no lugar; só gravações de fora (outro processo, lote.py) fazem recarregar
+    return ConjuntoRegistros()
+
+
+with medidor.etapa('abrir armazenamento'):
+    armazenamento = obter_armazenamento()
+    armazenamento = GravacaoIncremental(armazenamento, _conjunto_compartilhado(armazenamento.diretorio))
+
+
+@st.cache_resource(show_spinner=False)
+def _fila_tarefas(diretorio):
+    # Threads que executam a fila de tarefas, uma vez por processo. Com
+    # CONTROLE_TRABALHADORES_TAREFAS=0 quem executa é `python lote.py fila --continuo`
+    fila = FilaTarefas()
+    quantidade = int(os.environ.get('CONTROLE_TRABALHADORES_TAREFAS', 1))
+    if quantidade > 0:
+        # Mesmo conjunto em memória das sessões: as gravações das tarefas chegam a ele sem releitura
+        iniciar_trabalhadores(fila, GravacaoIncremental(obter_armazenamento(), _conjunto_compartilhado(diretorio)), quantidade)
+    return fila
+
+
+fila_tarefas = _fila_tarefas(armazenamento.diretorio)
+
+
+# Cache do processo, compartilhado por todas as sessões. A chave inclui a versão
+# dos arquivos: qualquer gravação invalida a entrada e a próxima leitura recarrega.
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _resumo_compartilhado(_armazenamento, diretorio, versao):
+    return _armazenamento.carregar_resumo()
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _catalogo_compartilhado(_armazenamento, diretorio, versao):
+    # Preços indexados por COD VIP e por nome normalizado
+    return CatalogoPrecos(_armazenamento.carregar_precos())
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _historico_compartilhado(_armazenamento, diretorio, versao):
+    # Histórico de preços com vigência, para os cálculos pelo preço da data
+    return _armazenamento.carregar_historico_precos()
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _indice_registros_compartilhado(_df, diretorio, versao):
+    # Índices por ID e por (Filial, Data, Produto) para os seletores de registro
+    return IndiceRegistros(_df)
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _relatorio_compartilhado(_armazenamento, diretorio, versao, versao_precos, filiais, produtos, inicio, fim):
+    historico = _historico_compartilhado(_armazenamento, diretorio, versao_precos)
+    return montar_relatorio(_armazenamento, historico, filiais, produtos, inicio, fim)
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _ordem_relatorio(_armazenamento, diretorio, versao, versao_precos, filiais, produtos, inicio, fim, ordenar_por, crescente):
+    # Ordem das linhas do relatório, calculada uma vez por filtro e coluna
+    df_relatorio, _ = _relatorio_compartilhado(_armazenamento, diretorio, versao, versao_precos, filiais, produtos, inicio, fim)
+    return ordem_relatorio(df_relatorio, ordenar_por, crescente)
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _analise_compartilhada(_armazenamento, diretorio, versao, filiais, produtos, ano):
+    # Tabelas, estilos e totais do dashboard por filtro; as abas reutilizam o mesmo resultado
+    return montar_dashboard(_resumo_compartilhado(_armazenamento, diretorio, versao), filiais, produtos, ano)
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _alertas_compartilhados(_armazenamento, diretorio, versao):
+    # Anomalias de todas as filiais e produtos, recalculadas só quando chegam dados novos
+    return detectar_anomalias(_resumo_compartilhado(_armazenamento, diretorio, versao))
 
-# Inicializar o estado da sessão
-if 'df' not in st.session_state:
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _sugestoes_compartilhadas(_armazenamento, _df, diretorio, versao_conjunto, versao_precos):
+    # Previsão de todas as filiais e produtos, refeita só quando chegam registros ou preços novos.
+    # A chave é a versão do conjunto de onde saiu `_df`, não a lida do armazenamento no início
+    # da execução: uma gravação entre as duas leituras guardaria dados antigos na chave nova
+    return sugerir_producao(_df, _historico_compartilhado(_armazenamento, diretorio, versao_precos))
+
+
+# Uma única leitura das versões por execução, para dados e índices baterem
+versao_dados = armazenamento.versao()
+versao_precos = armazenamento.versao_precos()
+
+
+# Os dados são lidos sob demanda, só nos menus que precisam deles
+def dados():
+    conjunto = armazenamento.conjunto
     try:
-        st.session_state.df = pd.read_csv(ARQUIVO_DADOS, dtype={'Filial': str})
-        st.session_state.df['Data'] = pd.to_datetime(st.session_state.df['Data'], errors='coerce')
-        
-        # Verificar datas inválidas
-        if st.session_state.df['Data'].isna().any():
-            st.error("Existem datas inválidas no arquivo CSV. Corrija antes de continuar.")
-            st.stop()
-    except FileNotFoundError:
-        st.error(f"Arquivo {ARQUIVO_DADOS} não encontrado.")
+        # Leitura completa só na primeira vez; depois de gravações de outros
+        # processos (workers, lote.py), só as partições que eles alteraram
+        inicio = time.perf_counter()
+        sincronizacao = armazenamento.sincronizar()
+        medidor.adicionar(f"carregar dados ({sincronizacao})", time.perf_counter() - inicio)
+        with conjunto.trava:
+            # Visão rasa (sem copiar os dados) da tabela compartilhada
+            df = conjunto.tabela().copy(deep=False)
+            versao_conjunto = conjunto.versao
+        with medidor.etapa('índice de registros'):
+            indice_registros = _indice_registros_compartilhado(df, armazenamento.diretorio, versao_conjunto)
+    except (FileNotFoundError, ValueError) as e:
+        st.error(str(e))
+        st.stop()
+    return df, indice_registros, versao_conjunto
+
+
+def precos_atuais():
+    with medidor.etapa('carregar preços'):
+        catalogo = _catalogo_compartilhado(armazenamento, armazenamento.diretorio, versao_precos)
+        historico = _historico_compartilhado(armazenamento, armazenamento.diretorio, versao_precos)
+    return catalogo, historico
+
+
+def salvar_precos(df_precos, vigencia, produtos):
+    # Grava a tabela na hora; o recálculo do Lucro Bruto dos produtos alterados
+    # a partir da vigência vai para a fila de tarefas
+    with medidor.etapa('gravar preços'):
+        armazenamento.salvar_precos(df_precos, vigencia=vigencia)
+    produtos = [str(produto) for produto in produtos]
+    st.session_state['tarefa_recalculo'] = fila_tarefas.enviar(
+        'recalcular', f"Recálculo do Lucro Bruto de {len(produtos)} produto(s)",
+        {'produtos': produtos, 'inicio': str(pd.Timestamp(vigencia).date())}
+    )
+
+
+def acompanhar_tarefa(id_tarefa):
+    # Tarefa enviada por esta sessão: andamento enquanto roda, resultado quando termina
+    tarefa = fila_tarefas.obter(id_tarefa) if id_tarefa else None
+    if tarefa is None:
+        return
+    situacao = tarefa['Situação']
+    if situacao in (PENDENTE, EXECUTANDO):
+        _andamento_tarefa(id_tarefa)
+        return
+
+    mensagem = f"{tarefa['Descrição']}: {tarefa['Mensagem']}"
+    if situacao == CONCLUIDA:
+        st.success(mensagem)
+    elif situacao == ERRO:
+        st.error(mensagem)
+    else:
+        st.info(mensagem)
+    resultados = fila_tarefas.resultados(id_tarefa)
+    if 'situacao' in resultados:
+        st.dataframe(resultados['situacao'], hide_index=True, use_container_width=True)
+    alertas = resultados.get('alertas')
+    if alertas is not None and not alertas.empty:
+        st.warning(f"{len(alertas)} alerta(s) de quebra acima do esperado nos meses importados. Veja o menu Alertas.")
+        st.dataframe(alertas, hide_index=True, use_container_width=True)
+    if situacao in (ERRO, CANCELADA) and st.button("Tentar de novo", key=f"repetir_{id_tarefa}"):
+        fila_tarefas.repetir(id_tarefa)
+        reexecutar()
+
+
+@st.fragment(run_every=2)
+def _andamento_tarefa(id_tarefa):
+    # Só este trecho da página é atualizado enquanto a tarefa roda; quando ela
+    # termina, a página inteira é executada de novo para ler o que foi gravado
+    tarefa = fila_tarefas.obter(id_tarefa)
+    if tarefa['Situação'] not in (PENDENTE, EXECUTANDO):
+        st.rerun()
+    etapa = tarefa['Etapa'] or ("aguardando na fila" if tarefa['Situação'] == PENDENTE else "começando")
+    st.progress(tarefa['Progresso'], text=f"{tarefa['Descrição']}: {etapa}")
+    if tarefa['Cancelar']:
+        st.caption("Cancelamento pedido: a tarefa para na próxima etapa, se ainda não começou a gravar.")
+    elif st.button("Cancelar tarefa", key=f"cancelar_{id_tarefa}"):
+        fila_tarefas.cancelar(id_tarefa)
+        st.rerun(scope='fragment')
+
+
+def resumo_atual():
+    # Resumo mensal: basta para listas de filiais/produtos e para o período dos filtros
+    try:
+        with medidor.etapa('resumo mensal'):
+            return _resumo_compartilhado(armazenamento, armazenamento.diretorio, versao_dados)
+    except (FileNotFoundError, ValueError) as e:
+        st.error(str(e))
         st.stop()
 
-# Carrega dados de preços
-if os.path.exists(ARQUIVO_PRECOS):
-    df_precos = pd.read_csv(ARQUIVO_PRECOS)
-    # Tratar NaN na coluna 'Produto'
-    df_precos['Produto'] = df_precos['Produto'].fillna('Desconhecido')
-else:
-    df_precos = pd.DataFrame(columns=['COD VIP', 'Produto', 'Custo Unitário', 'Preço Venda Unitário'])
 
-st.set_page_config(page_title="Controle de Quebras", layout="wide")
-st.title("📉 Controle de Quebras de Salgados")
+def reexecutar():
+    # st.rerun interrompe o script: os tempos desta execução são fechados antes
+    medidor.finalizar()
+    st.rerun()
+
+
+def selecionar_registro(chave, rotulo):
+    # Busca e paginação sobre o índice: só a página visível vira texto de resumo
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        texto = st.text_input("Buscar produto", key=f"{chave}_texto")
+    with col2:
+        filial_busca = st.selectbox("Filial", ["Todas"] + sorted(df['Filial'].unique()), key=f"{chave}_filial")
+    with col3:
+        data_busca = st.date_input("Data", value=None, key=f"{chave}_data")
+
+    with medidor.etapa('buscar registros'):
+        posicoes = indice_registros.buscar(
+            filial=None if filial_busca == "Todas" else filial_busca,
+            data=data_busca,
+            texto=texto or None
+        )
+    if len(posicoes) == 0:
+        st.warning("Nenhum registro encontrado para a busca.")
+        return None
+
+    total_paginas = IndiceRegistros.total_paginas(posicoes)
+    pagina = st.number_input(f"Página (de {total_paginas}, {len(posicoes)} registros)", min_value=1, max_value=total_paginas, value=1, step=1, key=f"{chave}_pagina")
+    visiveis = indice_registros.pagina(posicoes, int(pagina))
+    resumos = {
+        id_registro: f"{data.date()} | {produto} | {filial} | {vendidos:g} vendidos | {quebra:g} quebras"
+        for id_registro, data, produto, filial, vendidos, quebra in zip(
+            visiveis['ID'], visiveis['Data'], visiveis['Produto'], visiveis['Filial'], visiveis['Vendidos'], visiveis['Quebra']
+        )
+    }
+    return st.selectbox(rotulo, list(resumos), format_func=resumos.get, key=f"{chave}_registro")
 
-menu = st.sidebar.selectbox("Menu", ["Registrar Quebra", "Relatório", "Análise", "Importar Planilha", "Preços"])
+st.title("📉 Controle de Quebras de Salgados")
 
-# Atualizar o DataFrame global
-df = st.session_state.df
+menu = st.sidebar.selectbox("Menu", ["Registrar Quebra", "Relatório", "Análise", "Alertas", "Produção", "Importar Planilha", "Preços", "Tarefas"])
+medidor.menu = menu
 
 if menu == "Registrar Quebra":
     st.header("➕ Registrar, Editar ou Excluir Quebra")
 
-    modo = st.radio("Modo", ["Novo Registro", "Editar Registro Existente", "Excluir Registro"])
+    modo = st.radio("Modo", ["Novo Registro", "Registro em Lote", "Editar Registro Existente", "Excluir Registro"])
+
+    catalogo, historico = precos_atuais()
+    if modo in ("Editar Registro Existente", "Excluir Registro"):
+        # Só editar e excluir precisam das linhas e dos índices de registros
+        df, indice_registros, _ = dados()
+    else:
+        filiais_registradas = list(resumo_atual()['Filial'].unique())
 
     if modo == "Novo Registro":
         with st.form("form_quebra"):
             data = st.date_input("Data", value=datetime.today())
-            produto = st.selectbox("Produto", options=[""] + list(df_precos['Produto'].unique()), help="Selecione um produto ou digite um novo")
+            produto = st.selectbox("Produto", options=[""] + catalogo.produtos, help="Selecione um produto ou digite um novo")
             if not produto:
-                produto_novo = st.text_input("Novo Produto (se não listado)")
+                # Nome digitado em outra grafia de um produto cadastrado usa o nome do cadastro
+                produto_novo = catalogo.nome_cadastrado(st.text_input("Novo Produto (se não listado)"))
             else:
                 produto_novo = produto
             vendidos = st.number_input("Vendidos", min_value=0, step=1)
             quebra = st.number_input("Quebra", min_value=0, step=1)
-            filial = st.selectbox("Filial", options=[""] + list(df['Filial'].unique()), help="Selecione uma filial ou digite uma nova")
+            filial = st.selectbox("Filial", options=[""] + filiais_registradas, help="Selecione uma filial ou digite uma nova")
             if not filial:
                 filial_nova = st.text_input("Nova Filial (se não listada)")
             else:
@@ -68,46 +300,99 @@ if menu == "Registrar Quebra":
                 elif not filial_nova:
                     st.error("O campo Filial é obrigatório.")
                 else:
-                    total = vendidos + quebra
-                    perc_quebra = (quebra / total) * 100 if total > 0 else 0
-
-                    # Calcular Lucro Bruto
-                    preco_info = df_precos[df_precos['Produto'] == produto_novo]
-                    if not preco_info.empty:
-                        custo_unit = preco_info['Custo Unitário'].iloc[0]
-                        preco_venda = preco_info['Preço Venda Unitário'].iloc[0]
-                        lucro_bruto = (preco_venda * vendidos) - (custo_unit * (vendidos + quebra))
-                    else:
-                        st.warning(f"Produto {produto_novo} sem preço cadastrado. Lucro Bruto será None.")
-                        lucro_bruto = None
-
                     novo_registro = pd.DataFrame([{
-                        'Data': data,
+                        'Data': pd.Timestamp(data),
                         'Produto': produto_novo,
                         'Vendidos': vendidos,
                         'Quebra': quebra,
-                        '% Quebra': round(perc_quebra, 2),
-                        'Filial': filial_nova,
-                        'Lucro Bruto': lucro_bruto
+                        'Filial': filial_nova
                     }])
 
-                    df = pd.concat([df, novo_registro], ignore_index=True)
-                    df.to_csv(ARQUIVO_DADOS, index=False)
+                    # Calcular % Quebra e Lucro Bruto
+                    with medidor.etapa('calcular métricas'):
+                        novo_registro, sem_preco = calcular_metricas_vigentes(novo_registro, historico)
+                    if sem_preco.any():
+                        st.warning(f"Produto {produto_novo} sem preço cadastrado. Lucro Bruto será None.")
+
+                    with medidor.etapa('gravar'):
+                        armazenamento.inserir(novo_registro)
                     st.success("Registro adicionado com sucesso!")
 
+    elif modo == "Registro em Lote":
+        # Um dia inteiro de uma filial: todos os produtos em uma grade, salvos de uma vez
+        col1, col2 = st.columns(2)
+        with col1:
+            data = st.date_input("Data", value=datetime.today())
+        with col2:
+            filial = st.selectbox("Filial", options=[""] + filiais_registradas, help="Selecione uma filial ou digite uma nova")
+            if not filial:
+                filial = st.text_input("Nova Filial (se não listada)")
+
+        grade = pd.DataFrame({
+            'Produto': catalogo.produtos,
+            'Vendidos': 0,
+            'Quebra': 0
+        })
+
+        with st.form("form_quebra_lote"):
+            grade_editada = st.data_editor(
+                grade,
+                hide_index=True,
+                num_rows="dynamic",
+                use_container_width=True,
+                column_config={
+                    'Vendidos': st.column_config.NumberColumn(min_value=0, step=1),
+                    'Quebra': st.column_config.NumberColumn(min_value=0, step=1)
+                }
+            )
+            incluir_zerados = st.checkbox("Registrar também produtos sem venda e sem quebra")
+            submit = st.form_submit_button("Registrar Lote")
+
+            if submit:
+                lote = grade_editada.dropna(subset=['Produto'])
+                lote = lote[lote['Produto'].astype(str).str.strip() != ""]
+                if not incluir_zerados:
+                    lote = lote[(lote['Vendidos'].fillna(0) > 0) | (lote['Quebra'].fillna(0) > 0)]
+
+                if not filial:
+                    st.error("O campo Filial é obrigatório.")
+                elif lote.empty:
+                    st.warning("Nenhum produto com quantidade informada.")
+                else:
+                    lote = lote.assign(Data=pd.Timestamp(data), Filial=filial,
+                                       Produto=[catalogo.nome_cadastrado(p) for p in lote['Produto']])
+
+                    # Calcular % Quebra e Lucro Bruto de todas as linhas de uma vez
+                    with medidor.etapa('calcular métricas'):
+                        lote, sem_preco = calcular_metricas_vigentes(lote, historico)
+                    if sem_preco.any():
+                        st.warning(f"Produtos sem preço cadastrado (Lucro Bruto será None): {', '.join(lote.loc[sem_preco, 'Produto'])}")
+
+                    with medidor.etapa('gravar'):
+                        armazenamento.inserir(lote)
+                    st.success(f"{len(lote)} registros adicionados com sucesso!")
+
     elif modo == "Editar Registro Existente" and not df.empty:
-        df_sorted = df.sort_values(by="Data", ascending=False)
-        df_sorted['Resumo'] = df_sorted.apply(lambda x: f"{x['Data'].date()} | {x['Produto']} | {x['Filial']}", axis=1)
-        selecao = st.selectbox("Selecione um registro para editar", df_sorted['Resumo'])
+        id_selecionado = selecionar_registro("editar", "Selecione um registro para editar")
+        if id_selecionado is None:
+            st.stop()
 
-        idx = df_sorted[df_sorted['Resumo'] == selecao].index[0]
+        idx = indice_registros.rotulo(id_selecionado)
         registro = df.loc[idx]
+        # Registro de onde saíram os valores do formulário que o usuário está vendo
+        # (o da execução anterior): se outra sessão o alterar antes do "Salvar", a
+        # gravação recusa em vez de sobrescrever. O formulário desta execução é
+        # montado com a linha atual, que vira a referência do próximo "Salvar"
+        abertos = st.session_state.setdefault('registros_abertos', {})
+        original = abertos.get(id_selecionado, df.loc[[idx]])
+        abertos[id_selecionado] = df.loc[[idx]]
 
         with st.form("form_editar_quebra"):
             data = st.date_input("Data", value=pd.to_datetime(registro['Data']))
-            produto = st.selectbox("Produto", options=[""] + list(df_precos['Produto'].unique()), index=0 if registro['Produto'] not in df_precos['Produto'].unique() else list(df_precos['Produto'].unique()).index(registro['Produto']) + 1)
+            opcao = catalogo.opcao(registro['Produto'])
+            produto = st.selectbox("Produto", options=[""] + catalogo.produtos, index=0 if opcao is None else opcao + 1)
             if not produto:
-                produto_novo = st.text_input("Novo Produto (se não listado)", value=registro['Produto'])
+                produto_novo = catalogo.nome_cadastrado(st.text_input("Novo Produto (se não listado)", value=registro['Produto']))
             else:
                 produto_novo = produto
             vendidos = st.number_input("Vendidos", min_value=0, step=1, value=int(registro['Vendidos']))
@@ -126,33 +411,31 @@ if menu == "Registrar Quebra":
                     elif not filial_nova:
                         st.error("O campo Filial é obrigatório.")
                     else:
-                        total = vendidos + quebra
-                        perc_quebra = (quebra / total) * 100 if total > 0 else 0
-
-                        # Calcular Lucro Bruto
-                        preco_info = df_precos[df_precos['Produto'] == produto_novo]
-                        if not preco_info.empty:
-                            custo_unit = preco_info['Custo Unitário'].iloc[0]
-                            preco_venda = preco_info['Preço Venda Unitário'].iloc[0]
-                            lucro_bruto = (preco_venda * vendidos) - (custo_unit * (vendidos + quebra))
-                        else:
-                            st.warning(f"Produto {produto_novo} sem preço cadastrado. Lucro Bruto será None.")
-                            lucro_bruto = None
-
-                        df.loc[idx, :] = {
-                            'Data': data,
+                        registro_editado = pd.DataFrame([{
+                            'Data': pd.Timestamp(data),
                             'Produto': produto_novo,
                             'Vendidos': vendidos,
                             'Quebra': quebra,
-                            '% Quebra': round(perc_quebra, 2),
-                            'Filial': filial_nova,
-                            'Lucro Bruto': lucro_bruto
-                        }
+                            'Filial': filial_nova
+                        }])
+
+                        # Calcular % Quebra e Lucro Bruto
+                        with medidor.etapa('calcular métricas'):
+                            registro_editado, sem_preco = calcular_metricas_vigentes(registro_editado, historico)
+                        if sem_preco.any():
+                            st.warning(f"Produto {produto_novo} sem preço cadastrado. Lucro Bruto será None.")
 
-                        df.to_csv(ARQUIVO_DADOS, index=False)
-                        st.session_state.df = df
+                        # Mesmo ID, novos valores (a data ou a filial podem ter mudado de partição)
+                        for coluna in ('ID', 'Inicial', 'Estoque Final'):
+                            registro_editado[coluna] = registro[coluna]
+                        with medidor.etapa('gravar'):
+                            try:
+                                armazenamento.atualizar(original, registro_editado)
+                            finally:
+                                # Gravado ou recusado, a próxima abertura parte do registro atual
+                                abertos.pop(id_selecionado, None)
                         st.success("Registro atualizado com sucesso!")
-                        st.rerun()
+                        reexecutar()
                 except Exception as e:
                     st.error(f"Erro ao atualizar registro: {str(e)}")
 
@@ -164,20 +447,13 @@ if menu == "Registrar Quebra":
                                 ["Excluir Registro Individual", "Excluir por Período e Filial"])
         
         if tipo_exclusao == "Excluir Registro Individual":
-            # Ordenar registros por data (mais recentes primeiro)
-            df_sorted = df.sort_values(by="Data", ascending=False)
-            
-            # Criar resumo para exibição
-            df_sorted['Resumo'] = df_sorted.apply(
-                lambda x: f"{x['Data'].date()} | {x['Produto']} | {x['Filial']} | {x['Vendidos']} vendidos | {x['Quebra']} quebras",
-                axis=1
-            )
-            
             # Selecionar registro
-            selecao = st.selectbox("Selecione um registro para excluir:", df_sorted['Resumo'])
-            
-            # Encontrar índice do registro selecionado
-            idx = df_sorted[df_sorted['Resumo'] == selecao].index[0]
+            id_selecionado = selecionar_registro("excluir", "Selecione um registro para excluir:")
+            if id_selecionado is None:
+                st.stop()
+
+            # Localizar o registro pelo ID
+            idx = indice_registros.rotulo(id_selecionado)
             
             # Exibir detalhes do registro
             st.subheader("Detalhes do Registro Selecionado:")
@@ -186,20 +462,12 @@ if menu == "Registrar Quebra":
             # Botão de confirmação
             if st.button("Confirmar Exclusão do Registro"):
                 try:
-                    # Criar backup
-                    shutil.copy(ARQUIVO_DADOS, ARQUIVO_DADOS + ".backup")
-                    
-                    # Excluir registro
-                    df_novo = df.drop(idx).reset_index(drop=True)
-                    
-                    # Salvar alterações
-                    df_novo.to_csv(ARQUIVO_DADOS, index=False)
-                    
-                    # Atualizar o DataFrame na sessão
-                    st.session_state.df = df_novo
+                    # Excluir registro (só a partição dele é regravada, com backup)
+                    with medidor.etapa('gravar'):
+                        armazenamento.excluir(df.loc[[idx]], backup=True)
                     
                     st.success("Registro excluído com sucesso!")
-                    st.rerun()
+                    reexecutar()
                     
                 except Exception as e:
                     st.error(f"Erro ao excluir registro: {e}")
@@ -226,8 +494,9 @@ if menu == "Registrar Quebra":
             fim = pd.to_datetime(data_fim)
             
             # Criar máscara de filtro
-            mask = (df['Data'] >= inicio) & (df['Data'] <= fim) & (df['Filial'].isin(filiais))
-            registros_filtrados = df[mask]
+            with medidor.etapa('filtrar'):
+                mask = (df['Data'] >= inicio) & (df['Data'] <= fim) & (df['Filial'].isin(filiais))
+                registros_filtrados = df[mask]
             
             if not registros_filtrados.empty:
                 st.subheader("Registros Encontrados:")
@@ -237,70 +506,88 @@ if menu == "Registrar Quebra":
                 # Botão de confirmação
                 if st.button("Confirmar Exclusão dos Registros"):
                     try:
-                        # Excluir registros
-                        df_novo = df[~mask].copy()
-                        
-                        # Salvar alterações
-                        df_novo.to_csv(ARQUIVO_DADOS, index=False)
-                        
-                        # Atualizar o DataFrame na sessão
-                        st.session_state.df = df_novo
-                        
-                        st.success(f"{len(registros_filtrados)} registros excluídos com sucesso!")
-                        st.rerun()
-                        
+                        # Exclusão na fila de tarefas, só dos registros conferidos acima
+                        # (só as partições envolvidas são regravadas, com backup)
+                        st.session_state['tarefa_exclusao'] = fila_tarefas.enviar(
+                            'excluir_periodo', f"Exclusão de {len(registros_filtrados)} registros",
+                            {'filiais': [str(f) for f in filiais], 'inicio': str(inicio.date()), 'fim': str(fim.date()),
+                             'ids': registros_filtrados['ID'].astype(str).tolist()}
+                        )
                     except Exception as e:
                         st.error(f"Erro ao excluir registros: {str(e)}")
             else:
                 st.warning("Nenhum registro encontrado para os critérios selecionados.")
+            acompanhar_tarefa(st.session_state.get('tarefa_exclusao'))
 
 elif menu == "Relatório":
     st.header("📊 Relatório de Quebras")
 
-    if not df.empty:
-        df['Data'] = pd.to_datetime(df['Data'])
+    # Opções dos filtros tiradas do resumo mensal; as linhas só são lidas para o filtro escolhido
+    resumo = resumo_atual()
+    if not resumo.empty:
+        meses = pd.to_datetime(pd.DataFrame({'year': resumo['Ano'], 'month': resumo['Mes'], 'day': 1}))
 
-        filial = st.multiselect("Filial", df['Filial'].unique(), default=list(df['Filial'].unique()))
-        produtos = st.multiselect("Produto", df['Produto'].unique(), default=list(df['Produto'].unique()))
-        datas = st.date_input("Período", [df['Data'].min(), df['Data'].max()])
+        filial = st.multiselect("Filial", resumo['Filial'].unique(), default=list(resumo['Filial'].unique()))
+        produtos = st.multiselect("Produto", resumo['Produto'].unique(), default=list(resumo['Produto'].unique()))
+        datas = st.date_input("Período", [meses.min().date(), (meses.max() + pd.offsets.MonthEnd(0)).date()])
 
         if len(datas) == 2:
-            df_filt = df[
-                (df['Filial'].isin(filial)) &
-                (df['Produto'].isin(produtos)) &
-                (df['Data'] >= pd.to_datetime(datas[0])) &
-                (df['Data'] <= pd.to_datetime(datas[1]))
-            ].copy()
-
-            if not df_filt.empty:
-                df_relatorio = pd.merge(df_filt, df_precos[['Produto', 'Custo Unitário', 'Preço Venda Unitário']],
-                                        on='Produto', how='left')
-                colunas_para_remover = ['Inicial', 'Estoque Final']
-                df_relatorio.drop(columns=[col for col in colunas_para_remover if col in df_relatorio.columns], inplace=True)
-
-                st.dataframe(df_relatorio)
-
-                # Exportar como CSV
-                csv = df_relatorio.to_csv(index=False)
-                st.download_button(
-                    label="Exportar como CSV",
-                    data=csv,
-                    file_name="relatorio_quebras.csv",
-                    mime="text/csv"
+            filtros = (tuple(filial), tuple(produtos), datas[0], datas[1])
+            with medidor.etapa('consulta e preços'):
+                df_relatorio, totais = _relatorio_compartilhado(
+                    armazenamento, armazenamento.diretorio, versao_dados, versao_precos, *filtros
                 )
 
-                # Exportar como Excel
-                excel_buffer = io.BytesIO()
-                df_relatorio.to_excel(excel_buffer, index=False, engine='openpyxl')
-                st.download_button(
-                    label="Exportar como Excel",
-                    data=excel_buffer,
-                    file_name="relatorio_quebras.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            if not df_relatorio.empty:
+                # Paginação no servidor: só a página atual vai para o navegador
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    ordenar_por = st.selectbox("Ordenar por", list(df_relatorio.columns), index=list(df_relatorio.columns).index('Data'))
+                with col2:
+                    crescente = st.radio("Ordem", ["Decrescente", "Crescente"], horizontal=True) == "Crescente"
+                with col3:
+                    tamanho_pagina = st.selectbox("Linhas por página", [50, 100, 250, 500])
+                total_paginas = max(1, -(-len(df_relatorio) // tamanho_pagina))
+                with col4:
+                    pagina = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, value=1, step=1)
+
+                with medidor.etapa('ordenar'):
+                    ordem = _ordem_relatorio(
+                        armazenamento, armazenamento.diretorio, versao_dados, versao_precos, *filtros, ordenar_por, crescente
+                    )
+                with medidor.etapa('página'):
+                    posicoes = ordem[(pagina - 1) * tamanho_pagina:pagina * tamanho_pagina]
+                    st.dataframe(df_relatorio.iloc[posicoes], hide_index=True, use_container_width=True)
+                st.caption(
+                    f"{len(df_relatorio):,} registros no filtro | página {pagina} de {total_paginas} | "
+                    f"consulta {medidor.etapas['consulta e preços'] * 1000:.0f} ms | "
+                    f"página {(medidor.etapas['ordenar'] + medidor.etapas['página']) * 1000:.0f} ms"
                 )
 
-                total_lucro = df_relatorio['Lucro Bruto'].sum()
-                st.metric("Lucro Bruto Total", f"R$ {total_lucro:,.2f}")
+                # Exportação sob demanda: o arquivo só é gerado quando pedido e fica
+                # guardado pela assinatura do filtro (downloads repetidos saem prontos)
+                formato = st.selectbox("Formato de exportação", formatos_disponiveis())
+                chave_exportacao = assinatura(
+                    filiais=sorted(map(str, filial)), produtos=sorted(map(str, produtos)),
+                    inicio=datas[0], fim=datas[1], formato=formato,
+                    versao=versao_dados, versao_precos=versao_precos
+                )
+                arquivo_exportado = caminho_exportacao(formato, chave_exportacao)
+                if not os.path.exists(arquivo_exportado):
+                    if st.button("Gerar arquivo para exportação"):
+                        with st.spinner("Gerando arquivo..."), medidor.etapa('exportação'):
+                            arquivo_exportado = exportar(lambda: df_relatorio, formato, chave_exportacao)
+                if os.path.exists(arquivo_exportado):
+                    with open(arquivo_exportado, 'rb') as conteudo:
+                        st.download_button(
+                            label=f"Exportar como {formato}",
+                            data=conteudo,
+                            file_name=nome_arquivo(formato),
+                            mime=tipo_mime(formato)
+                        )
+
+                # Totais calculados sobre o filtro inteiro, não só a página
+                st.metric("Lucro Bruto Total", f"R$ {totais['Lucro Bruto']:,.2f}")
             else:
                 st.warning("Nenhum dado disponível para o filtro selecionado.")
         else:
@@ -311,201 +598,175 @@ elif menu == "Relatório":
 elif menu == "Análise":
     st.header("📈 Análise de Quebras - Dashboard")
 
-    if not df.empty:
-        df['Data'] = pd.to_datetime(df['Data'])
+    # O dashboard agrega a partir do resumo mensal, não das linhas brutas
+    resumo = resumo_atual()
 
+    if not resumo.empty:
         # Filtros em uma única linha
         col1, col2, col3 = st.columns(3)
         with col1:
-            filial = st.multiselect("Filial", df['Filial'].unique(), default=list(df['Filial'].unique()))
+            filial = st.multiselect("Filial", resumo['Filial'].unique(), default=list(resumo['Filial'].unique()))
         with col2:
-            produtos = st.multiselect("Produto", df['Produto'].unique(), default=list(df['Produto'].unique()))
+            produtos = st.multiselect("Produto", resumo['Produto'].unique(), default=list(resumo['Produto'].unique()))
         with col3:
-            ano = st.selectbox("Ano", sorted(df['Data'].dt.year.unique()), index=len(sorted(df['Data'].dt.year.unique()))-1)
-
-        df_filt = df[
-            (df['Filial'].isin(filial)) &
-            (df['Produto'].isin(produtos)) &
-            (df['Data'].dt.year == ano)
-        ].copy()
-
-        if not df_filt.empty:
-            # Preparar dados
-            df_filt['Mês'] = df_filt['Data'].dt.month
-            meses = {1: 'jan', 2: 'fev', 3: 'mar', 4: 'abr', 5: 'mai', 6: 'jun',
-                     7: 'jul', 8: 'ago', 9: 'set', 10: 'out', 11: 'nov', 12: 'dez'}
-
-            # Criar DataFrames separados para cada métrica
-            quebras_df = df_filt.pivot_table(
-                values='Quebra',
-                index='Filial',
-                columns='Mês',
-                aggfunc='sum'
-            ).fillna(0).astype(int)
-
-            vendas_df = df_filt.pivot_table(
-                values='Vendidos',
-                index='Filial',
-                columns='Mês',
-                aggfunc='sum'
-            ).fillna(0).astype(int)
-
-            # Corrigindo o cálculo da porcentagem
-            perc_quebra_df = (quebras_df / vendas_df * 100).fillna(0).round(1)
-
-            margem_df = df_filt.pivot_table(
-                values='Lucro Bruto',
-                index='Filial',
-                columns='Mês',
-                aggfunc='sum'
-            ).fillna(0).round(2)
-
-            # Renomear colunas com nomes dos meses
-            for df_temp in [quebras_df, vendas_df, perc_quebra_df, margem_df]:
-                df_temp.columns = [meses[m] for m in df_temp.columns]
+            anos = sorted(resumo['Ano'].unique())
+            ano = st.selectbox("Ano", anos, index=len(anos)-1)
+
+        with medidor.etapa('tabelas e estilos'):
+            analise = _analise_compartilhada(
+                armazenamento, armazenamento.diretorio, versao_dados, tuple(filial), tuple(produtos), ano
+            )
+
+        if analise is not None:
+            tabelas, totais = analise['tabelas'], analise['totais']
 
             # Criar abas para diferentes visualizações
             tab1, tab2, tab3 = st.tabs(["Quebras e Vendas", "% Quebra", "Margem Bruta"])
 
-            with tab1:
-                # Quebras
-                st.subheader("Quebras")
-                st.dataframe(
-                    quebras_df.style.format("{:,.0f}")
-                        .applymap(lambda x: f'background-color: {"#ffcccc" if x > 0 else "white"}; color: black'),
-                    use_container_width=True
-                )
+            with medidor.etapa('renderizar tabelas'):
+                with tab1:
+                    st.subheader("Quebras")
+                    st.dataframe(estilizar("Quebras", *tabelas["Quebras"]), use_container_width=True)
 
-                # Vendas
-                st.subheader("Vendas")
-                st.dataframe(
-                    vendas_df.style.format("{:,.0f}")
-                        .applymap(lambda x: f'background-color: {"#cce5ff" if x > 0 else "white"}; color: black'),
-                    use_container_width=True
-                )
+                    st.subheader("Vendas")
+                    st.dataframe(estilizar("Vendas", *tabelas["Vendas"]), use_container_width=True)
 
-            with tab2:
-                # % Quebra
-                st.subheader("% Quebra sobre Venda")
-                st.dataframe(
-                    perc_quebra_df.style.format("{:.1f}%")
-                        .applymap(lambda x: f'background-color: {"#ffcccc" if x > 8 else "#ccffcc"}; color: {"red" if x > 8 else "darkgreen"}'),
-                    use_container_width=True
-                )
+                with tab2:
+                    st.subheader("% Quebra sobre Venda")
+                    st.dataframe(estilizar("% Quebra", *tabelas["% Quebra"]), use_container_width=True)
 
-            with tab3:
-                # Margem Bruta
-                st.subheader("Margem Bruta")
-                st.dataframe(
-                    margem_df.style.format("R$ {:,.2f}")
-                        .applymap(lambda x: f'background-color: {"#ccffcc" if x > 0 else "#ffcccc"}; color: {"darkgreen" if x > 0 else "red"}'),
-                    use_container_width=True
-                )
+                with tab3:
+                    st.subheader("Margem Bruta")
+                    st.dataframe(estilizar("Margem Bruta", *tabelas["Margem Bruta"]), use_container_width=True)
 
             # Totais
             st.subheader("Totais do Período")
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                total_quebras = quebras_df.sum().sum()
-                st.metric("Total Quebras", f"{total_quebras:,.0f}")
+                st.metric("Total Quebras", f"{totais['Quebras']:,.0f}")
             
             with col2:
-                total_vendas = vendas_df.sum().sum()
-                st.metric("Total Vendas", f"{total_vendas:,.0f}")
+                st.metric("Total Vendas", f"{totais['Vendas']:,.0f}")
             
             with col3:
-                perc_total = (total_quebras / total_vendas * 100)
-                st.metric("% Quebra Média", f"{perc_total:.1f}%")
+                st.metric("% Quebra Média", f"{totais['% Quebra']:.1f}%")
             
             with col4:
-                total_margem = margem_df.sum().sum()
-                st.metric("Margem Bruta Total", f"R$ {total_margem:,.2f}")
+                st.metric("Margem Bruta Total", f"R$ {totais['Margem Bruta']:,.2f}")
 
         else:
             st.warning("Nenhum dado disponível para o filtro selecionado.")
     else:
         st.warning("Nenhum dado disponível para análise.")
 
+elif menu == "Alertas":
+    st.header("🚨 Alertas de Quebra")
+    st.caption("Meses em que o % Quebra de um produto na filial ficou muito acima da mediana dos 6 meses anteriores.")
+
+    with medidor.etapa('anomalias'):
+        alertas = _alertas_compartilhados(armazenamento, armazenamento.diretorio, versao_dados)
+
+    if not alertas.empty:
+        col1, col2 = st.columns(2)
+        with col1:
+            filial = st.multiselect("Filial", sorted(alertas['Filial'].unique()))
+        with col2:
+            meses = st.number_input("Últimos meses", min_value=1, max_value=120, value=3, step=1)
+
+        # Meses contados a partir do último mês com dados
+        resumo = resumo_atual()
+        ultimo = int((resumo['Ano'] * 12 + resumo['Mes'] - 1).max())
+        periodos = alertas['Ano'] * 12 + alertas['Mes'] - 1
+        filtro = periodos > ultimo - meses
+        if filial:
+            filtro &= alertas['Filial'].isin(filial)
+        alertas_filt = alertas[filtro]
+
+        st.metric("Alertas", len(alertas_filt))
+        st.dataframe(alertas_filt, hide_index=True, use_container_width=True)
+    else:
+        st.info("Nenhuma anomalia de quebra encontrada.")
+
+elif menu == "Produção":
+    st.header("🥐 Sugestão de Produção")
+    df, _, versao_conjunto = dados()
+    with medidor.etapa('previsão'):
+        sugestoes = _sugestoes_compartilhadas(armazenamento, df, armazenamento.diretorio, versao_conjunto, versao_precos)
+
+    if not sugestoes.empty:
+        st.caption(f"Produção sugerida para {sugestoes['Data'].iloc[0]:%d/%m/%Y}, o dia seguinte ao último lançamento. "
+                   "A sugestão equilibra a venda prevista e a quebra pela margem de cada produto: "
+                   "quanto maior a margem, mais vale arriscar sobra do que faltar.")
+        filial = st.multiselect("Filial", sorted(sugestoes['Filial'].unique()))
+        sugestoes_filt = sugestoes[sugestoes['Filial'].isin(filial)] if filial else sugestoes
+
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Produção sugerida", f"{int(sugestoes_filt['Sugestão'].sum()):,}")
+        col2.metric("Venda esperada", f"{sugestoes_filt['Venda esperada'].sum():,.0f}")
+        col3.metric("Quebra esperada", f"{sugestoes_filt['Quebra esperada'].sum():,.0f}")
+        col4.metric("Lucro esperado", f"R$ {sugestoes_filt['Lucro esperado'].sum():,.2f}")
+        st.dataframe(sugestoes_filt.drop(columns='Data'), hide_index=True, use_container_width=True)
+    else:
+        st.info(f"Sem lançamentos diários suficientes para prever: cada filial precisa de pelo menos {MINIMO_DIAS} "
+                f"dias lançados nas últimas {JANELA_DIAS // 7} semanas.")
+
 elif menu == "Importar Planilha":
     st.header("📥 Importar Planilha de Quebras")
 
-    filial = st.text_input("Filial")
+    filial = st.text_input("Filial", help="Vale para todos os arquivos; pode ser ajustada por arquivo na tabela abaixo")
     mes = st.selectbox("Mês da quebra", list(range(1, 13)))
     ano = st.selectbox("Ano da quebra", list(range(2023, datetime.today().year + 1)))
-    arquivo = st.file_uploader("Selecione a planilha Excel", type=[".xls", ".xlsx"])
+    arquivos = st.file_uploader("Selecione as planilhas Excel (ou um .zip com elas)", type=[".xls", ".xlsx", ".zip"], accept_multiple_files=True)
+
+    planilhas = expandir_arquivos([(a.name, a.getvalue()) for a in arquivos]) if arquivos else []
+    if planilhas:
+        # Filial, mês e ano de cada arquivo, partindo dos valores acima
+        destinos = st.data_editor(
+            pd.DataFrame({
+                'Arquivo': [nome for nome, _ in planilhas],
+                'Filial': filial,
+                'Mês': mes,
+                'Ano': ano
+            }),
+            disabled=['Arquivo'],
+            hide_index=True,
+            use_container_width=True
+        )
+        repetidas = st.radio(
+            "Se a filial e o mês já tiverem outra planilha importada:",
+            ["Somar à importação anterior", "Substituir a importação anterior"],
+            horizontal=True
+        )
     confirmar = st.button("Confirmar e Importar")
 
     if confirmar:
-        if not filial or filial.strip() == "":
-            st.error("O campo Filial é obrigatório. Por favor, informe a filial antes de importar a planilha.")
-        elif not arquivo:
+        if not planilhas:
             st.error("Por favor, selecione uma planilha para importar.")
+        elif destinos['Filial'].fillna("").astype(str).str.strip().eq("").any():
+            st.error("O campo Filial é obrigatório. Por favor, informe a filial de cada planilha antes de importar.")
         else:
             try:
-                # Ler a planilha
-                df_planilha = pd.read_excel(arquivo)
-                df_planilha.columns = df_planilha.columns.str.strip()
-
-                if "DESCRIÇÃO" not in df_planilha.columns:
-                    st.error("A planilha deve conter a coluna 'DESCRIÇÃO'.")
-                else:
-                    df_filtrado = df_planilha[["CÓD. VIP", "DESCRIÇÃO", "QUEBRA", "VENDA"]].copy()
-                    df_filtrado.rename(columns={
-                        "CÓD. VIP": "COD VIP",
-                        "DESCRIÇÃO": "Produto",
-                        "QUEBRA": "Quebra",
-                        "VENDA": "Vendidos"
-                    }, inplace=True)
-
-                    # Garantir que 'Quebra' e 'Vendidos' sejam numéricos
-                    df_filtrado['Quebra'] = pd.to_numeric(df_filtrado['Quebra'], errors='coerce').fillna(0)
-                    df_filtrado['Vendidos'] = pd.to_numeric(df_filtrado['Vendidos'], errors='coerce').fillna(0)
-
-                    # Agrupar por COD VIP e Produto
-                    df_filtrado = df_filtrado.groupby(["COD VIP", "Produto"], as_index=False).agg({
-                        "Quebra": "sum",
-                        "Vendidos": "sum"
-                    })
-
-                    # Calcular % Quebra
-                    df_filtrado['% Quebra'] = (df_filtrado['Quebra'] / (df_filtrado['Vendidos'] + df_filtrado['Quebra'])) * 100
-                    df_filtrado['% Quebra'] = df_filtrado['% Quebra'].fillna(0).round(2)
-                    df_filtrado['Data'] = pd.to_datetime(f"{ano}-{mes:02d}-01")
-                    df_filtrado['Filial'] = filial
-
-                    # Mesclar com preços
-                    df_merge = pd.merge(df_filtrado, df_precos, on=['COD VIP', 'Produto'], how='left')
-
-                    # Identificar produtos sem preço
-                    produtos_sem_preco = df_merge[df_merge['Preço Venda Unitário'].isna()]['Produto'].unique()
-                    if len(produtos_sem_preco) > 0:
-                        st.warning(f"Os seguintes produtos estão sem preço cadastrado e não foram importados: {', '.join(produtos_sem_preco)}")
-                        df_merge = df_merge[~df_merge['Produto'].isin(produtos_sem_preco)]
-
-                    if not df_merge.empty:
-                        # Calcular Lucro Bruto
-                        df_merge['Lucro Bruto'] = (df_merge['Preço Venda Unitário'] * df_merge['Vendidos']) - (df_merge['Custo Unitário'] * (df_merge['Vendidos'] + df_merge['Quebra']))
-                        colunas_df = ['Data', 'Produto', 'Vendidos', 'Quebra', '% Quebra', 'Filial', 'Lucro Bruto']
-                        df_novo = df_merge[colunas_df]
-
-                        # Adicionar ao DataFrame principal
-                        df = pd.concat([df, df_novo], ignore_index=True)
-
-                        # Salvar no arquivo
-                        df.to_csv(ARQUIVO_DADOS, index=False)
-                        st.session_state.df = df
-                        st.success(f"Importação realizada com sucesso! {len(df_novo)} registros adicionados.")
-                        st.rerun()
-                    else:
-                        st.warning("Nenhum dado foi importado pois todos os produtos estavam sem preço.")
+                # A importação roda na fila de tarefas: a página só acompanha o andamento
+                st.session_state['tarefa_importacao'] = fila_tarefas.enviar(
+                    'importar', f"Importação de {len(planilhas)} planilha(s)",
+                    {
+                        'destinos': [[str(f), int(a), int(m)] for f, a, m in destinos[['Filial', 'Ano', 'Mês']].itertuples(index=False, name=None)],
+                        'substituir_mes': repetidas == "Substituir a importação anterior",
+                    },
+                    planilhas
+                )
             except Exception as e:
                 st.error(f"Erro ao importar: {str(e)}")
 
+    acompanhar_tarefa(st.session_state.get('tarefa_importacao'))
+
 elif menu == "Preços":
     st.header("💰 Cadastro e Edição de Preços")
+    catalogo, _ = precos_atuais()
+    df_precos = catalogo.df
 
-    modo_preco = st.radio("Modo", ["Cadastrar Novo Preço", "Editar Preço Existente", "Excluir Preço"])
+    modo_preco = st.radio("Modo", ["Cadastrar Novo Preço", "Editar Preço Existente", "Excluir Preço", "Atualizar pela Tabela do Fornecedor"])
 
     if modo_preco == "Cadastrar Novo Preço":
         with st.form("form_precos"):
@@ -513,59 +774,69 @@ elif menu == "Preços":
             produto = st.text_input("Nome do Produto")
             custo = st.number_input("Custo Unitário", min_value=0.0, format="%.2f")
             preco_venda = st.number_input("Preço Venda Unitário", min_value=0.0, format="%.2f")
+            vigencia = st.date_input("Vigente a partir de", value=datetime.today())
             submit = st.form_submit_button("Salvar")
 
             if submit:
                 if preco_venda <= custo:
                     st.error("O Preço Venda Unitário deve ser maior que o Custo Unitário.")
                 else:
-                    novo_preco = pd.DataFrame([{
-                        "COD VIP": cod_vip,
-                        "Produto": produto,
+                    # Código (ou, sem código cadastrado, o nome) já existente atualiza o cadastro
+                    previa = catalogo.diferencas(pd.DataFrame([{
+                        "COD VIP": cod_vip.strip() or None,
+                        "Produto": produto.strip() or None,
                         "Custo Unitário": custo,
                         "Preço Venda Unitário": preco_venda
-                    }])
-                    df_precos = df_precos[~((df_precos["COD VIP"] == cod_vip) & (df_precos["Produto"] == produto))]
-                    df_precos = pd.concat([df_precos, novo_preco], ignore_index=True)
-                    df_precos.to_csv(ARQUIVO_PRECOS, index=False)
-                    st.success("Preço salvo com sucesso!")
-                    st.rerun()
+                    }]))
+                    situacao = previa['Situação'].iloc[0]
+                    if situacao.startswith("Ignorado"):
+                        st.error(situacao.replace("Ignorado: ", "").capitalize() + ".")
+                    elif situacao == "Sem alteração":
+                        st.info("Preço já cadastrado com esses valores.")
+                    else:
+                        salvar_precos(catalogo.aplicar(previa), pd.Timestamp(vigencia), catalogo.produtos_afetados(previa))
+                        st.success("Preço salvo com sucesso! Os registros são recalculados em segundo plano.")
+                        reexecutar()
 
-    elif modo_preco == "Editar Preço Existente" and not df_precos.empty:
-        produto_selecionado = st.selectbox("Selecione o Produto", df_precos['Produto'])
-        preco_info = df_precos[df_precos['Produto'] == produto_selecionado].iloc[0]
+    elif modo_preco == "Editar Preço Existente" and len(catalogo):
+        produto_selecionado = st.selectbox("Selecione o Produto", catalogo.produtos)
+        posicao = catalogo.posicao(produto=produto_selecionado)
+        preco_info = catalogo.linha(posicao)
 
         with st.form("form_editar_precos"):
             cod_vip = st.text_input("Código VIP", value=preco_info['COD VIP'])
             produto = st.text_input("Nome do Produto", value=preco_info['Produto'])
             custo = st.number_input("Custo Unitário", min_value=0.0, format="%.2f", value=float(preco_info['Custo Unitário']))
             preco_venda = st.number_input("Preço Venda Unitário", min_value=0.0, format="%.2f", value=float(preco_info['Preço Venda Unitário']))
+            vigencia = st.date_input("Vigente a partir de", value=datetime.today(),
+                                     help="Registros a partir desta data são recalculados com o novo preço")
             submit = st.form_submit_button("Salvar Alterações")
 
             if submit:
                 if preco_venda <= custo:
                     st.error("O Preço Venda Unitário deve ser maior que o Custo Unitário.")
                 else:
-                    idx = df_precos[df_precos['Produto'] == produto_selecionado].index[0]
-                    df_precos.loc[idx, :] = {
+                    df_precos = catalogo.atualizar(posicao, {
                         "COD VIP": cod_vip,
                         "Produto": produto,
                         "Custo Unitário": custo,
                         "Preço Venda Unitário": preco_venda
-                    }
-                    df_precos.to_csv(ARQUIVO_PRECOS, index=False)
-                    st.success("Preço atualizado com sucesso!")
-                    st.rerun()
+                    })
+                    # Nome antigo e novo: os registros de ambos podem mudar de preço
+                    salvar_precos(df_precos, pd.Timestamp(vigencia), list({produto_selecionado, produto}))
+                    st.success("Preço atualizado com sucesso! Os registros são recalculados em segundo plano.")
+                    reexecutar()
 
-    elif modo_preco == "Excluir Preço" and not df_precos.empty:
+    elif modo_preco == "Excluir Preço" and len(catalogo):
         st.subheader("🗑️ Excluir Preço")
         
         # Selecionar produto para excluir
-        produto_selecionado = st.selectbox("Selecione o Produto para Excluir", df_precos['Produto'])
+        produto_selecionado = st.selectbox("Selecione o Produto para Excluir", catalogo.produtos)
         
         if produto_selecionado:
             # Mostrar informações do produto
-            preco_info = df_precos[df_precos['Produto'] == produto_selecionado].iloc[0]
+            posicao = catalogo.posicao(produto=produto_selecionado)
+            preco_info = catalogo.linha(posicao)
             
             st.write("### Informações do Produto")
             col1, col2 = st.columns(2)
@@ -579,20 +850,79 @@ elif menu == "Preços":
             # Botão de confirmação
             if st.button("Confirmar Exclusão do Preço"):
                 try:
-                    # Remover o produto do DataFrame
-                    df_precos = df_precos[df_precos['Produto'] != produto_selecionado]
-                    
-                    # Salvar alterações
-                    df_precos.to_csv(ARQUIVO_PRECOS, index=False)
+                    # Salvar a tabela sem o produto: a partir de hoje os registros dele ficam sem preço
+                    salvar_precos(catalogo.remover(posicao), pd.Timestamp.today().normalize(), [produto_selecionado])
                     
-                    st.success(f"Preço do produto '{produto_selecionado}' excluído com sucesso!")
-                    st.rerun()
+                    st.success(f"Preço do produto '{produto_selecionado}' excluído com sucesso! Os registros são recalculados em segundo plano.")
+                    reexecutar()
                     
                 except Exception as e:
                     st.error(f"Erro ao excluir preço: {str(e)}")
 
+    elif modo_preco == "Atualizar pela Tabela do Fornecedor":
+        # Carga em lote: casa pelo COD VIP (ou pelo nome, sem código) e mostra a prévia antes de gravar
+        arquivo = st.file_uploader("Tabela de preços (.csv, .xlsx ou .xls) com COD VIP, Produto, Custo e Preço Venda",
+                                   type=[".csv", ".xlsx", ".xls"])
+        if arquivo is not None:
+            try:
+                with medidor.etapa('prévia de preços'):
+                    previa = catalogo.diferencas(ler_tabela_fornecedor(arquivo.name, arquivo.getvalue()))
+            except Exception as e:
+                st.error(f"Erro ao ler a tabela de preços: {str(e)}")
+                st.stop()
+
+            contagem = previa['Situação'].str.split(':').str[0].value_counts()
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Novos", int(contagem.get("Novo", 0)))
+            col2.metric("Alterados", int(contagem.get("Alterado", 0)))
+            col3.metric("Sem alteração", int(contagem.get("Sem alteração", 0)))
+            col4.metric("Ignorados", int(contagem.get("Ignorado", 0)))
+            st.dataframe(
+                previa[previa['Situação'] != "Sem alteração"].drop(columns='_posicao'),
+                hide_index=True, use_container_width=True
+            )
+
+            mudancas = int(contagem.get("Novo", 0) + contagem.get("Alterado", 0))
+            vigencia = st.date_input("Vigente a partir de", value=datetime.today(), key="vigencia_fornecedor")
+            if mudancas and st.button(f"Aplicar {mudancas} alteração(ões)"):
+                salvar_precos(catalogo.aplicar(previa), pd.Timestamp(vigencia), catalogo.produtos_afetados(previa))
+                st.success(f"{mudancas} preço(s) gravado(s); os registros são recalculados em segundo plano.")
+                reexecutar()
+
+    acompanhar_tarefa(st.session_state.get('tarefa_recalculo'))
+
     st.subheader("📋 Tabela de Preços Cadastrados")
     st.dataframe(df_precos.style.format({
         'Custo Unitário': 'R$ {:.2f}',
         'Preço Venda Unitário': 'R$ {:.2f}'
-    }), use_container_width=True)
\ No newline at end of file
+    }), use_container_width=True)
+
+elif menu == "Tarefas":
+    st.header("⏳ Tarefas em Segundo Plano")
+    lista = fila_tarefas.listar()
+    if lista.empty:
+        st.info("Nenhuma tarefa enviada.")
+    else:
+        st.dataframe(
+            lista.drop(columns='ID'), hide_index=True, use_container_width=True,
+            column_config={'Progresso': st.column_config.ProgressColumn(min_value=0, max_value=1)}
+        )
+        rotulos = {
+            id_tarefa: f"{criada} | {descricao} | {situacao}"
+            for id_tarefa, criada, descricao, situacao in zip(lista['ID'], lista['Criada em'], lista['Descrição'], lista['Situação'])
+        }
+        acompanhar_tarefa(st.selectbox("Acompanhar tarefa", list(rotulos), format_func=rotulos.get))
+
+# Fecha os tempos da execução (e grava no log se passou do limite)
+medidor.finalizar()
+if os.environ.get('CONTROLE_ADMIN') == '1':
+    with st.sidebar.expander("⏱️ Tempos desta execução"):
+        st.dataframe(
+            pd.DataFrame(medidor.tempos(), columns=['Etapa', 'Segundos']).round(4),
+            hide_index=True, use_container_width=True
+        )
+        if medidor.arquivo_perfil:
+            st.caption(f"Perfil gravado em {medidor.arquivo_perfil}")
+        resumo_perfil = medidor.resumo_perfil()
+        if resumo_perfil:
+            st.code(resumo_perfil)
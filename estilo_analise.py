@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+import resumo_mensal
+
+# Tabela -> (formato, limite, estilo acima do limite, estilo no limite ou abaixo/vazio)
+REGRAS = {
+    'Quebras': ("{:,.0f}", 0,
+                'background-color: #ffcccc; color: black',
+                'background-color: white; color: black'),
+    'Vendas': ("{:,.0f}", 0,
+               'background-color: #cce5ff; color: black',
+               'background-color: white; color: black'),
+    '% Quebra': ("{:.1f}%", 8,
+                 'background-color: #ffcccc; color: red',
+                 'background-color: #ccffcc; color: darkgreen'),
+    'Margem Bruta': ("R$ {:,.2f}", 0,
+                     'background-color: #ccffcc; color: darkgreen',
+                     'background-color: #ffcccc; color: red'),
+}
+
+
+def estilos_css(df, limite, acima, abaixo):
+    # Uma comparação NumPy sobre a matriz inteira, em vez de uma função Python por célula
+    with np.errstate(invalid='ignore'):
+        maior = df.to_numpy(dtype=float) > limite
+    return pd.DataFrame(np.where(maior, acima, abaixo), index=df.index, columns=df.columns)
+
+
+def montar_analise(resumo):
+    """Tabelas mensais, estilos e totais do dashboard, calculados uma única vez.
+
+    Devolve {'tabelas': {nome: (df, css)}, 'totais': {...}}; as abas usam o
+    mesmo resultado.
+    """
+    quebras_df, vendas_df, perc_quebra_df, margem_df = resumo_mensal.tabelas_mensais(resumo)
+    tabelas = {}
+    for nome, tabela in zip(REGRAS, (quebras_df, vendas_df, perc_quebra_df, margem_df)):
+        _, limite, acima, abaixo = REGRAS[nome]
+        tabelas[nome] = (tabela, estilos_css(tabela, limite, acima, abaixo))
+
+    total_quebras = float(quebras_df.to_numpy().sum())
+    total_vendas = float(vendas_df.to_numpy().sum())
+    totais = {
+        'Quebras': total_quebras,
+        'Vendas': total_vendas,
+        '% Quebra': total_quebras / total_vendas * 100 if total_vendas else 0.0,
+        'Margem Bruta': float(margem_df.to_numpy().sum()),
+    }
+    return {'tabelas': tabelas, 'totais': totais}
+
+
+def estilizar(nome, tabela, css):
+    # Os estilos já vêm prontos: o apply só devolve a matriz calculada
+    return tabela.style.format(REGRAS[nome][0]).apply(lambda _: css, axis=None)
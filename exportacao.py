@@ -0,0 +1,106 @@
+import hashlib
+import importlib.util
+import json
+import os
+
+DIRETORIO_EXPORTACOES = 'exportacoes'
+
+# Quantos arquivos gerados ficam guardados para downloads repetidos
+LIMITE_EXPORTACOES = 20
+
+# Linhas escritas por vez; o arquivo nunca é montado inteiro na memória
+TAMANHO_BLOCO = 20000
+
+FORMATOS = {
+    'CSV': ('.csv', 'text/csv'),
+    'CSV compactado (.gz)': ('.csv.gz', 'application/gzip'),
+    'Excel': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'Parquet': ('.parquet', 'application/octet-stream'),
+}
+
+
+def assinatura(**filtros):
+    # Mesmo filtro + mesma versão dos dados = mesmo arquivo
+    texto = json.dumps(filtros, sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()[:24]
+
+
+def _gravar_csv(df, caminho, compressao=None):
+    df.to_csv(caminho, index=False, chunksize=TAMANHO_BLOCO, compression=compressao)
+
+
+def _gravar_xlsx(df, caminho):
+    # Modo write_only do openpyxl: as linhas vão direto para o arquivo
+    from openpyxl import Workbook
+    livro = Workbook(write_only=True)
+    aba = livro.create_sheet('Relatório')
+    aba.append(list(df.columns))
+    for inicio in range(0, len(df), TAMANHO_BLOCO):
+        bloco = df.iloc[inicio:inicio + TAMANHO_BLOCO].astype(object)
+        bloco = bloco.where(bloco.notna(), None)
+        for linha in bloco.itertuples(index=False, name=None):
+            aba.append(linha)
+    livro.save(caminho)
+
+
+def _gravar_parquet(df, caminho):
+    df.to_parquet(caminho, index=False, row_group_size=TAMANHO_BLOCO)
+
+
+def _limpar(diretorio, limite):
+    # Mantém só os arquivos mais recentes
+    arquivos = [os.path.join(diretorio, nome) for nome in os.listdir(diretorio) if not nome.endswith('.tmp')]
+    arquivos.sort(key=os.path.getmtime, reverse=True)
+    for antigo in arquivos[limite:]:
+        os.remove(antigo)
+
+
+def caminho_exportacao(formato, chave, diretorio=DIRETORIO_EXPORTACOES):
+    return os.path.join(diretorio, f"relatorio_{chave}{FORMATOS[formato][0]}")
+
+
+def exportar(carregar, formato, chave, diretorio=DIRETORIO_EXPORTACOES, limite=LIMITE_EXPORTACOES):
+    """Devolve o caminho do arquivo exportado, gerando-o só se ainda não existir.
+
+    `carregar` é chamado apenas quando o arquivo precisa ser gerado, e `chave`
+    (ver assinatura()) identifica o filtro e a versão dos dados.
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = caminho_exportacao(formato, chave, diretorio)
+    if os.path.exists(caminho):
+        os.utime(caminho)
+        return caminho
+
+    gravar(carregar(), formato, caminho)
+    _limpar(diretorio, limite)
+    return caminho
+
+
+def gravar(df, formato, caminho):
+    # Grava em arquivo temporário e troca no final: ninguém lê um arquivo pela metade
+    temporario = caminho + '.tmp'
+    if formato == 'CSV':
+        _gravar_csv(df, temporario)
+    elif formato == 'CSV compactado (.gz)':
+        _gravar_csv(df, temporario, compressao='gzip')
+    elif formato == 'Excel':
+        _gravar_xlsx(df, temporario)
+    else:
+        _gravar_parquet(df, temporario)
+    os.replace(temporario, caminho)
+
+
+def formatos_disponiveis():
+    # Só verifica se o pyarrow está instalado, sem importá-lo (o to_parquet importa quando precisar)
+    formatos = ['CSV', 'CSV compactado (.gz)', 'Excel']
+    if importlib.util.find_spec('pyarrow') is not None:
+        formatos.append('Parquet')
+    return formatos
+
+
+def tipo_mime(formato):
+    return FORMATOS[formato][1]
+
+
+def nome_arquivo(formato):
+    return f"relatorio_quebras{FORMATOS[formato][0]}"
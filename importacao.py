@@ -0,0 +1,232 @@
+import hashlib
+import io
+import os
+import time
+import zipfile
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from calculos import calcular_metricas_vigentes
+
+COLUNAS_PLANILHA = {
+    "CÓD. VIP": "COD VIP",
+    "DESCRIÇÃO": "Produto",
+    "QUEBRA": "Quebra",
+    "VENDA": "Vendidos"
+}
+EXTENSOES_PLANILHA = ('.xls', '.xlsx')
+
+ARQUIVO_IMPORTACOES = '_importacoes.csv'
+# IDs: os registros criados pela importação, separados por espaço
+COLUNAS_IMPORTACOES = ['Hash', 'Filial', 'Ano', 'Mes', 'Arquivo', 'Registros', 'Importado em', 'IDs']
+
+# Linhas lidas antes de agregar parcialmente; limita a memória em planilhas grandes
+TAMANHO_BLOCO = 50000
+
+
+def expandir_arquivos(arquivos):
+    # Recebe [(nome, bytes)] e abre os .zip, devolvendo só as planilhas
+    planilhas = []
+    for nome, conteudo in arquivos:
+        if nome.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(conteudo)) as pacote:
+                for interno in pacote.namelist():
+                    if interno.lower().endswith(EXTENSOES_PLANILHA) and not interno.startswith('__MACOSX'):
+                        planilhas.append((f"{nome}/{interno}", pacote.read(interno)))
+        elif nome.lower().endswith(EXTENSOES_PLANILHA):
+            planilhas.append((nome, conteudo))
+    return planilhas
+
+
+def hash_conteudo(conteudo):
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def ids_importacao(hash_arquivo, filial, ano, mes, produtos):
+    # IDs derivados do arquivo, do destino e do produto: importar de novo o mesmo
+    # arquivo gera os mesmos IDs, então a gravação pode ser repetida sem duplicar
+    produtos = pd.Series(produtos, dtype=object).astype(str).reset_index(drop=True)
+    ocorrencias = produtos.groupby(produtos).cumcount()
+    base = f"{hash_arquivo}|{filial}|{int(ano)}|{int(mes)}"
+    return [
+        hashlib.sha256(f"{base}|{produto}|{n}".encode()).hexdigest()[:16]
+        for produto, n in zip(produtos, ocorrencias)
+    ]
+
+
+class RegistroImportacoes:
+    """Livro das importações já feitas, por hash do arquivo e (Filial, ano, mês).
+
+    As chaves ficam em conjuntos na memória, então a checagem de repetição é
+    O(1) e acontece antes de a planilha ser lida. Cada linha guarda também os
+    IDs dos registros que a importação criou, que são os únicos removidos
+    quando ela é substituída.
+    """
+
+    def __init__(self, diretorio):
+        self.caminho = os.path.join(diretorio, ARQUIVO_IMPORTACOES)
+        if os.path.exists(self.caminho):
+            self.df = pd.read_csv(self.caminho, dtype={'Hash': str, 'Filial': str, 'IDs': str})
+        else:
+            self.df = pd.DataFrame(columns=COLUNAS_IMPORTACOES)
+        # Livro anterior à coluna IDs: a primeira gravação reescreve o arquivo inteiro
+        self._cabecalho_antigo = 'IDs' not in self.df.columns
+        self.df = self.df.reindex(columns=COLUNAS_IMPORTACOES)
+        self._indexar()
+
+    def _indexar(self):
+        self._arquivos = set(zip(self.df['Hash'], self.df['Filial'].astype(str), self.df['Ano'].astype(int), self.df['Mes'].astype(int)))
+        self._meses = {chave[1:] for chave in self._arquivos}
+
+    def ja_importado(self, hash_arquivo, filial, ano, mes):
+        # Mesmo arquivo para a mesma filial e mês
+        return (hash_arquivo, str(filial), int(ano), int(mes)) in self._arquivos
+
+    def mes_importado(self, filial, ano, mes):
+        # Alguma planilha (talvez outra versão) já foi importada para a filial e mês
+        return (str(filial), int(ano), int(mes)) in self._meses
+
+    def ids_importados(self, filial, ano, mes):
+        """IDs dos registros criados pelas importações da filial e mês.
+
+        Devolve (ids, sem_ids): `sem_ids` é verdadeiro se alguma importação
+        com registros foi gravada antes de o livro guardar os IDs.
+        """
+        do_mes = self.df[
+            (self.df['Filial'].astype(str) == str(filial))
+            & (self.df['Ano'].astype(int) == int(ano))
+            & (self.df['Mes'].astype(int) == int(mes))
+        ]
+        ids = [i for texto in do_mes['IDs'].dropna() for i in texto.split()]
+        sem_ids = bool((do_mes['IDs'].isna() & (pd.to_numeric(do_mes['Registros']) > 0)).any())
+        return ids, sem_ids
+
+    def registrar(self, linhas, substituidos=()):
+        # `linhas` seguem COLUNAS_IMPORTACOES, com 'IDs' como lista de IDs.
+        # `substituidos`: (filial, ano, mes) cujas importações anteriores foram trocadas
+        novos = pd.DataFrame(linhas, columns=COLUNAS_IMPORTACOES)
+        novos['Importado em'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        novos['IDs'] = [' '.join(ids) for ids in novos['IDs']]
+        substituidos = {(str(f), int(a), int(m)) for f, a, m in substituidos}
+        if substituidos or self._cabecalho_antigo:
+            manter = [
+                (str(f), int(a), int(m)) not in substituidos
+                for f, a, m in zip(self.df['Filial'], self.df['Ano'], self.df['Mes'])
+            ]
+            self.df = pd.concat([self.df[manter], novos], ignore_index=True)
+            self.df.to_csv(self.caminho + '.tmp', index=False)
+            os.replace(self.caminho + '.tmp', self.caminho)
+            self._cabecalho_antigo = False
+        else:
+            novos.to_csv(self.caminho, mode='a', header=not os.path.exists(self.caminho), index=False)
+            self.df = pd.concat([self.df, novos], ignore_index=True)
+        self._indexar()
+
+
+def _agregar(bloco):
+    bloco = pd.DataFrame(bloco, columns=list(COLUNAS_PLANILHA.values()))
+    bloco['Quebra'] = pd.to_numeric(bloco['Quebra'], errors='coerce').fillna(0)
+    bloco['Vendidos'] = pd.to_numeric(bloco['Vendidos'], errors='coerce').fillna(0)
+    return bloco.groupby(["COD VIP", "Produto"], as_index=False)[["Quebra", "Vendidos"]].sum()
+
+
+def _linhas_xlsx(conteudo):
+    # Modo somente leitura do openpyxl: as linhas são lidas sob demanda
+    from openpyxl import load_workbook
+    livro = load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+    try:
+        for linha in livro.active.iter_rows(values_only=True):
+            yield linha
+    finally:
+        livro.close()
+
+
+def _linhas_xls(conteudo):
+    planilha = pd.read_excel(io.BytesIO(conteudo), header=None)
+    for linha in planilha.itertuples(index=False):
+        yield tuple(linha)
+
+
+def ler_planilha(nome, conteudo):
+    """Lê uma planilha de quebras e devolve Quebra e Vendidos somados por COD VIP e Produto.
+
+    Roda em processo separado, por isso devolve um dicionário com o resultado
+    (ou o erro) e o tempo gasto em vez de lançar exceção.
+    """
+    inicio = time.perf_counter()
+    try:
+        linhas = _linhas_xlsx(conteudo) if nome.lower().endswith('.xlsx') else _linhas_xls(conteudo)
+        cabecalho = [str(c).strip() if c is not None else '' for c in next(linhas, ())]
+        if "DESCRIÇÃO" not in cabecalho:
+            raise ValueError("A planilha deve conter a coluna 'DESCRIÇÃO'.")
+        faltando = [c for c in COLUNAS_PLANILHA if c not in cabecalho]
+        if faltando:
+            raise ValueError(f"Colunas ausentes na planilha: {', '.join(faltando)}")
+        posicoes = [cabecalho.index(c) for c in COLUNAS_PLANILHA]
+
+        parciais, bloco, total_linhas = [], [], 0
+        for linha in linhas:
+            if linha is None or all(v is None for v in linha):
+                continue
+            bloco.append([linha[p] if p < len(linha) else None for p in posicoes])
+            if len(bloco) >= TAMANHO_BLOCO:
+                parciais.append(_agregar(bloco))
+                total_linhas += len(bloco)
+                bloco = []
+        total_linhas += len(bloco)
+        parciais.append(_agregar(bloco))
+
+        planilha = pd.concat(parciais, ignore_index=True)
+        planilha = planilha.groupby(["COD VIP", "Produto"], as_index=False)[["Quebra", "Vendidos"]].sum()
+        return {'arquivo': nome, 'planilha': planilha, 'linhas': total_linhas,
+                'segundos': time.perf_counter() - inicio, 'erro': None}
+    except Exception as e:
+        return {'arquivo': nome, 'planilha': None, 'linhas': 0,
+                'segundos': time.perf_counter() - inicio, 'erro': str(e)}
+
+
+def ler_planilhas(planilhas, processos=None):
+    """Lê várias planilhas em um pool de processos.
+
+    Gera (posição, resultado) assim que cada arquivo fica pronto, para a tela
+    mostrar o progresso arquivo a arquivo. Com `processos=1` lê na própria
+    thread, sem abrir o pool.
+    """
+    if len(planilhas) <= 1 or processos == 1:
+        for posicao, (nome, conteudo) in enumerate(planilhas):
+            yield posicao, ler_planilha(nome, conteudo)
+        return
+    processos = processos or min(len(planilhas), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=processos) as pool:
+        futuros = {pool.submit(ler_planilha, nome, conteudo): posicao
+                   for posicao, (nome, conteudo) in enumerate(planilhas)}
+        try:
+            for futuro in as_completed(futuros):
+                yield futuros[futuro], futuro.result()
+        finally:
+            # Leitura interrompida por quem consome: as planilhas que ainda não começaram são descartadas
+            for futuro in futuros:
+                futuro.cancel()
+
+
+def montar_registros(planilha, filial, ano, mes, catalogo, historico):
+    """Converte a planilha agregada em registros de quebra do mês.
+
+    Os produtos são casados com o `catalogo` pelo COD VIP (ou, sem código
+    cadastrado, pelo nome normalizado) e recebem o nome do catálogo; os preços
+    são os vigentes no mês, pelo histórico de preços. Devolve
+    (registros, produtos_sem_preco); produtos sem preço ficam de fora.
+    """
+    planilha = planilha.copy()
+    planilha['Data'] = pd.to_datetime(f"{int(ano)}-{int(mes):02d}-01")
+    planilha['Filial'] = str(filial)
+
+    planilha, cadastrados = catalogo.canonizar(planilha)
+    # Calcular % Quebra e Lucro Bruto pelos preços vigentes no mês
+    registros, sem_preco = calcular_metricas_vigentes(planilha, historico)
+    sem_preco |= ~cadastrados
+    produtos_sem_preco = list(registros.loc[sem_preco, 'Produto'].unique())
+    colunas_df = ['Data', 'Produto', 'Vendidos', 'Quebra', '% Quebra', 'Filial', 'Lucro Bruto']
+    return registros.loc[~sem_preco, colunas_df], produtos_sem_preco
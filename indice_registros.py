@@ -0,0 +1,70 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+TAMANHO_PAGINA = 50
+
+
+class IndiceRegistros:
+    """Índices sobre a tabela de registros para localizar linhas sem varrer o histórico.
+
+    - por ID: pd.Index com tabela hash, busca O(1);
+    - secundário: (Filial, Data, Produto) ordenado, busca por prefixo em O(log n);
+    - ordem de exibição (mais recentes primeiro) calculada uma única vez.
+
+    As posições devolvidas são posições de linha em `df` (iloc).
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self._por_id = pd.Index(df['ID'].astype(str))
+        secundario = pd.MultiIndex.from_arrays(
+            [df['Filial'].astype(str), pd.to_datetime(df['Data']), df['Produto'].astype(str)],
+            names=['Filial', 'Data', 'Produto']
+        )
+        self._secundario = pd.Series(np.arange(len(df)), index=secundario).sort_index()
+        self._recentes = np.argsort(-pd.to_datetime(df['Data']).to_numpy().astype('int64'), kind='stable')
+
+    def posicao(self, id_registro):
+        posicao = self._por_id.get_loc(str(id_registro))
+        if not isinstance(posicao, (int, np.integer)):
+            raise KeyError(f"ID repetido: {id_registro}")
+        return posicao
+
+    def registro(self, id_registro):
+        return self.df.iloc[self.posicao(id_registro)]
+
+    def rotulo(self, id_registro):
+        # Rótulo do índice de df (para df.loc / df.drop)
+        return self.df.index[self.posicao(id_registro)]
+
+    def buscar(self, filial=None, data=None, produto=None, texto=None):
+        """Posições dos registros filtrados, dos mais recentes para os mais antigos."""
+        ordem = self._recentes
+        if filial is not None or data is not None or produto is not None:
+            chave = [
+                str(filial) if filial is not None else slice(None),
+                pd.Timestamp(data) if data is not None else slice(None),
+                str(produto) if produto is not None else slice(None),
+            ]
+            try:
+                locais = self._secundario.index.get_locs(chave)
+            except KeyError:
+                locais = np.array([], dtype=int)
+            selecionados = np.zeros(len(self.df), dtype=bool)
+            selecionados[self._secundario.to_numpy()[locais]] = True
+            ordem = ordem[selecionados[ordem]]
+        if texto:
+            produtos = self.df['Produto'].astype(str).iloc[ordem]
+            ordem = ordem[produtos.str.contains(texto, case=False, regex=False).to_numpy()]
+        return ordem
+
+    @staticmethod
+    def total_paginas(posicoes, tamanho=TAMANHO_PAGINA):
+        return max(1, math.ceil(len(posicoes) / tamanho))
+
+    def pagina(self, posicoes, numero, tamanho=TAMANHO_PAGINA):
+        # Só a página pedida vira DataFrame
+        inicio = (numero - 1) * tamanho
+        return self.df.iloc[posicoes[inicio:inicio + tamanho]]
@@ -0,0 +1,266 @@
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+
+import pandas as pd
+
+import resumo_mensal
+from anomalias import detectar_anomalias
+from armazenamento import obter_armazenamento
+from catalogo_precos import CatalogoPrecos, ler_tabela_fornecedor
+from exportacao import FORMATOS, gravar
+from importacao import expandir_arquivos
+from servicos import importar_lote, montar_relatorio, recalcular_lucro, sugestao_producao
+from tarefas import FilaTarefas, trabalhar
+
+# Tarefas em lote sem navegador (cron). O armazenamento segue CONTROLE_ARMAZENAMENTO, como no app.
+# Uso:
+#   python lote.py importar entrada/ [--filial 3 --ano 2025 --mes 6] [--substituir]
+#   python lote.py resumo [--ano 2025 --saida relatorios/]
+#   python lote.py relatorio --inicio 2025-01-01 --fim 2025-12-31 [--filial 3] --saida relatorio.csv
+#   python lote.py precos tabela_fornecedor.xlsx [--vigencia 2025-07-01] [--aplicar]
+#   python lote.py recalcular [--desde 2025-06-01] [--produto "Pão Francês"]
+#   python lote.py alertas [--desde 2025-01-01] [--saida alertas.csv]
+#   python lote.py producao [--filial 3] [--saida producao.csv]
+#   python lote.py compactar
+#   python lote.py fila [--continuo | --listar]
+
+# Nome do arquivo com filial, ano e mês: 3_2025-06.xlsx, loja3_2025_06.xls, ...
+PADRAO_DESTINO = re.compile(r'(?P<filial>[^_/\\]+)_(?P<ano>\d{4})[-_](?P<mes>\d{1,2})(?:\D[^/\\]*)?\.[^./\\]+$')
+
+
+def destino_do_nome(nome, filial=None, ano=None, mes=None):
+    # Valores passados na linha de comando têm prioridade sobre o nome do arquivo
+    encontrado = PADRAO_DESTINO.search(nome)
+    if encontrado:
+        filial = filial or encontrado['filial']
+        ano = ano or int(encontrado['ano'])
+        mes = mes or int(encontrado['mes'])
+    if not filial or not ano or not mes:
+        return None
+    return filial, ano, mes
+
+
+def importar(args):
+    armazenamento = obter_armazenamento()
+    arquivos = []
+    for nome in sorted(os.listdir(args.pasta)):
+        caminho = os.path.join(args.pasta, nome)
+        if os.path.isfile(caminho):
+            with open(caminho, 'rb') as arquivo:
+                arquivos.append((nome, arquivo.read()))
+
+    planilhas, destinos = [], []
+    for nome, conteudo in expandir_arquivos(arquivos):
+        destino = destino_do_nome(nome, args.filial, args.ano, args.mes)
+        if destino is None:
+            print(f"{nome}: filial, ano e mês não identificados no nome do arquivo; ignorado")
+            continue
+        planilhas.append((nome, conteudo))
+        destinos.append(destino)
+    if not planilhas:
+        print("Nenhuma planilha para importar.")
+        return 0
+
+    inicio = time.perf_counter()
+    situacao, resultado = importar_lote(
+        armazenamento, planilhas, destinos,
+        CatalogoPrecos(armazenamento.carregar_precos()), armazenamento.carregar_historico_precos(),
+        substituir_mes=args.substituir, processos=args.processos,
+        progresso=lambda lidos, total, arquivo: print(f"{lidos}/{total} lidos: {arquivo}")
+    )
+    print(pd.DataFrame(situacao).to_string(index=False))
+    print(f"{resultado['status']}: {resultado['registros']} registros de {resultado['planilhas']} planilha(s) "
+          f"em {time.perf_counter() - inicio:.1f}s")
+    alertas = resultado.get('alertas')
+    if alertas is not None and not alertas.empty:
+        print(f"{len(alertas)} alerta(s) de quebra acima do esperado nos meses importados:")
+        print(alertas.to_string(index=False))
+    return 1 if resultado['status'] == 'erro' else 0
+
+
+def resumo(args):
+    armazenamento = obter_armazenamento()
+    inicio = time.perf_counter()
+    resumo_df = armazenamento.reconstruir_resumo()
+    print(f"Resumo mensal: {len(resumo_df)} linhas em {time.perf_counter() - inicio:.1f}s")
+    if args.saida:
+        # Tabelas da Análise (filial x mês) do ano pedido, ou do último ano com dados
+        ano = args.ano or int(resumo_df['Ano'].max())
+        filtrado = resumo_mensal.filtrar(resumo_df, ano=ano)
+        if filtrado.empty:
+            print(f"Sem dados em {ano}.")
+            return 0
+        os.makedirs(args.saida, exist_ok=True)
+        nomes = ('quebras', 'vendas', 'perc_quebra', 'margem')
+        for nome, tabela in zip(nomes, resumo_mensal.tabelas_mensais(filtrado)):
+            caminho = os.path.join(args.saida, f"{nome}_{ano}.csv")
+            tabela.to_csv(caminho)
+            print(f"Gravado {caminho}")
+    return 0
+
+
+def relatorio(args):
+    armazenamento = obter_armazenamento()
+    inicio = time.perf_counter()
+    df_relatorio, totais = montar_relatorio(
+        armazenamento, armazenamento.carregar_historico_precos(),
+        filiais=args.filial, produtos=args.produto, inicio=args.inicio, fim=args.fim
+    )
+    formato = args.formato or next(
+        (nome for nome, (extensao, _) in FORMATOS.items() if args.saida.endswith(extensao)),
+        'CSV'
+    )
+    gravar(df_relatorio, formato, args.saida)
+    print(f"{len(df_relatorio)} registros gravados em {args.saida} ({formato}) em {time.perf_counter() - inicio:.1f}s")
+    print(f"Quebra: {totais['Quebra']:,.0f} | Vendidos: {totais['Vendidos']:,.0f} | Lucro Bruto: R$ {totais['Lucro Bruto']:,.2f}")
+    return 0
+
+
+def precos(args):
+    # Sem --aplicar, só mostra a prévia do que mudaria
+    armazenamento = obter_armazenamento()
+    catalogo = CatalogoPrecos(armazenamento.carregar_precos())
+    with open(args.tabela, 'rb') as arquivo:
+        previa = catalogo.diferencas(ler_tabela_fornecedor(os.path.basename(args.tabela), arquivo.read()))
+    mudancas = previa[previa['Situação'].isin(['Novo', 'Alterado'])]
+    print(previa[previa['Situação'] != 'Sem alteração'].drop(columns='_posicao').to_string(index=False))
+    print(previa['Situação'].value_counts().to_string())
+    if not args.aplicar or mudancas.empty:
+        return 0
+    inicio = time.perf_counter()
+    vigencia = args.vigencia or pd.Timestamp.today().normalize()
+    armazenamento.salvar_precos(catalogo.aplicar(previa), vigencia=vigencia)
+    alterados = recalcular_lucro(armazenamento, armazenamento.carregar_historico_precos(),
+                                 produtos=catalogo.produtos_afetados(previa), inicio=vigencia)
+    print(f"{len(mudancas)} preços gravados e {alterados} registros recalculados em {time.perf_counter() - inicio:.1f}s")
+    return 0
+
+
+def recalcular(args):
+    armazenamento = obter_armazenamento()
+    inicio = time.perf_counter()
+    alterados = recalcular_lucro(armazenamento, armazenamento.carregar_historico_precos(),
+                                 produtos=args.produto, inicio=args.desde)
+    print(f"{alterados} registros recalculados em {time.perf_counter() - inicio:.1f}s")
+    return 0
+
+
+def alertas(args):
+    armazenamento = obter_armazenamento()
+    inicio = time.perf_counter()
+    alertas_df = detectar_anomalias(armazenamento.carregar_resumo(), desde=args.desde)
+    print(f"{len(alertas_df)} alertas em {time.perf_counter() - inicio:.1f}s")
+    if args.saida:
+        alertas_df.to_csv(args.saida, index=False)
+        print(f"Gravado {args.saida}")
+    else:
+        print(alertas_df.head(args.limite).to_string(index=False))
+    return 0
+
+
+def producao(args):
+    armazenamento = obter_armazenamento()
+    inicio = time.perf_counter()
+    sugestoes = sugestao_producao(armazenamento, armazenamento.carregar_historico_precos())
+    if args.filial:
+        sugestoes = sugestoes[sugestoes['Filial'].isin(args.filial)]
+    print(f"{len(sugestoes)} sugestões em {time.perf_counter() - inicio:.1f}s")
+    if sugestoes.empty:
+        return 0
+    print(f"Para {sugestoes['Data'].iloc[0]:%Y-%m-%d}: {int(sugestoes['Sugestão'].sum())} unidades, "
+          f"quebra esperada {sugestoes['Quebra esperada'].sum():,.0f}, lucro esperado R$ {sugestoes['Lucro esperado'].sum():,.2f}")
+    if args.saida:
+        sugestoes.to_csv(args.saida, index=False)
+        print(f"Gravado {args.saida}")
+    else:
+        print(sugestoes.head(args.limite).to_string(index=False))
+    return 0
+
+
+def compactar(args):
+    print(f"{obter_armazenamento().compactar()} partições compactadas")
+    return 0
+
+
+def fila(args):
+    # Tarefas enviadas pelo app (importações, exclusões por período, recálculos)
+    fila_tarefas = FilaTarefas()
+    if args.listar:
+        lista = fila_tarefas.listar()
+        print(lista.drop(columns='ID').to_string(index=False) if not lista.empty else "Nenhuma tarefa.")
+        return 0
+    try:
+        trabalhar(fila_tarefas, obter_armazenamento(), parar=threading.Event() if args.continuo else None)
+    except KeyboardInterrupt:
+        # A tarefa interrompida volta à fila se ainda não tinha começado a gravar
+        pass
+    return 0
+
+
+def argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Tarefas em lote do Controle de Quebras.")
+    tarefas = parser.add_subparsers(dest='tarefa', required=True)
+
+    p = tarefas.add_parser('importar', help="importa as planilhas (e .zip) de uma pasta")
+    p.add_argument('pasta')
+    p.add_argument('--filial', help="filial de todos os arquivos (senão, vem do nome: <filial>_<AAAA>-<MM>.xlsx)")
+    p.add_argument('--ano', type=int)
+    p.add_argument('--mes', type=int)
+    p.add_argument('--substituir', action='store_true', help="substitui as importações anteriores da filial e mês em vez de somar a elas")
+    p.add_argument('--processos', type=int, help="processos para ler as planilhas (padrão: um por CPU)")
+    p.set_defaults(funcao=importar)
+
+    p = tarefas.add_parser('resumo', help="recalcula o resumo mensal e, com --saida, grava as tabelas da Análise")
+    p.add_argument('--ano', type=int)
+    p.add_argument('--saida', help="pasta para as tabelas em CSV")
+    p.set_defaults(funcao=resumo)
+
+    p = tarefas.add_parser('relatorio', help="grava o relatório de um filtro")
+    p.add_argument('--filial', action='append', help="pode ser repetido; padrão: todas")
+    p.add_argument('--produto', action='append', help="pode ser repetido; padrão: todos")
+    p.add_argument('--inicio', type=pd.Timestamp)
+    p.add_argument('--fim', type=pd.Timestamp)
+    p.add_argument('--formato', choices=list(FORMATOS), help="padrão: pela extensão de --saida")
+    p.add_argument('--saida', required=True)
+    p.set_defaults(funcao=relatorio)
+
+    p = tarefas.add_parser('precos', help="atualiza os preços pela tabela do fornecedor (.csv, .xlsx)")
+    p.add_argument('tabela')
+    p.add_argument('--vigencia', type=pd.Timestamp, help="data a partir da qual os novos preços valem (padrão: hoje)")
+    p.add_argument('--aplicar', action='store_true', help="grava as mudanças (sem isto, só mostra a prévia)")
+    p.set_defaults(funcao=precos)
+
+    p = tarefas.add_parser('recalcular', help="recalcula %% Quebra e Lucro Bruto pelo histórico de preços")
+    p.add_argument('--desde', type=pd.Timestamp, help="só registros a partir desta data")
+    p.add_argument('--produto', action='append', help="pode ser repetido; padrão: todos")
+    p.set_defaults(funcao=recalcular)
+
+    p = tarefas.add_parser('alertas', help="lista os meses com %% Quebra anormalmente alto, do maior escore ao menor")
+    p.add_argument('--desde', type=pd.Timestamp, help="só alertas a partir deste mês")
+    p.add_argument('--limite', type=int, default=50, help="alertas mostrados sem --saida (padrão: 50)")
+    p.add_argument('--saida', help="grava todos os alertas em CSV")
+    p.set_defaults(funcao=alertas)
+
+    p = tarefas.add_parser('producao', help="sugere a produção do dia seguinte ao último lançamento, por filial e produto")
+    p.add_argument('--filial', action='append', help="pode ser repetido; padrão: todas")
+    p.add_argument('--limite', type=int, default=50, help="sugestões mostradas sem --saida (padrão: 50)")
+    p.add_argument('--saida', help="grava todas as sugestões em CSV")
+    p.set_defaults(funcao=producao)
+
+    p = tarefas.add_parser('compactar', help="une as partições mensais pequenas")
+    p.set_defaults(funcao=compactar)
+
+    p = tarefas.add_parser('fila', help="executa as tarefas pendentes da fila do app")
+    p.add_argument('--continuo', action='store_true', help="continua esperando tarefas novas (serviço, no lugar das threads do app)")
+    p.add_argument('--listar', action='store_true', help="só lista as tarefas")
+    p.set_defaults(funcao=fila)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = argumentos()
+    sys.exit(args.funcao(args))
@@ -0,0 +1,104 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+ARQUIVO_LENTAS = 'execucoes_lentas.jsonl'
+DIRETORIO_PERFIS = 'perfis'
+
+# Execuções acima deste tempo (segundos) são gravadas no log
+LIMITE_LENTO = 2.0
+
+
+class Medidor:
+    """Tempo de cada etapa de uma execução do script.
+
+    Cada etapa é medida com `with medidor.etapa('nome'):`; etapas repetidas
+    somam. finalizar() grava uma linha JSON em `arquivo` quando a execução
+    passa de `limite` segundos. Com `perfil=True`, a execução inteira roda sob
+    o cProfile e o perfil das execuções lentas vai para `diretorio_perfis`.
+    """
+
+    def __init__(self, limite=LIMITE_LENTO, arquivo=ARQUIVO_LENTAS, perfil=False, diretorio_perfis=DIRETORIO_PERFIS,
+                 inicio=None):
+        self.limite = limite
+        self.arquivo = arquivo
+        self.diretorio_perfis = diretorio_perfis
+        self.menu = None
+        self.etapas = {}
+        self.total = None
+        self.arquivo_perfil = None
+        self._perfil = cProfile.Profile() if perfil else None
+        # `inicio` permite contar o que rodou antes do medidor existir (as importações)
+        self._inicio = inicio if inicio is not None else time.perf_counter()
+        if self._perfil is not None:
+            try:
+                self._perfil.enable()
+            except ValueError:
+                # Outro perfil já ativo (outra sessão ao mesmo tempo): segue só com os tempos
+                self._perfil = None
+
+    @contextmanager
+    def etapa(self, nome):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas[nome] = self.etapas.get(nome, 0.0) + time.perf_counter() - inicio
+
+    def adicionar(self, nome, segundos):
+        # Etapa medida por fora, antes do medidor existir
+        self.etapas[nome] = self.etapas.get(nome, 0.0) + segundos
+
+    def tempos(self):
+        # [(etapa, segundos)], com o que não foi medido em "outros"
+        total = self.total if self.total is not None else time.perf_counter() - self._inicio
+        linhas = list(self.etapas.items())
+        linhas.append(('outros', max(0.0, total - sum(self.etapas.values()))))
+        linhas.append(('total', total))
+        return linhas
+
+    def finalizar(self):
+        # Pode ser chamado mais de uma vez (por exemplo, antes de um st.rerun); só o primeiro vale
+        if self.total is not None:
+            return self.total
+        self.total = time.perf_counter() - self._inicio
+        if self._perfil is not None:
+            self._perfil.disable()
+        if self.total < self.limite:
+            return self.total
+
+        quando = datetime.now()
+        if self._perfil is not None:
+            os.makedirs(self.diretorio_perfis, exist_ok=True)
+            self.arquivo_perfil = os.path.join(
+                self.diretorio_perfis, f"{quando:%Y%m%d-%H%M%S-%f}_{_nome_arquivo(self.menu)}.prof"
+            )
+            self._perfil.dump_stats(self.arquivo_perfil)
+
+        linha = {
+            'quando': quando.isoformat(timespec='seconds'),
+            'menu': self.menu,
+            'total': round(self.total, 4),
+            'etapas': {nome: round(segundos, 4) for nome, segundos in self.etapas.items()},
+            'perfil': self.arquivo_perfil,
+        }
+        with open(self.arquivo, 'a', encoding='utf-8') as log:
+            log.write(json.dumps(linha, ensure_ascii=False) + '\n')
+        return self.total
+
+    def resumo_perfil(self, linhas=25):
+        # Funções mais caras pelo tempo acumulado, como texto
+        if self._perfil is None:
+            return None
+        saida = io.StringIO()
+        pstats.Stats(self._perfil, stream=saida).sort_stats('cumulative').print_stats(linhas)
+        return saida.getvalue()
+
+
+def _nome_arquivo(texto):
+    return ''.join(c if c.isalnum() else '_' for c in str(texto or 'inicio'))
@@ -0,0 +1,22 @@
+import sys
+
+from armazenamento import ARQUIVO_DADOS, ArmazenamentoParquet, ArmazenamentoParticionado
+
+# Converte os dados atuais (partições CSV ou o antigo dados_quebras.csv) para o backend Parquet.
+# Uso: python migrar_parquet.py [arquivo_csv_legado]
+# Depois, rode o app com CONTROLE_ARMAZENAMENTO=parquet.
+
+if __name__ == "__main__":
+    arquivo_legado = sys.argv[1] if len(sys.argv) > 1 else ARQUIVO_DADOS
+    origem = ArmazenamentoParticionado(arquivo_legado=arquivo_legado)
+    destino = ArmazenamentoParquet()
+
+    df = origem.carregar()
+    if df['Data'].isna().any():
+        sys.exit("Existem datas inválidas nos dados de origem. Corrija antes de migrar.")
+
+    destino.regravar_particoes(df, destino.particoes_de(df))
+    convertido = destino.carregar()
+    print(f"{len(df)} registros lidos, {len(convertido)} gravados em {destino.diretorio}/")
+    if len(convertido) != len(df):
+        sys.exit("A quantidade de registros migrados não confere com a origem.")
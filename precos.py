@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from calculos import chave_texto
+
+ARQUIVO_PRECOS = 'precos.csv'
+ARQUIVO_HISTORICO_PRECOS = 'historico_precos.csv'
+
+COLUNAS_PRECOS = ['COD VIP', 'Produto', 'Custo Unitário', 'Preço Venda Unitário']
+COLUNA_VIGENCIA = 'Vigência'
+COLUNAS_HISTORICO = COLUNAS_PRECOS + [COLUNA_VIGENCIA]
+
+# Vigência dos preços que já existiam antes do histórico: valem para todo o passado
+VIGENCIA_INICIAL = pd.Timestamp('1900-01-01')
+
+
+def versao_precos(arquivo=ARQUIVO_PRECOS):
+    # Muda sempre que o arquivo é regravado; serve de chave para caches de leitura
+    try:
+        info = os.stat(arquivo)
+    except FileNotFoundError:
+        return None
+    return (info.st_mtime_ns, info.st_size)
+
+
+def carregar_precos(arquivo=ARQUIVO_PRECOS):
+    if not os.path.exists(arquivo):
+        return pd.DataFrame(columns=COLUNAS_PRECOS)
+    df_precos = pd.read_csv(arquivo)
+    # Tratar NaN na coluna 'Produto'
+    df_precos['Produto'] = df_precos['Produto'].fillna('Desconhecido')
+    return df_precos
+
+
+def historico_inicial(df_precos):
+    # Sem histórico gravado: a tabela atual vale desde sempre
+    historico = df_precos.reindex(columns=COLUNAS_HISTORICO)
+    historico[COLUNA_VIGENCIA] = VIGENCIA_INICIAL
+    return historico
+
+
+def carregar_historico(arquivo=ARQUIVO_HISTORICO_PRECOS, arquivo_precos=ARQUIVO_PRECOS):
+    if not os.path.exists(arquivo):
+        return historico_inicial(carregar_precos(arquivo_precos))
+    historico = pd.read_csv(arquivo).reindex(columns=COLUNAS_HISTORICO)
+    historico[COLUNA_VIGENCIA] = pd.to_datetime(historico[COLUNA_VIGENCIA])
+    return historico
+
+
+def mudancas_precos(antigos, novos, vigencia):
+    """Linhas a acrescentar ao histórico quando a tabela `antigos` vira `novos`.
+
+    Produtos novos ou com código/custo/preço diferente entram com os valores
+    novos; produtos que saíram da tabela entram sem preço, para que registros
+    a partir de `vigencia` fiquem sem preço como antes. Chave: Produto (vale o
+    primeiro cadastro, como no catálogo de preços).
+    """
+    antigos = antigos.reindex(columns=COLUNAS_PRECOS).drop_duplicates('Produto', keep='first').set_index('Produto')
+    novos = novos.reindex(columns=COLUNAS_PRECOS).drop_duplicates('Produto', keep='first').set_index('Produto')
+
+    comparaveis = antigos.reindex(novos.index)
+    iguais = comparaveis.index.isin(antigos.index)
+    for coluna in ('Custo Unitário', 'Preço Venda Unitário'):
+        a = pd.to_numeric(comparaveis[coluna], errors='coerce').to_numpy(dtype=float)
+        b = pd.to_numeric(novos[coluna], errors='coerce').to_numpy(dtype=float)
+        iguais &= (a == b) | (np.isnan(a) & np.isnan(b))
+    iguais &= chave_texto(comparaveis['COD VIP']) == chave_texto(novos['COD VIP'])
+
+    alterados = novos[~iguais].reset_index()
+    removidos = antigos[~antigos.index.isin(novos.index)].reset_index()
+    removidos[['Custo Unitário', 'Preço Venda Unitário']] = np.nan
+
+    mudancas = pd.concat([alterados, removidos], ignore_index=True).reindex(columns=COLUNAS_HISTORICO)
+    mudancas[COLUNA_VIGENCIA] = pd.Timestamp(vigencia).normalize()
+    return mudancas
+
+
+def salvar_precos(df_precos, vigencia=None, arquivo=ARQUIVO_PRECOS, arquivo_historico=ARQUIVO_HISTORICO_PRECOS):
+    """Grava a tabela atual e acrescenta ao histórico o que mudou, vigente a partir de `vigencia` (padrão: hoje)."""
+    historico = carregar_historico(arquivo_historico, arquivo)
+    mudancas = mudancas_precos(carregar_precos(arquivo), df_precos, vigencia or pd.Timestamp.today())
+    if not mudancas.empty or not os.path.exists(arquivo_historico):
+        historico = pd.concat([historico, mudancas], ignore_index=True) if not mudancas.empty else historico
+        # Histórico antes da tabela atual: quem vê a versão nova de precos.csv já acha o histórico novo
+        temporario = arquivo_historico + '.tmp'
+        historico[COLUNAS_HISTORICO].to_csv(temporario, index=False, date_format='%Y-%m-%d')
+        os.replace(temporario, arquivo_historico)
+
+    temporario = arquivo + '.tmp'
+    df_precos.to_csv(temporario, index=False)
+    os.replace(temporario, arquivo)
@@ -0,0 +1,225 @@
+import math
+import warnings
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from calculos import precos_vigentes
+
+# Dias de histórico usados no ajuste (8 semanas: 8 observações de cada dia da semana)
+JANELA_DIAS = 56
+# Filiais com menos dias registrados na janela ficam sem sugestão (ex.: só importações mensais)
+MINIMO_DIAS = 14
+# Alfas da suavização exponencial testados em cada série
+ALFAS = (0.1, 0.2, 0.3, 0.5, 0.8)
+# Últimos dias da janela, usados para escolher o modelo de cada série
+DIAS_VALIDACAO = 14
+# Desvio mínimo da previsão, em unidades
+PISO_DESVIO = 0.5
+# Proporção de venda perdida / produção: limites para produtos com margem zero ou enorme
+LIMITES_PROPORCAO = (0.05, 0.95)
+
+SAZONAL_INGENUO = 'sazonal ingênuo'
+SUAVIZACAO = 'suavização exponencial'
+
+COLUNAS_SUGESTAO = ['Filial', 'Produto', 'Data', 'Modelo', 'Venda prevista', 'Desvio', 'Sugestão',
+                    'Venda esperada', 'Quebra esperada', '% Quebra esperada', 'Lucro esperado']
+
+
+def matriz_diaria(df, fim, dias=JANELA_DIAS, minimo_dias=MINIMO_DIAS):
+    """Vendidos dos registros como matriz (série x dia), dos `dias` dias até `fim`.
+
+    Cada série é um par (Filial, Produto). Dia sem nenhum registro da filial
+    fica NaN (não houve lançamento); dia com registros da filial mas sem o
+    produto conta como zero vendido. Devolve (chaves, filial_da_serie,
+    presenca, vendidos), com `presenca` (filial x dia) marcando os dias
+    lançados de cada filial.
+    """
+    inicio = fim - pd.Timedelta(days=dias - 1)
+    df = df[(df['Data'] >= inicio) & (df['Data'] <= fim)]
+    # Códigos por coluna e uma chave inteira por série: sem montar tuplas (Filial, Produto) linha a linha
+    codigos_filial, nomes_filiais = pd.factorize(df['Filial'])
+    codigos_produto, nomes_produtos = pd.factorize(df['Produto'])
+    com_chave = (codigos_filial >= 0) & (codigos_produto >= 0)
+    dia = ((df['Data'] - inicio) // pd.Timedelta(days=1)).to_numpy(dtype='int64')
+
+    presenca = np.zeros((len(nomes_filiais), dias), dtype=bool)
+    presenca[codigos_filial[com_chave], dia[com_chave]] = True
+    # Só filiais com lançamentos diários suficientes
+    manter = com_chave & (presenca.sum(axis=1) >= minimo_dias)[codigos_filial]
+
+    n_produtos = len(nomes_produtos)
+    unicas, codigos = np.unique(codigos_filial[manter].astype(np.int64) * n_produtos + codigos_produto[manter],
+                                return_inverse=True)
+    filial_da_serie = unicas // n_produtos
+    chaves = pd.MultiIndex.from_arrays([
+        np.asarray(nomes_filiais.astype(str), dtype=object)[filial_da_serie],
+        np.asarray(nomes_produtos.astype(str), dtype=object)[unicas % n_produtos],
+    ])
+    vendidos = np.where(presenca[filial_da_serie], 0.0, np.nan)
+    # Vários registros do mesmo produto no mesmo dia somam
+    np.add.at(vendidos, (codigos, dia[manter]), pd.to_numeric(df['Vendidos'], errors='coerce').fillna(0).to_numpy()[manter])
+    return chaves, filial_da_serie, presenca, vendidos
+
+
+def fatores_semana(vendidos, filial_da_serie, presenca, dia_semana):
+    # Fator de cada dia da semana por filial (todas as vendas dela): venda média no dia / venda média
+    totais = np.zeros(presenca.shape)
+    np.add.at(totais, filial_da_serie, np.nan_to_num(vendidos))
+    totais = np.where(presenca, totais, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = np.nanmean(totais, axis=1, keepdims=True)
+        fatores = np.ones((presenca.shape[0], 7))
+        for semana in range(7):
+            colunas = totais[:, dia_semana == semana]
+            lancados = (~np.isnan(colunas)).any(axis=1)
+            fatores[lancados, semana] = np.nanmean(colunas[lancados], axis=1) / media[lancados, 0]
+    return np.clip(np.nan_to_num(fatores, nan=1.0), 0.2, 5.0)
+
+
+def _suavizacao(vendidos, sazonal, alfas, validacao):
+    """Suavização exponencial simples do nível dessazonalizado, para vários alfas de uma vez.
+
+    Percorre os dias (poucos) com todas as séries e alfas vetorizados; dia
+    sem lançamento mantém o nível. Cada dia é previsto só com os anteriores.
+    Devolve (nivel_final, erro_ajuste, erro_validacao): erros quadráticos
+    médios (alfa x série) depois da primeira semana e nos últimos `validacao` dias.
+    """
+    x = vendidos / sazonal
+    with warnings.catch_warnings():
+        # Séries sem lançamento na primeira semana partem da média da janela
+        warnings.simplefilter('ignore', RuntimeWarning)
+        nivel = np.nanmean(x[:, :7], axis=1)
+        nivel = np.where(np.isnan(nivel), np.nanmean(x, axis=1), nivel)
+    nivel = np.broadcast_to(np.nan_to_num(nivel), (len(alfas), len(x))).copy()
+    alfas = np.asarray(alfas)[:, None]
+    forma = nivel.shape
+    soma_ajuste, dias_ajuste = np.zeros(forma), np.zeros(forma)
+    soma_validacao, dias_validacao = np.zeros(forma), np.zeros(forma)
+    dias = x.shape[1]
+    for t in range(dias):
+        observado = ~np.isnan(x[:, t])
+        erro = np.where(observado, (nivel * sazonal[:, t] - np.nan_to_num(vendidos[:, t])) ** 2, 0.0)
+        if t >= 7:
+            soma_ajuste += erro
+            dias_ajuste += observado
+        if t >= dias - validacao:
+            soma_validacao += erro
+            dias_validacao += observado
+        nivel = np.where(observado, nivel + alfas * (np.nan_to_num(x[:, t]) - nivel), nivel)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return nivel, soma_ajuste / dias_ajuste, soma_validacao / dias_validacao
+
+
+def prever_vendas(vendidos, fatores, dia_semana, dia_semana_alvo, horizonte=1, alfas=ALFAS, validacao=DIAS_VALIDACAO):
+    """Venda prevista de cada série para o dia `horizonte` depois do fim da matriz.
+
+    Dois modelos por série, ajustados em todas as séries de uma vez:
+    - sazonal ingênuo: a venda do mesmo dia da semana anterior;
+    - suavização exponencial do nível, com o fator do dia da semana da filial
+      (`fatores`, série x 7) e o alfa de menor erro em cada série.
+    Vale o de menor erro nos últimos `validacao` dias, previstos só com os
+    dias anteriores a cada um. Devolve (previsao, desvio, usa_ingenuo), com o
+    desvio estimado pelo erro desses dias.
+    """
+    dias = vendidos.shape[1]
+    nivel, erro_ajuste, erro_validacao = _suavizacao(vendidos, fatores[:, dia_semana], alfas, validacao)
+    melhor = np.argmin(np.nan_to_num(erro_ajuste, nan=np.inf), axis=0)
+    series = np.arange(len(vendidos))
+    previsao = nivel[melhor, series] * fatores[:, dia_semana_alvo]
+    erro = erro_validacao[melhor, series]
+
+    # Sazonal ingênuo nos dias de validação: cada dia contra o mesmo dia da semana anterior
+    validar = slice(dias - validacao, dias)
+    diferencas = (vendidos[:, validar] - vendidos[:, dias - validacao - 7:dias - 7]) ** 2
+    dias_ingenuo = (~np.isnan(diferencas)).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        erro_ingenuo = np.nansum(diferencas, axis=1) / dias_ingenuo
+    # Mesmo dia da semana do alvo na última semana da matriz
+    ingenua = vendidos[:, dias - 7 + (horizonte - 1) % 7]
+    usa_ingenuo = ((erro_ingenuo < np.nan_to_num(erro, nan=np.inf)) & (dias_ingenuo >= validacao // 2)
+                   & ~np.isnan(ingenua))
+
+    previsao = np.where(usa_ingenuo, ingenua, previsao)
+    desvio = np.sqrt(np.nan_to_num(np.where(usa_ingenuo, erro_ingenuo, erro)))
+    # Piso: variação de Poisson da própria previsão
+    desvio = np.maximum(np.maximum(desvio, np.sqrt(np.maximum(previsao, 0))), PISO_DESVIO)
+    return np.maximum(previsao, 0), desvio, usa_ingenuo
+
+
+def _normal(z):
+    # (densidade, acumulada) da normal padrão, elemento a elemento
+    acumulada = 0.5 * (1 + np.frompyfunc(math.erf, 1, 1)(z / math.sqrt(2)).astype(float))
+    return np.exp(-z ** 2 / 2) / math.sqrt(2 * math.pi), acumulada
+
+
+def quantidade_produzir(previsao, desvio, custo, preco_venda):
+    """Quantidade que maximiza o lucro esperado com demanda normal(previsao, desvio).
+
+    Cada unidade a mais rende (preço - custo) se vender e perde o custo se
+    virar quebra: a produção ótima é o quantil (preço - custo) / preço da
+    demanda. Devolve (sugestao, venda_esperada, quebra_esperada) com a
+    sugestão arredondada em unidades.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        proporcao = np.clip((preco_venda - custo) / preco_venda, *LIMITES_PROPORCAO)
+    # Poucos valores distintos (um por preço): o quantil sai de uma tabela
+    valores, posicoes = np.unique(np.nan_to_num(proporcao, nan=LIMITES_PROPORCAO[0]), return_inverse=True)
+    z = np.array([NormalDist().inv_cdf(float(p)) for p in valores])[posicoes]
+    sugestao = np.maximum(np.round(previsao + z * desvio), 0)
+    # Quebra esperada E[(Q - D)+] = desvio * (densidade(u) + u * acumulada(u)), u = (Q - previsão) / desvio
+    u = (sugestao - previsao) / desvio
+    densidade, acumulada = _normal(u)
+    quebra = np.minimum(desvio * (densidade + u * acumulada), sugestao)
+    return sugestao, sugestao - quebra, quebra
+
+
+def sugerir_producao(df, historico, dias=JANELA_DIAS, minimo_dias=MINIMO_DIAS):
+    """Sugestão de produção de cada filial e produto para o dia seguinte ao último lançamento.
+
+    Ajusta os modelos de prever_vendas() nos últimos `dias` dias de todas as
+    séries de uma vez e custeia a sugestão com os preços vigentes no dia
+    (histórico de preços). A venda registrada é tratada como a procura: dias em
+    que o produto acabou subestimam a demanda. Séries sem venda na janela e
+    produtos sem preço ficam de fora.
+
+    Devolve uma linha por série, do maior para o menor lucro esperado.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=COLUNAS_SUGESTAO)
+    datas = pd.to_datetime(df['Data']).dt.normalize()
+    fim = datas.max()
+    df = df.assign(Data=datas)
+    chaves, filial_da_serie, presenca, vendidos = matriz_diaria(df, fim, dias, minimo_dias)
+    if not len(chaves):
+        return pd.DataFrame(columns=COLUNAS_SUGESTAO)
+
+    inicio = fim - pd.Timedelta(days=dias - 1)
+    alvo = fim + pd.Timedelta(days=1)
+    dia_semana = pd.date_range(inicio, fim).dayofweek.to_numpy()
+    fatores = fatores_semana(vendidos, filial_da_serie, presenca, dia_semana)[filial_da_serie]
+    previsao, desvio, usa_ingenuo = prever_vendas(vendidos, fatores, dia_semana, alvo.dayofweek)
+
+    precos = precos_vigentes(pd.DataFrame({'Produto': chaves.get_level_values(1), 'Data': alvo}), historico)
+    custo, preco_venda = precos[:, 0], precos[:, 1]
+    sugestao, venda, quebra = quantidade_produzir(previsao, desvio, custo, preco_venda)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        perc_quebra = np.where(sugestao > 0, quebra / sugestao * 100, 0.0)
+    sugestoes = pd.DataFrame({
+        'Filial': chaves.get_level_values(0),
+        'Produto': chaves.get_level_values(1),
+        'Data': alvo,
+        'Modelo': np.where(usa_ingenuo, SAZONAL_INGENUO, SUAVIZACAO),
+        'Venda prevista': np.round(previsao, 1),
+        'Desvio': np.round(desvio, 1),
+        'Sugestão': sugestao.astype(int),
+        'Venda esperada': np.round(venda, 1),
+        'Quebra esperada': np.round(quebra, 1),
+        '% Quebra esperada': np.round(perc_quebra, 2),
+        'Lucro esperado': np.round(preco_venda * venda - custo * sugestao, 2),
+    })
+    manter = (np.nansum(vendidos, axis=1) > 0) & ~np.isnan(precos).any(axis=1)
+    return (sugestoes[manter].sort_values('Lucro esperado', ascending=False, kind='stable')
+            .reset_index(drop=True))
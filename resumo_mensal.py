@@ -0,0 +1,77 @@
+import pandas as pd
+
+CHAVES_RESUMO = ['Filial', 'Produto', 'Ano', 'Mes']
+METRICAS_RESUMO = ['Quebra', 'Vendidos', 'Lucro Bruto', 'Registros']
+COLUNAS_RESUMO = CHAVES_RESUMO + METRICAS_RESUMO
+
+MESES = {1: 'jan', 2: 'fev', 3: 'mar', 4: 'abr', 5: 'mai', 6: 'jun',
+         7: 'jul', 8: 'ago', 9: 'set', 10: 'out', 11: 'nov', 12: 'dez'}
+
+
+def resumo_vazio():
+    return pd.DataFrame({
+        'Filial': pd.Series(dtype=str), 'Produto': pd.Series(dtype=str),
+        'Ano': pd.Series(dtype='int64'), 'Mes': pd.Series(dtype='int64'),
+        'Quebra': pd.Series(dtype='float64'), 'Vendidos': pd.Series(dtype='float64'),
+        'Lucro Bruto': pd.Series(dtype='float64'), 'Registros': pd.Series(dtype='int64'),
+    })
+
+
+def agregar(df):
+    # Soma os registros no grão (Filial, Produto, ano, mês)
+    if df.empty:
+        return resumo_vazio()
+    datas = pd.to_datetime(df['Data'])
+    base = pd.DataFrame({
+        'Filial': df['Filial'].astype(str).values,
+        'Produto': df['Produto'].astype(str).values,
+        'Ano': datas.dt.year.values,
+        'Mes': datas.dt.month.values,
+        'Quebra': pd.to_numeric(df['Quebra'], errors='coerce').fillna(0).values,
+        'Vendidos': pd.to_numeric(df['Vendidos'], errors='coerce').fillna(0).values,
+        'Lucro Bruto': pd.to_numeric(df['Lucro Bruto'], errors='coerce').fillna(0).values,
+        'Registros': 1,
+    })
+    return base.groupby(CHAVES_RESUMO, as_index=False, sort=False)[METRICAS_RESUMO].sum()
+
+
+def somar(resumo, delta):
+    # Inserções só acrescentam: soma o delta às linhas existentes
+    if delta.empty:
+        return resumo
+    if resumo.empty:
+        return delta.reset_index(drop=True)
+    juntos = pd.concat([resumo, delta], ignore_index=True)
+    return juntos.groupby(CHAVES_RESUMO, as_index=False, sort=False)[METRICAS_RESUMO].sum()
+
+
+def substituir(resumo, remover, delta):
+    # Troca as linhas marcadas em `remover` (máscara booleana) pelo novo agregado
+    return somar(resumo[~remover].reset_index(drop=True), delta)
+
+
+def filtrar(resumo, filiais=None, produtos=None, ano=None):
+    mask = pd.Series(True, index=resumo.index)
+    if filiais is not None:
+        mask &= resumo['Filial'].isin([str(f) for f in filiais])
+    if produtos is not None:
+        mask &= resumo['Produto'].isin(list(produtos))
+    if ano is not None:
+        mask &= resumo['Ano'] == int(ano)
+    return resumo[mask]
+
+
+def tabelas_mensais(resumo):
+    # Quebra, Vendidos, % Quebra e Lucro Bruto por Filial x Mês, em um único groupby
+    por_mes = resumo.groupby(['Filial', 'Mes'])[['Quebra', 'Vendidos', 'Lucro Bruto']].sum().unstack('Mes', fill_value=0)
+
+    quebras_df = por_mes['Quebra'].astype(int)
+    vendas_df = por_mes['Vendidos'].astype(int)
+    perc_quebra_df = (quebras_df / vendas_df * 100).fillna(0).round(1)
+    margem_df = por_mes['Lucro Bruto'].round(2)
+
+    # Renomear colunas com nomes dos meses
+    for df_temp in [quebras_df, vendas_df, perc_quebra_df, margem_df]:
+        df_temp.columns = [MESES[m] for m in df_temp.columns]
+        df_temp.columns.name = None
+    return quebras_df, vendas_df, perc_quebra_df, margem_df
@@ -0,0 +1,246 @@
+from contextlib import closing, nullcontext
+
+import numpy as np
+import pandas as pd
+
+import resumo_mensal
+from anomalias import detectar_anomalias
+from calculos import calcular_metricas_vigentes, precos_vigentes
+from estilo_analise import montar_analise
+from importacao import RegistroImportacoes, hash_conteudo, ids_importacao, ler_planilhas, montar_registros
+from previsao import COLUNAS_SUGESTAO, JANELA_DIAS, sugerir_producao
+
+# Operações do app sem interface, usadas pelo controle.py e pelas tarefas em lote (lote.py).
+# Nada aqui importa o Streamlit.
+
+COLUNAS_TOTAIS = ('Quebra', 'Vendidos', 'Lucro Bruto')
+
+
+def _etapa(medidor, nome):
+    return medidor.etapa(nome) if medidor is not None else nullcontext()
+
+
+# ---------- relatório ----------
+
+def montar_relatorio(armazenamento, historico, filiais=None, produtos=None, inicio=None, fim=None):
+    """Registros do filtro com os preços vigentes na data de cada um, e os totais do filtro inteiro.
+
+    Devolve (df_relatorio, totais).
+    """
+    # Filtros aplicados na leitura: só as partições do filtro são abertas
+    df_filt = armazenamento.carregar(
+        filiais=None if filiais is None else list(filiais),
+        produtos=None if produtos is None else list(produtos),
+        inicio=inicio, fim=fim, categorias=True
+    )
+    df_relatorio = df_filt.copy()
+    df_relatorio[['Custo Unitário', 'Preço Venda Unitário']] = precos_vigentes(df_filt, historico)
+    colunas_para_remover = ['ID', 'Inicial', 'Estoque Final']
+    df_relatorio.drop(columns=[col for col in colunas_para_remover if col in df_relatorio.columns], inplace=True)
+    totais = {coluna: float(df_relatorio[coluna].sum()) for coluna in COLUNAS_TOTAIS}
+    return df_relatorio, totais
+
+
+def ordem_relatorio(df_relatorio, ordenar_por, crescente=True):
+    # Posições das linhas na ordem pedida (estável; vazios no fim)
+    return (df_relatorio[ordenar_por].reset_index(drop=True)
+            .sort_values(ascending=crescente, kind='stable', na_position='last').index.to_numpy())
+
+
+def recalcular_lucro(armazenamento, historico, produtos=None, inicio=None, medidor=None):
+    """Recalcula '% Quebra' e 'Lucro Bruto' pelo histórico de preços.
+
+    Só lê os registros dos `produtos` a partir de `inicio` (None: todos) e só
+    regrava as linhas cujo valor mudou. Devolve quantas linhas mudaram.
+    """
+    with _etapa(medidor, 'carregar registros'):
+        df = armazenamento.carregar(produtos=None if produtos is None else list(produtos), inicio=inicio)
+    if df.empty:
+        return 0
+    with _etapa(medidor, 'recalcular'):
+        novos, _ = calcular_metricas_vigentes(df, historico)
+        mudou = np.zeros(len(df), dtype=bool)
+        for coluna in ('% Quebra', 'Lucro Bruto'):
+            # Tolerância de meio centavo: o Parquet guarda float32
+            antes = pd.to_numeric(df[coluna], errors='coerce').to_numpy(dtype=float)
+            depois = novos[coluna].to_numpy(dtype=float)
+            mudou |= ~np.isclose(antes, depois, rtol=0, atol=0.005, equal_nan=True)
+    if mudou.any():
+        with _etapa(medidor, 'gravar'):
+            armazenamento.atualizar(df[mudou], novos[mudou])
+    return int(mudou.sum())
+
+
+def excluir_periodo(armazenamento, filiais, inicio, fim, ids=None, medidor=None):
+    """Exclui (com backup) os registros das `filiais` entre `inicio` e `fim`.
+
+    Com `ids`, só os registros com esses IDs (os que foram conferidos na tela);
+    registros incluídos no período depois disso ficam. Devolve quantos saíram.
+    """
+    with _etapa(medidor, 'carregar registros'):
+        df = armazenamento.carregar(filiais=list(filiais), inicio=inicio, fim=fim)
+        if ids is not None:
+            df = df[df['ID'].astype(str).isin(set(ids))]
+    if df.empty:
+        return 0
+    with _etapa(medidor, 'gravar'):
+        armazenamento.excluir(df, backup=True)
+    return len(df)
+
+
+# ---------- análise ----------
+
+def montar_dashboard(resumo, filiais=None, produtos=None, ano=None):
+    # Tabelas, estilos e totais da Análise; None quando o filtro não tem dados
+    resumo_filt = resumo_mensal.filtrar(resumo, filiais=filiais, produtos=produtos, ano=ano)
+    return montar_analise(resumo_filt) if not resumo_filt.empty else None
+
+
+# ---------- alertas ----------
+
+def alertas_periodos(armazenamento, periodos, resumo=None):
+    # Alertas só dos (Filial, Ano, Mes) informados; o histórico inteiro entra na linha de base
+    alertas = detectar_anomalias(armazenamento.carregar_resumo() if resumo is None else resumo)
+    periodos = pd.DataFrame(list(periodos), columns=['Filial', 'Ano', 'Mes']).astype({'Filial': str, 'Ano': int, 'Mes': int})
+    chaves = alertas[['Filial', 'Ano', 'Mes']].astype({'Filial': str, 'Ano': int, 'Mes': int})
+    dentro = pd.MultiIndex.from_frame(chaves).isin(pd.MultiIndex.from_frame(periodos.drop_duplicates()))
+    return alertas[dentro].reset_index(drop=True)
+
+
+# ---------- produção ----------
+
+def sugestao_producao(armazenamento, historico, resumo=None):
+    # Só os registros recentes são lidos: a previsão usa as últimas JANELA_DIAS até o último lançamento
+    resumo = armazenamento.carregar_resumo() if resumo is None else resumo
+    if resumo.empty:
+        return pd.DataFrame(columns=COLUNAS_SUGESTAO)
+    ultimo = int((resumo['Ano'].astype(int) * 12 + resumo['Mes'].astype(int) - 1).max())
+    inicio = pd.Timestamp(ultimo // 12, ultimo % 12 + 1, 1) - pd.Timedelta(days=JANELA_DIAS)
+    return sugerir_producao(armazenamento.carregar(inicio=inicio), historico)
+
+
+# ---------- importação ----------
+
+def _registros_importados(armazenamento, livro, filial, ano, mes):
+    # ID, Filial e Data dos registros criados pelas importações anteriores da filial e mês
+    ids, sem_ids = livro.ids_importados(filial, ano, mes)
+    dia = pd.Timestamp(int(ano), int(mes), 1)
+    registros = pd.DataFrame({'ID': ids, 'Filial': str(filial), 'Data': dia}, columns=['ID', 'Filial', 'Data'])
+    if sem_ids:
+        # Importações gravadas antes de o livro guardar os IDs: os registros delas
+        # são os da filial no dia 1º, onde toda importação é lançada
+        atuais = armazenamento.carregar(filiais=[str(filial)], inicio=dia, fim=dia)
+        atuais = atuais[pd.to_datetime(atuais['Data']) == dia]
+        registros = pd.concat([registros, atuais[['ID', 'Filial', 'Data']]], ignore_index=True)
+    return registros
+
+
+def importar_lote(armazenamento, planilhas, destinos, catalogo, historico, substituir_mes=False,
+                  processos=None, progresso=None, medidor=None):
+    """Importa um lote de planilhas em uma única gravação (tudo ou nada).
+
+    `planilhas` é [(nome, bytes)] e `destinos` é [(filial, ano, mes)] na mesma
+    ordem; `catalogo` é o CatalogoPrecos atual e `historico` o histórico de
+    preços. Uma planilha já importada para a filial e o mês é ignorada; outras
+    planilhas do mesmo mês somam-se às anteriores, a não ser que
+    `substituir_mes` seja verdadeiro: aí os registros criados pelas importações
+    anteriores do mês saem. `progresso(lidos, total, arquivo)` é chamado a cada
+    planilha lida.
+
+    Devolve (situacao, resultado): `situacao` tem uma linha por arquivo e
+    `resultado['status']` é 'ok', 'erro', 'nada' (nada novo) ou 'sem_preco'.
+    Com 'ok', `resultado['alertas']` traz as anomalias de quebra dos meses importados.
+    """
+    with _etapa(medidor, 'livro de importações'):
+        livro = RegistroImportacoes(armazenamento.diretorio)
+
+    # Checa repetições pelo hash antes de ler qualquer planilha
+    situacao, a_ler, vistos = {}, [], set()
+    for posicao, ((nome, conteudo), (filial, ano, mes)) in enumerate(zip(planilhas, destinos)):
+        chave = (hash_conteudo(conteudo), str(filial).strip(), int(ano), int(mes))
+        situacao[posicao] = {'Arquivo': nome, 'Filial': chave[1], 'Mês': chave[3], 'Ano': chave[2]}
+        if chave in vistos:
+            situacao[posicao]['Situação'] = "Repetida no lote: ignorada"
+        elif livro.ja_importado(*chave) and not substituir_mes:
+            situacao[posicao]['Situação'] = "Já importada: ignorada"
+        else:
+            a_ler.append((posicao, chave))
+        vistos.add(chave)
+
+    # Ler as planilhas em paralelo
+    resultados = {}
+    with _etapa(medidor, 'ler planilhas'):
+        # closing: se o progresso interromper a leitura (tarefa cancelada), o pool para na hora
+        with closing(ler_planilhas([planilhas[p] for p, _ in a_ler], processos=processos)) as leitura:
+            for lidos, (i, resultado) in enumerate(leitura, start=1):
+                resultados[a_ler[i][0]] = resultado
+                if progresso is not None:
+                    progresso(lidos, len(a_ler), resultado['arquivo'])
+
+    montados, com_erro = [], False
+    for posicao, chave in a_ler:
+        resultado = resultados[posicao]
+        linha = situacao[posicao]
+        linha['Linhas lidas'] = resultado['linhas']
+        linha['Tempo (s)'] = round(resultado['segundos'], 2)
+        if resultado['erro']:
+            com_erro = True
+            linha['Situação'] = f"Erro: {resultado['erro']}"
+            continue
+        _, filial_arquivo, ano_arquivo, mes_arquivo = chave
+        with _etapa(medidor, 'montar registros'):
+            registros, produtos_sem_preco = montar_registros(
+                resultado['planilha'], filial_arquivo, ano_arquivo, mes_arquivo, catalogo, historico
+            )
+        montados.append((chave, linha, registros, produtos_sem_preco))
+
+    resultado = {'registros': 0, 'planilhas': 0}
+    if com_erro:
+        resultado['status'] = 'erro'
+    elif not a_ler:
+        resultado['status'] = 'nada'
+    else:
+        # Trava de escrita do livro até a gravação: outro processo pode ter importado
+        # os mesmos meses enquanto as planilhas eram lidas
+        with armazenamento.escrita():
+            livro = RegistroImportacoes(armazenamento.diretorio)
+            lotes, remover, livro_novos, substituidos = [], [], [], []
+            for chave, linha, registros, produtos_sem_preco in montados:
+                hash_arquivo, filial_arquivo, ano_arquivo, mes_arquivo = chave
+                linha['Registros'] = len(registros)
+                linha['Situação'] = "OK"
+                if livro.ja_importado(*chave) and not substituir_mes:
+                    linha['Registros'] = 0
+                    linha['Situação'] = "Importada por outra sessão durante a leitura: ignorada"
+                    continue
+                # Os IDs vêm do arquivo: se a gravação terminou e o livro não, importar
+                # de novo troca as mesmas linhas em vez de duplicá-las
+                registros = registros.assign(ID=ids_importacao(*chave, registros['Produto']))
+                remover.append(registros[['ID', 'Filial', 'Data']])
+                if substituir_mes and livro.mes_importado(*chave[1:]):
+                    if chave[1:] not in substituidos:
+                        remover.append(_registros_importados(armazenamento, livro, *chave[1:]))
+                        substituidos.append(chave[1:])
+                    linha['Situação'] = "Substitui a importação anterior"
+                if produtos_sem_preco:
+                    linha['Situação'] += f" | Sem preço cadastrado (não importados): {', '.join(produtos_sem_preco)}"
+                lotes.append(registros)
+                livro_novos.append([*chave, linha['Arquivo'], len(registros), None, list(registros['ID'])])
+
+            df_novo = pd.concat(lotes, ignore_index=True) if lotes else pd.DataFrame()
+            resultado = {'registros': len(df_novo), 'planilhas': len(lotes)}
+            if not lotes:
+                resultado['status'] = 'nada'
+            elif df_novo.empty and not substituidos:
+                resultado['status'] = 'sem_preco'
+            else:
+                # Uma única gravação para o lote inteiro; o livro é gravado ainda sob a trava
+                with _etapa(medidor, 'gravar'):
+                    armazenamento.substituir(pd.concat(remover, ignore_index=True), df_novo)
+                livro.registrar(livro_novos, substituidos=substituidos)
+                resultado['status'] = 'ok'
+    situacao = list(situacao.values())
+    if resultado['status'] == 'ok':
+        with _etapa(medidor, 'anomalias'):
+            resultado['alertas'] = alertas_periodos(armazenamento, [novo[1:4] for novo in livro_novos])
+    return situacao, resultado
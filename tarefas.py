@@ -0,0 +1,380 @@
+import json
+import os
+import shutil
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+from armazenamento import RegistroDesatualizado, fcntl, novos_ids
+from catalogo_precos import CatalogoPrecos
+from servicos import excluir_periodo, importar_lote, recalcular_lucro
+
+# Fila de tarefas pesadas: importação de planilhas, exclusão por período e recálculo
+# do Lucro Bruto. A página só envia a tarefa e acompanha o andamento; quem executa são
+# threads do processo do app (ou `python lote.py fila`), então fechar a aba não
+# interrompe nada no meio. A tabela de tarefas fica em disco e é compartilhada pelos
+# processos do app (trabalhadores.py): cada tarefa é reservada por um só deles.
+
+DIRETORIO_TAREFAS = 'tarefas'
+ARQUIVO_TABELA = 'tarefas.json'
+ARQUIVO_TRAVA_FILA = '_trava'
+
+PENDENTE, EXECUTANDO, CONCLUIDA, ERRO, CANCELADA = 'pendente', 'executando', 'concluída', 'erro', 'cancelada'
+TERMINADAS = (CONCLUIDA, ERRO, CANCELADA)
+
+# Tentativas automáticas: tarefa recusada por conflito de gravação, ou interrompida antes de gravar
+MAXIMO_TENTATIVAS = 3
+# Tarefas terminadas guardadas com anexos e resultados; as mais antigas são apagadas
+MAXIMO_TERMINADAS = 100
+# Segundos entre consultas à fila quando não há tarefa pendente
+INTERVALO_CONSULTA = 1.0
+
+COLUNAS_TAREFAS = ['ID', 'Tipo', 'Descrição', 'Situação', 'Progresso', 'Etapa', 'Mensagem', 'Tentativas',
+                   'Criada em', 'Iniciada em', 'Terminada em']
+
+
+class TarefaCancelada(Exception):
+    pass
+
+
+def _agora():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _processo_atual():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _processo_vivo(processo):
+    # Só dá para conferir processos desta máquina (e fora do Windows, onde os.kill encerraria o processo)
+    maquina, _, pid = processo.rpartition(':')
+    if maquina != socket.gethostname() or os.name == 'nt':
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class FilaTarefas:
+    """Tabela de tarefas em <diretorio>/tarefas.json, com uma pasta por tarefa.
+
+    A pasta guarda os parâmetros, os anexos (planilhas enviadas) e as tabelas
+    de resultado, para a tarefa poder ser repetida e consultada depois.
+    Alterações na tabela passam por uma trava entre processos; as leituras
+    não precisam dela, porque a tabela é sempre trocada inteira.
+    """
+
+    def __init__(self, diretorio=DIRETORIO_TAREFAS):
+        self.diretorio = diretorio
+        # Não reentrante: uma segunda trava do arquivo no mesmo processo esperaria pela primeira
+        self._trava = threading.Lock()
+
+    # ---------- tabela ----------
+
+    @contextmanager
+    def _alterar(self):
+        # Lê a tabela sob a trava e grava de volta só se mudou
+        with self._trava:
+            os.makedirs(self.diretorio, exist_ok=True)
+            with open(os.path.join(self.diretorio, ARQUIVO_TRAVA_FILA), 'a') as arquivo:
+                if fcntl is not None:
+                    fcntl.flock(arquivo, fcntl.LOCK_EX)
+                tarefas = self._ler()
+                antes = json.dumps(tarefas)
+                yield tarefas
+                if json.dumps(tarefas) != antes:
+                    caminho = os.path.join(self.diretorio, ARQUIVO_TABELA)
+                    with open(caminho + '.tmp', 'w', encoding='utf-8') as f:
+                        json.dump(tarefas, f, ensure_ascii=False)
+                    os.replace(caminho + '.tmp', caminho)
+
+    def _ler(self):
+        try:
+            with open(os.path.join(self.diretorio, ARQUIVO_TABELA), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _procurar(tarefas, id_tarefa):
+        for tarefa in tarefas:
+            if tarefa['ID'] == id_tarefa:
+                return tarefa
+        raise KeyError(f"Tarefa não encontrada: {id_tarefa}")
+
+    def _pasta(self, id_tarefa):
+        return os.path.join(self.diretorio, id_tarefa)
+
+    # ---------- envio e consulta ----------
+
+    def enviar(self, tipo, descricao, parametros, anexos=()):
+        """Põe uma tarefa no fim da fila e devolve o ID dela.
+
+        `parametros` precisa ser serializável em JSON; `anexos` é [(nome, bytes)].
+        """
+        if tipo not in EXECUTORES:
+            raise ValueError(f"Tipo de tarefa desconhecido: {tipo}")
+        id_tarefa = novos_ids(1)[0]
+        pasta = self._pasta(id_tarefa)
+        os.makedirs(os.path.join(pasta, 'anexos'))
+        for posicao, (_, conteudo) in enumerate(anexos):
+            with open(os.path.join(pasta, 'anexos', str(posicao)), 'wb') as f:
+                f.write(conteudo)
+        with open(os.path.join(pasta, 'parametros.json'), 'w', encoding='utf-8') as f:
+            json.dump({'parametros': parametros, 'anexos': [nome for nome, _ in anexos]}, f, ensure_ascii=False)
+
+        with self._alterar() as tarefas:
+            tarefas.append({
+                'ID': id_tarefa, 'Tipo': tipo, 'Descrição': descricao, 'Situação': PENDENTE,
+                'Progresso': 0.0, 'Etapa': '', 'Mensagem': '', 'Tentativas': 0,
+                'Criada em': _agora(), 'Iniciada em': None, 'Terminada em': None,
+                'Processo': None, 'Cancelar': False, 'Gravando': False,
+            })
+            terminadas = [t['ID'] for t in tarefas if t['Situação'] in TERMINADAS]
+            apagar = set(terminadas[:max(0, len(terminadas) - MAXIMO_TERMINADAS)])
+            tarefas[:] = [t for t in tarefas if t['ID'] not in apagar]
+        for id_apagada in apagar:
+            shutil.rmtree(self._pasta(id_apagada), ignore_errors=True)
+        return id_tarefa
+
+    def listar(self):
+        # Da mais recente para a mais antiga
+        return pd.DataFrame(list(reversed(self._ler())), columns=COLUNAS_TAREFAS)
+
+    def obter(self, id_tarefa):
+        return next((t for t in self._ler() if t['ID'] == id_tarefa), None)
+
+    def parametros(self, id_tarefa):
+        # (parametros, anexos) como foram enviados
+        pasta = self._pasta(id_tarefa)
+        with open(os.path.join(pasta, 'parametros.json'), encoding='utf-8') as f:
+            dados = json.load(f)
+        anexos = []
+        for posicao, nome in enumerate(dados['anexos']):
+            with open(os.path.join(pasta, 'anexos', str(posicao)), 'rb') as f:
+                anexos.append((nome, f.read()))
+        return dados['parametros'], anexos
+
+    def resultados(self, id_tarefa):
+        # Tabelas gravadas pela tarefa, por nome ('situacao', 'alertas', ...)
+        pasta = self._pasta(id_tarefa)
+        if not os.path.isdir(pasta):
+            return {}
+        return {nome[:-len('.csv')]: pd.read_csv(os.path.join(pasta, nome), dtype={'Filial': str})
+                for nome in sorted(os.listdir(pasta)) if nome.endswith('.csv')}
+
+    # ---------- cancelamento e repetição ----------
+
+    def cancelar(self, id_tarefa):
+        """Pendente sai da fila na hora; em execução para na próxima etapa, se ainda não começou a gravar.
+
+        Devolve a situação da tarefa depois do pedido.
+        """
+        with self._alterar() as tarefas:
+            tarefa = self._procurar(tarefas, id_tarefa)
+            if tarefa['Situação'] == PENDENTE:
+                tarefa.update({'Situação': CANCELADA, 'Mensagem': "Cancelada antes de começar.", 'Terminada em': _agora()})
+            elif tarefa['Situação'] == EXECUTANDO:
+                tarefa['Cancelar'] = True
+            return tarefa['Situação']
+
+    def repetir(self, id_tarefa):
+        # Tarefa com erro ou cancelada volta para o fim da fila, com os mesmos parâmetros e anexos
+        with self._alterar() as tarefas:
+            tarefa = self._procurar(tarefas, id_tarefa)
+            if tarefa['Situação'] not in (ERRO, CANCELADA):
+                raise ValueError("Só tarefas com erro ou canceladas podem ser repetidas.")
+            tarefa.update({'Situação': PENDENTE, 'Progresso': 0.0, 'Etapa': '', 'Mensagem': '', 'Tentativas': 0,
+                           'Terminada em': None, 'Cancelar': False, 'Gravando': False})
+            tarefas.remove(tarefa)
+            tarefas.append(tarefa)
+
+    # ---------- execução ----------
+
+    @staticmethod
+    def _recuperar_interrompidas(tarefas):
+        # Em execução por um processo que não existe mais (app reiniciado, processo caiu)
+        for tarefa in tarefas:
+            if tarefa['Situação'] != EXECUTANDO or _processo_vivo(tarefa['Processo']):
+                continue
+            if tarefa['Cancelar']:
+                tarefa.update({'Situação': CANCELADA, 'Mensagem': "Cancelada (o processo parou)."})
+            elif tarefa['Gravando']:
+                # A gravação pode ter ficado pela metade: repetir sozinho poderia duplicar registros
+                tarefa.update({'Situação': ERRO, 'Mensagem': "Interrompida durante a gravação. "
+                               "Confira os dados antes de repetir a tarefa."})
+            elif tarefa['Tentativas'] < MAXIMO_TENTATIVAS:
+                tarefa.update({'Situação': PENDENTE, 'Mensagem': "Interrompida antes de gravar: de volta à fila."})
+                continue
+            else:
+                tarefa.update({'Situação': ERRO, 'Mensagem': "Interrompida antes de gravar em todas as tentativas."})
+            tarefa['Terminada em'] = _agora()
+
+    def reservar(self):
+        """Reserva para este processo a tarefa pendente mais antiga e a devolve (None: nada a fazer)."""
+        # Consulta sem trava primeiro: com a fila parada, as threads não regravam nada
+        if not any(t['Situação'] in (PENDENTE, EXECUTANDO) for t in self._ler()):
+            return None
+        with self._alterar() as tarefas:
+            self._recuperar_interrompidas(tarefas)
+            tarefa = next((t for t in tarefas if t['Situação'] == PENDENTE), None)
+            if tarefa is None:
+                return None
+            tarefa.update({'Situação': EXECUTANDO, 'Processo': _processo_atual(), 'Tentativas': tarefa['Tentativas'] + 1,
+                           'Iniciada em': _agora(), 'Progresso': 0.0, 'Etapa': '', 'Gravando': False})
+            return dict(tarefa)
+
+    def anotar(self, id_tarefa, progresso=None, etapa=None, gravando=False):
+        """Anota o andamento da tarefa em execução.
+
+        Levanta TarefaCancelada se o cancelamento foi pedido e a tarefa ainda
+        não começou a gravar; `gravando=True` marca que começou.
+        """
+        with self._alterar() as tarefas:
+            tarefa = self._procurar(tarefas, id_tarefa)
+            if tarefa['Cancelar'] and not tarefa['Gravando']:
+                raise TarefaCancelada()
+            if progresso is not None:
+                tarefa['Progresso'] = round(float(progresso), 3)
+            if etapa is not None:
+                tarefa['Etapa'] = etapa
+            if gravando:
+                tarefa['Gravando'] = True
+
+    def terminar(self, id_tarefa, situacao, mensagem, tabelas=None):
+        # `situacao` PENDENTE devolve a tarefa à fila para outra tentativa
+        pasta = self._pasta(id_tarefa)
+        for nome in os.listdir(pasta):
+            if nome.endswith('.csv'):
+                os.remove(os.path.join(pasta, nome))
+        for nome, tabela in (tabelas or {}).items():
+            tabela.to_csv(os.path.join(pasta, f"{nome}.csv"), index=False)
+        with self._alterar() as tarefas:
+            tarefa = self._procurar(tarefas, id_tarefa)
+            if situacao == CONCLUIDA and tarefa['Cancelar']:
+                mensagem += " (o cancelamento chegou depois do início da gravação)"
+            tarefa.update({'Situação': situacao, 'Mensagem': mensagem,
+                           'Terminada em': _agora() if situacao in TERMINADAS else None})
+            if situacao == CONCLUIDA:
+                tarefa.update({'Progresso': 1.0, 'Etapa': ''})
+
+
+class _Andamento:
+    """Faz as vezes do medidor nos serviços: cada etapa vira andamento da tarefa.
+
+    O cancelamento é atendido no começo de cada etapa até 'gravar'; dali em
+    diante a tarefa vai até o fim, para não deixar uma gravação pela metade.
+    """
+
+    def __init__(self, fila, id_tarefa, fracoes):
+        self.fila = fila
+        self.id_tarefa = id_tarefa
+        self.fracoes = fracoes
+
+    @contextmanager
+    def etapa(self, nome):
+        self.fila.anotar(self.id_tarefa, self.fracoes.get(nome), nome, gravando=nome == 'gravar')
+        yield
+
+    def progresso(self, fracao, texto):
+        self.fila.anotar(self.id_tarefa, fracao, texto)
+
+
+# ---------- tipos de tarefa ----------
+# Cada um recebe (armazenamento, parametros, anexos, andamento) e devolve (ok, mensagem, tabelas)
+
+MENSAGENS_IMPORTACAO = {
+    'erro': "Nenhum dado foi importado: corrija os arquivos com erro e importe o lote novamente.",
+    'nada': "Nenhuma planilha nova para importar.",
+    'sem_preco': "Nenhum dado foi importado pois todos os produtos estavam sem preço.",
+}
+
+
+def _importar(armazenamento, parametros, anexos, andamento):
+    # Catálogo e preços lidos na hora da execução, não na do envio. As planilhas
+    # são lidas nesta thread: um fork com as threads do app rodando pode herdar
+    # travas presas, e o spawn executaria de novo o script do Streamlit
+    situacao, resultado = importar_lote(
+        armazenamento, anexos, [tuple(destino) for destino in parametros['destinos']],
+        CatalogoPrecos(armazenamento.carregar_precos()), armazenamento.carregar_historico_precos(),
+        substituir_mes=parametros['substituir_mes'], processos=1, medidor=andamento,
+        progresso=lambda lidos, total, arquivo: andamento.progresso(0.05 + 0.75 * lidos / total, f"{lidos}/{total} lidos: {arquivo}")
+    )
+    tabelas = {'situacao': pd.DataFrame(situacao)}
+    if resultado['status'] == 'ok':
+        tabelas['alertas'] = resultado['alertas']
+        mensagem = f"{resultado['registros']} registros de {resultado['planilhas']} planilha(s) adicionados."
+    else:
+        mensagem = MENSAGENS_IMPORTACAO[resultado['status']]
+    return resultado['status'] != 'erro', mensagem, tabelas
+
+
+def _excluir_periodo(armazenamento, parametros, anexos, andamento):
+    excluidos = excluir_periodo(armazenamento, parametros['filiais'], parametros['inicio'], parametros['fim'],
+                                ids=parametros.get('ids'), medidor=andamento)
+    return True, f"{excluidos} registros excluídos.", {}
+
+
+def _recalcular(armazenamento, parametros, anexos, andamento):
+    alterados = recalcular_lucro(armazenamento, armazenamento.carregar_historico_precos(),
+                                 produtos=parametros.get('produtos'), inicio=parametros.get('inicio'), medidor=andamento)
+    return True, f"{alterados} registro(s) recalculado(s).", {}
+
+
+EXECUTORES = {'importar': _importar, 'excluir_periodo': _excluir_periodo, 'recalcular': _recalcular}
+
+# Progresso ao começar cada etapa dos serviços
+FRACOES_ETAPAS = {'livro de importações': 0.0, 'ler planilhas': 0.05, 'carregar registros': 0.05,
+                  'recalcular': 0.5, 'gravar': 0.85, 'anomalias': 0.95}
+
+
+def executar_tarefa(fila, armazenamento, tarefa):
+    id_tarefa = tarefa['ID']
+    try:
+        parametros, anexos = fila.parametros(id_tarefa)
+        ok, mensagem, tabelas = EXECUTORES[tarefa['Tipo']](
+            armazenamento, parametros, anexos, _Andamento(fila, id_tarefa, FRACOES_ETAPAS)
+        )
+        fila.terminar(id_tarefa, CONCLUIDA if ok else ERRO, mensagem, tabelas)
+    except TarefaCancelada:
+        fila.terminar(id_tarefa, CANCELADA, "Cancelada; nada foi gravado.")
+    except RegistroDesatualizado as e:
+        # Outra sessão gravou nos mesmos registros entre a leitura e a gravação: repete relendo
+        if tarefa['Tentativas'] < MAXIMO_TENTATIVAS:
+            fila.terminar(id_tarefa, PENDENTE, f"{e} Nova tentativa na fila.")
+        else:
+            fila.terminar(id_tarefa, ERRO, str(e))
+    except Exception as e:
+        fila.terminar(id_tarefa, ERRO, f"Erro: {str(e)}")
+
+
+def trabalhar(fila, armazenamento, parar=None, intervalo=INTERVALO_CONSULTA):
+    """Executa as tarefas da fila, uma por vez.
+
+    Com `parar` (threading.Event), continua esperando tarefas novas até ele
+    ser ligado; sem ele, volta quando a fila esvazia.
+    """
+    while parar is None or not parar.is_set():
+        tarefa = fila.reservar()
+        if tarefa is None:
+            if parar is None:
+                return
+            parar.wait(intervalo)
+            continue
+        executar_tarefa(fila, armazenamento, tarefa)
+
+
+def iniciar_trabalhadores(fila, armazenamento, quantidade=1):
+    # Threads daemon: saem com o processo; o que ficou no meio volta à fila na próxima reserva
+    parar = threading.Event()
+    for numero in range(quantidade):
+        threading.Thread(target=trabalhar, args=(fila, armazenamento, parar),
+                         name=f"tarefas-{numero + 1}", daemon=True).start()
+    return parar
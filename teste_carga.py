@@ -0,0 +1,187 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import resumo_mensal
+from armazenamento import VARIAVEL_BACKEND, RegistroDesatualizado, obter_armazenamento
+from benchmark import TAMANHOS, gerar_historico, gerar_precos
+from calculos import calcular_metricas_vigentes
+from conjunto_registros import ConjuntoRegistros, GravacaoIncremental
+
+# Teste de carga local: N gerentes gravando ao mesmo tempo, cada um em um processo,
+# como sessões em workers diferentes do app (trabalhadores.py). Antes de cada
+# operação o gerente sincroniza sua cópia em memória, como a cada execução da página.
+# No fim confere que nenhuma gravação se perdeu e que todos enxergam os mesmos registros.
+# Uso: python teste_carga.py --gerentes 8 --operacoes 100 [--armazenamento sqlite] [--tamanho pequeno]
+
+# Proporção de cada operação de um gerente
+OPERACOES = {'registrar': 0.6, 'editar': 0.3, 'excluir': 0.1}
+COLUNAS_COMPARADAS = ['ID', 'Data', 'Produto', 'Filial', 'Vendidos', 'Quebra', 'Lucro Bruto']
+
+
+def gerente(numero, trabalho, backend, filiais, operacoes, lote, semente, largada, chegada, fila):
+    os.chdir(trabalho)
+    os.environ[VARIAVEL_BACKEND] = backend
+    gerador = np.random.default_rng(semente + 100 + numero)
+    armazenamento = GravacaoIncremental(obter_armazenamento(), ConjuntoRegistros())
+    historico = armazenamento.carregar_historico_precos()
+    produtos = armazenamento.carregar_precos()['Produto'].to_numpy()
+    filial = str(numero % filiais + 1)
+    tempos, contagem = [], {'gravacoes': 0, 'conflitos': 0}
+
+    def medido(nome, funcao):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append((nome, time.perf_counter() - inicio))
+        return resultado
+
+    armazenamento.sincronizar()
+    largada.wait()
+    for _ in range(operacoes):
+        tipo = medido('sincronizar', armazenamento.sincronizar)
+        tempos[-1] = (f"sincronizar ({tipo})", tempos[-1][1])
+        df = armazenamento.conjunto.tabela()
+        operacao = gerador.choice(list(OPERACOES), p=list(OPERACOES.values()))
+
+        if operacao == 'registrar':
+            # Registro em lote: alguns produtos da filial do gerente em um dia
+            novos = pd.DataFrame({
+                'Data': pd.Timestamp(2025, 12, 1) + pd.Timedelta(days=int(gerador.integers(0, 31))),
+                'Produto': gerador.choice(produtos, lote, replace=False),
+                'Vendidos': gerador.integers(0, 50, lote).astype(float),
+                'Quebra': gerador.integers(0, 5, lote).astype(float),
+                'Filial': filial,
+            })
+            novos, _ = calcular_metricas_vigentes(novos, historico)
+            medido('registrar', lambda: armazenamento.inserir(novos))
+        elif operacao == 'editar':
+            # Qualquer filial: dois gerentes podem editar o mesmo registro
+            antigo = df.iloc[[int(gerador.integers(len(df)))]].astype({'Filial': str, 'Produto': str})
+            novo, _ = calcular_metricas_vigentes(antigo.assign(Vendidos=float(gerador.integers(0, 50))), historico)
+            try:
+                medido('editar', lambda: armazenamento.atualizar(antigo, novo))
+            except RegistroDesatualizado:
+                contagem['conflitos'] += 1
+                continue
+        else:
+            da_filial = np.flatnonzero((df['Filial'] == filial).to_numpy())
+            registro = df.iloc[[int(gerador.choice(da_filial))]].astype({'Filial': str, 'Produto': str})
+            medido('excluir', lambda: armazenamento.excluir(registro))
+        contagem['gravacoes'] += 1
+
+    # Sincronização final depois que todos terminaram de gravar
+    chegada.wait()
+    armazenamento.sincronizar()
+    final = armazenamento.conjunto.tabela()[COLUNAS_COMPARADAS].astype({'Filial': str, 'Produto': str})
+    fila.put((numero, tempos, contagem, armazenamento.conjunto.versao, final))
+
+
+def iguais(a, b):
+    # Mesmos IDs e valores; números com a tolerância de centavos (o Parquet guarda float32)
+    a, b = a.sort_values('ID').reset_index(drop=True), b.sort_values('ID').reset_index(drop=True)
+    if len(a) != len(b) or not (a['ID'].to_numpy() == b['ID'].to_numpy()).all():
+        return False
+    for coluna in ('Data', 'Produto', 'Filial'):
+        if not (a[coluna].to_numpy() == b[coluna].to_numpy()).all():
+            return False
+    for coluna in ('Vendidos', 'Quebra', 'Lucro Bruto'):
+        if not np.isclose(a[coluna].to_numpy(dtype=float), b[coluna].to_numpy(dtype=float),
+                          rtol=0, atol=0.005, equal_nan=True).all():
+            return False
+    return True
+
+
+def iguais_resumos(a, b):
+    chaves = ['Filial', 'Produto', 'Ano', 'Mes']
+    tipos = {'Filial': str, 'Produto': str, 'Ano': 'int64', 'Mes': 'int64'}
+    a = a.astype(tipos).sort_values(chaves).reset_index(drop=True)
+    b = b.astype(tipos).sort_values(chaves).reset_index(drop=True)
+    if len(a) != len(b) or not a[chaves].equals(b[chaves]):
+        return False
+    return all(np.isclose(a[c].to_numpy(dtype=float), b[c].to_numpy(dtype=float), rtol=1e-6, atol=0.05).all()
+               for c in ('Quebra', 'Vendidos', 'Lucro Bruto', 'Registros'))
+
+
+def executar(args):
+    filiais, produtos, anos = TAMANHOS[args.tamanho]
+    trabalho = tempfile.mkdtemp(prefix='carga_quebras_')
+    diretorio_original = os.getcwd()
+    os.environ[VARIAVEL_BACKEND] = args.armazenamento
+    try:
+        os.chdir(trabalho)
+        df_precos = gerar_precos(produtos, args.semente)
+        df_precos.to_csv('precos.csv', index=False)
+        armazenamento = obter_armazenamento()
+        armazenamento.inserir(gerar_historico(filiais, df_precos, anos, semente=args.semente))
+        versao_inicial = armazenamento.versao()
+
+        contexto = multiprocessing.get_context('spawn')
+        largada, chegada, fila = contexto.Event(), contexto.Barrier(args.gerentes), contexto.Queue()
+        processos = [
+            contexto.Process(target=gerente, args=(i, trabalho, args.armazenamento, filiais, args.operacoes,
+                                                   args.lote, args.semente, largada, chegada, fila))
+            for i in range(args.gerentes)
+        ]
+        for processo in processos:
+            processo.start()
+        # Todos começam juntos, depois de importar os módulos e ler os dados
+        time.sleep(1)
+        inicio = time.perf_counter()
+        largada.set()
+        resultados = [fila.get() for _ in processos]
+        duracao = time.perf_counter() - inicio
+        for processo in processos:
+            processo.join()
+
+        tempos = pd.DataFrame([t for _, lista, _, _, _ in resultados for t in lista], columns=['Operação', 'Segundos'])
+        gravacoes = sum(c['gravacoes'] for _, _, c, _, _ in resultados)
+        conflitos = sum(c['conflitos'] for _, _, c, _, _ in resultados)
+        print(f"{args.gerentes} gerentes x {args.operacoes} operações ({args.armazenamento}, {args.tamanho}) "
+              f"em {duracao:.1f}s: {gravacoes / duracao:.1f} gravações/s, {conflitos} edições recusadas por conflito")
+        tabela = tempos.groupby('Operação')['Segundos'].agg(
+            Quantidade='count',
+            Media_ms=lambda s: 1000 * s.mean(),
+            P50_ms=lambda s: 1000 * s.median(),
+            P95_ms=lambda s: 1000 * s.quantile(0.95),
+            Maximo_ms=lambda s: 1000 * s.max(),
+        )
+        print(tabela.round(1).to_string())
+
+        # Conferências: versões, registros de cada gerente e resumo mensal contra o armazenamento
+        armazenamento = obter_armazenamento()
+        completo = armazenamento.carregar()[COLUNAS_COMPARADAS]
+        conferencias = {
+            'uma versão por gravação': armazenamento.versao() - versao_inicial == gravacoes,
+            'IDs sem repetição': not completo['ID'].duplicated().any(),
+            'gerentes com os registros do armazenamento': all(iguais(final, completo) for *_, final in resultados),
+            'resumo mensal igual aos registros': iguais_resumos(armazenamento.carregar_resumo(),
+                                                                resumo_mensal.agregar(armazenamento.carregar())),
+        }
+        for nome, ok in conferencias.items():
+            print(f"{'OK   ' if ok else 'FALHA'} {nome}")
+        return 0 if all(conferencias.values()) else 1
+    finally:
+        os.chdir(diretorio_original)
+        shutil.rmtree(trabalho, ignore_errors=True)
+
+
+def argumentos():
+    parser = argparse.ArgumentParser(description="Teste de carga: vários gerentes gravando ao mesmo tempo.")
+    parser.add_argument('--gerentes', type=int, default=8)
+    parser.add_argument('--operacoes', type=int, default=100, help="operações por gerente")
+    parser.add_argument('--lote', type=int, default=5, help="produtos por registro em lote")
+    parser.add_argument('--tamanho', choices=TAMANHOS, default='pequeno', help="histórico inicial, como no benchmark.py")
+    parser.add_argument('--armazenamento', choices=['csv', 'parquet', 'sqlite'], default='csv')
+    parser.add_argument('--semente', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(executar(argumentos()))
@@ -0,0 +1,95 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from armazenamento import VARIAVEL_BACKEND, fcntl
+
+# Vários processos do Streamlit sobre o mesmo armazenamento, atrás de um proxy (nginx).
+# Cada processo tem seus caches e sua cópia dos registros em memória; as gravações
+# passam pela trava de escrita do armazenamento, e cada sessão relê só as partições
+# que os outros processos alteraram (registro de alterações).
+# Uso:
+#   python trabalhadores.py --processos 4 --porta 8501
+#   python trabalhadores.py --processos 4 --porta 8501 --nginx > quebras.conf
+
+
+def portas(args):
+    return [args.porta + i for i in range(args.processos)]
+
+
+def configuracao_nginx(portas_internas, porta_publica=80):
+    # ip_hash: o websocket de uma sessão precisa voltar sempre ao mesmo processo
+    servidores = '\n'.join(f"    server 127.0.0.1:{porta};" for porta in portas_internas)
+    return f"""upstream controle_quebras {{
+    ip_hash;
+{servidores}
+}}
+
+server {{
+    listen {porta_publica};
+    client_max_body_size 200m;
+
+    location / {{
+        proxy_pass http://controle_quebras;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection "upgrade";
+        proxy_set_header Host $host;
+        proxy_read_timeout 86400;
+    }}
+}}
+"""
+
+
+def iniciar(porta, endereco):
+    return subprocess.Popen([
+        sys.executable, '-m', 'streamlit', 'run', 'controle.py',
+        '--server.port', str(porta),
+        '--server.address', endereco,
+        '--server.headless', 'true',
+    ])
+
+
+def main(args):
+    if args.nginx:
+        print(configuracao_nginx(portas(args), args.porta_publica), end='')
+        return 0
+    if fcntl is None and os.environ.get(VARIAVEL_BACKEND, 'csv').lower() != 'sqlite':
+        print("Sem trava de arquivos entre processos neste sistema: use um único processo "
+              f"ou {VARIAVEL_BACKEND}=sqlite.", file=sys.stderr)
+        return 1
+
+    processos = {porta: iniciar(porta, args.endereco) for porta in portas(args)}
+    print(f"{len(processos)} processos nas portas {', '.join(map(str, processos))}")
+    try:
+        # Se um processo cair, é reiniciado; Ctrl+C encerra todos
+        while True:
+            time.sleep(2)
+            for porta, processo in processos.items():
+                if processo.poll() is not None:
+                    print(f"Processo da porta {porta} saiu com código {processo.returncode}; reiniciando")
+                    processos[porta] = iniciar(porta, args.endereco)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for processo in processos.values():
+            processo.terminate()
+        for processo in processos.values():
+            processo.wait()
+    return 0
+
+
+def argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Sobe vários processos do app sobre o mesmo armazenamento.")
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--porta', type=int, default=8501, help="porta do primeiro processo; os outros usam as seguintes")
+    parser.add_argument('--endereco', default='127.0.0.1', help="endereço dos processos (padrão: só o proxy local os acessa)")
+    parser.add_argument('--nginx', action='store_true', help="só imprime a configuração do nginx para os processos")
+    parser.add_argument('--porta-publica', type=int, default=80, help="porta do nginx em --nginx")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main(argumentos()))